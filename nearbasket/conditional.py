@@ -0,0 +1,25 @@
+import hashlib
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+
+def make_etag(*parts):
+    """Strong ETag from the values a response depends on"""
+    digest = hashlib.sha256('\x1f'.join(str(part) for part in parts).encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def not_modified(request, etag):
+    """Return a 304 response when the client's If-None-Match already holds ``etag``, else None"""
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return None
+
+    etags = parse_etags(header)
+    if '*' not in etags and etag not in [value.removeprefix('W/') for value in etags]:
+        return None
+
+    response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    response['ETag'] = etag
+    return response
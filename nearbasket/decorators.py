@@ -0,0 +1,37 @@
+import functools
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised when a view runs more queries than it declared"""
+
+
+def query_budget(limit):
+    """
+    Declare the most queries a view may run.
+
+    When ``QUERY_BUDGET_ENFORCED`` is on (debug and test runs), going over
+    the budget raises ``QueryBudgetExceeded`` listing the executed SQL so a
+    regression fails loudly. Otherwise the decorator is free.
+    Apply it below ``@api_view`` so authentication is not counted.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not getattr(settings, 'QUERY_BUDGET_ENFORCED', False):
+                return view(request, *args, **kwargs)
+
+            with CaptureQueriesContext(connection) as queries:
+                response = view(request, *args, **kwargs)
+            if len(queries) > limit:
+                raise QueryBudgetExceeded(
+                    f"{view.__name__} ran {len(queries)} queries, budget is {limit}:\n"
+                    + "\n".join(query['sql'] for query in queries.captured_queries)
+                )
+            return response
+
+        wrapper.query_budget = limit
+        return wrapper
+    return decorator
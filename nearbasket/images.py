@@ -0,0 +1,171 @@
+import io
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Longest edge in pixels of each generated variant; every variant is written in each format
+VARIANTS = {
+    'thumbnail': 200,
+    'detail': 800,
+}
+FORMATS = {
+    'webp': 'WEBP',
+    'jpeg': 'JPEG',
+}
+QUALITY = 80
+
+ALLOWED_FORMATS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp', 'GIF': 'gif'}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class InvalidImage(Exception):
+    """Raised when an upload is not an image we accept"""
+
+
+def render_variants(data):
+    """
+    Resize the original image bytes into every variant and format.
+
+    Runs in a worker process, so it only uses Pillow and returns
+    ``{variant: {format: bytes}}`` for the caller to store.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        # Phone photos are often stored sideways with an EXIF rotation
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            transparent = 'A' in image.getbands() or 'transparency' in image.info
+            image = image.convert('RGBA' if transparent else 'RGB')
+
+        rendered = {}
+        for variant, edge in VARIANTS.items():
+            resized = image.copy()
+            resized.thumbnail((edge, edge), Image.Resampling.LANCZOS)
+            rendered[variant] = {}
+            for extension, image_format in FORMATS.items():
+                output = resized
+                if image_format == 'JPEG' and output.mode != 'RGB':
+                    # JPEG has no alpha channel: flatten onto white
+                    output = Image.new('RGB', resized.size, 'white')
+                    output.paste(resized, mask=resized.getchannel('A'))
+                buffer = io.BytesIO()
+                output.save(buffer, image_format, quality=QUALITY, optimize=True)
+                rendered[variant][extension] = buffer.getvalue()
+        return rendered
+
+
+def validate_image(upload):
+    """Check an uploaded file is a supported image within the size limit; returns its file extension"""
+    if upload.size > settings.IMAGE_UPLOAD_MAX_BYTES:
+        raise InvalidImage(f'Images must be smaller than {settings.IMAGE_UPLOAD_MAX_BYTES / (1024 * 1024):g} MB')
+    try:
+        with Image.open(upload) as image:
+            image_format = image.format
+            image.verify()
+    except (Image.DecompressionBombError, OSError, SyntaxError, ValueError):
+        raise InvalidImage('Upload a valid JPEG, PNG, WebP or GIF image')
+    finally:
+        upload.seek(0)
+    if image_format not in ALLOWED_FORMATS:
+        raise InvalidImage('Upload a valid JPEG, PNG, WebP or GIF image')
+    return ALLOWED_FORMATS[image_format]
+
+
+def store_original(upload, prefix):
+    """Validate and save an uploaded image through the default storage; returns ``{'original': name}``"""
+    extension = validate_image(upload)
+    name = default_storage.save(f'{prefix}/{uuid.uuid4().hex}.{extension}', upload)
+    return {'original': name}
+
+
+def image_names(files):
+    """Every storage name in an image files dict"""
+    names = []
+    for value in (files or {}).values():
+        if isinstance(value, dict):
+            names += value.values()
+        elif value:
+            names.append(value)
+    return names
+
+
+def delete_images(files):
+    for name in image_names(files):
+        try:
+            default_storage.delete(name)
+        except OSError:
+            logger.warning('Could not delete image %s', name, exc_info=True)
+
+
+def save_variants(original, rendered):
+    """Store rendered variants next to the original; returns the complete image files dict"""
+    base = os.path.splitext(original)[0]
+    files = {'original': original}
+    for variant, formats in rendered.items():
+        files[variant] = {
+            extension: default_storage.save(f'{base}_{variant}.{extension}', ContentFile(data))
+            for extension, data in formats.items()
+        }
+    return files
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Spawned workers start clean instead of inheriting the web worker's threads and sockets
+            _executor = ProcessPoolExecutor(max_workers=settings.IMAGE_WORKERS, mp_context=get_context('spawn'))
+        return _executor
+
+
+def generate_variants(files, on_ready, inline=False):
+    """
+    Render the variants of ``files['original']`` in the image process pool,
+    off the request thread.
+
+    Once stored, ``on_ready(files)`` is called with the complete files dict
+    from a pool thread and must return whether it kept them; variants it
+    rejects (the image was replaced meanwhile) are deleted. With ``inline``
+    or ``IMAGE_WORKERS = 0`` everything runs on the calling thread instead.
+    """
+    original = files['original']
+    with default_storage.open(original, 'rb') as source:
+        data = source.read()
+
+    def finish(rendered):
+        variants = save_variants(original, rendered)
+        if not on_ready(variants):
+            delete_images({key: value for key, value in variants.items() if key != 'original'})
+
+    if inline or not settings.IMAGE_WORKERS:
+        finish(render_variants(data))
+        return
+
+    def done(future):
+        global _executor
+        try:
+            finish(future.result())
+        except BrokenProcessPool:
+            logger.exception('Image worker died rendering %s', original)
+            # A crashed worker leaves the pool unusable; start a fresh one for the next upload
+            with _executor_lock:
+                _executor = None
+        except Exception:
+            logger.exception('Could not generate variants for %s', original)
+        finally:
+            # The callback runs on the pool's own thread, which would otherwise keep its connection open
+            connections.close_all()
+
+    get_executor().submit(render_variants, data).add_done_callback(done)
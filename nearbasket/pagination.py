@@ -0,0 +1,221 @@
+import base64
+import json
+from collections import OrderedDict
+from django.conf import settings
+from django.db.models import Q
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class CursorExpired(APIException):
+    status_code = status.HTTP_410_GONE
+    default_detail = 'This sync cursor has expired, sync again from the start'
+    default_code = 'cursor_expired'
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination over a unique, lexicographic ordering.
+
+    The cursor is the ordering key of the last row on the page, and the
+    next page is selected with ``WHERE (a, b) < (last_a, last_b)`` so page N
+    costs the same as page 1. No COUNT(*) is ever issued. ``ordering`` may
+    be overridden per instance and may name annotations as well as fields;
+    it must end in a unique field.
+    """
+    ordering = ('-created_at', '-id')
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def __init__(self, ordering=None):
+        if ordering is not None:
+            self.ordering = tuple(ordering)
+
+    @classmethod
+    def ordering_fields(cls, ordering=None):
+        return [name.lstrip('-') for name in ordering or cls.ordering]
+
+    @staticmethod
+    def resolve_field(queryset, name):
+        annotation = queryset.query.annotations.get(name)
+        if annotation is not None:
+            return annotation.output_field
+        return queryset.model._meta.get_field(name)
+
+    def get_page_size(self, request):
+        page_size = settings.REST_FRAMEWORK.get('PAGE_SIZE', 20)
+        try:
+            requested = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return page_size
+        return max(1, min(requested, self.max_page_size))
+
+    @staticmethod
+    def pack(values):
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    @staticmethod
+    def unpack(cursor):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if not isinstance(values, list):
+                raise ValueError
+            return values
+        except Exception:
+            raise NotFound('Invalid cursor')
+
+    def encode_cursor(self, row):
+        return self.pack([
+            str(getattr(row, name))
+            for name in self.ordering_fields(self.ordering)
+        ])
+
+    def decode_cursor(self, cursor):
+        return self.parse_position(self.unpack(cursor))
+
+    def parse_position(self, values):
+        try:
+            if len(values) != len(self.fields):
+                raise ValueError
+            return [field.to_python(value) for field, value in zip(self.fields, values)]
+        except Exception:
+            raise NotFound('Invalid cursor')
+
+    def after(self, values):
+        """Build the lexicographic ``(a, b, ...) past (values)`` filter"""
+        condition = Q()
+        for index in reversed(range(len(self.ordering))):
+            name = self.ordering[index].lstrip('-')
+            lookup = 'lt' if self.ordering[index].startswith('-') else 'gt'
+            strict = Q(**{f'{name}__{lookup}': values[index]})
+            condition = strict if index == len(self.ordering) - 1 else strict | (
+                Q(**{name: values[index]}) & condition
+            )
+        return condition
+
+    def window(self, queryset, request, page_size):
+        queryset = queryset.order_by(*self.ordering)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            queryset = queryset.filter(self.after(self.decode_cursor(cursor)))
+        return list(queryset[:page_size + 1])
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.paginate_querysets([queryset], request, view)
+
+    def paginate_querysets(self, querysets, request, view=None):
+        """
+        Paginate several querysets as one listing. The models must share the
+        ordering fields and a primary key space; a row found in more than one
+        queryset is returned once, from the first queryset that has it.
+        """
+        self.request = request
+        self.fields = [
+            self.resolve_field(querysets[0], name)
+            for name in self.ordering_fields(self.ordering)
+        ]
+        page_size = self.get_page_size(request)
+
+        rows, seen = [], set()
+        for queryset in querysets:
+            for row in self.window(queryset, request, page_size):
+                if row.pk not in seen:
+                    seen.add(row.pk)
+                    rows.append(row)
+        if len(querysets) > 1:
+            for name in reversed(self.ordering):
+                rows.sort(key=lambda row: getattr(row, name.lstrip('-')), reverse=name.startswith('-'))
+
+        self.has_next = len(rows) > page_size
+        self.page = rows[:page_size]
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class SyncPagination(KeysetPagination):
+    """
+    Oldest-first change feed over ``updated_at``.
+
+    The response always carries a ``cursor`` to resume from, even on the
+    last page, so a client can store it and ask for what changed since.
+    Besides its position, a cursor records since when the client has been
+    following the feed: the ``settled`` time its sync started at, or for
+    the cursor of a last page, the ``settled`` time it is now up to date
+    with. Cursors followed since before ``horizon`` are refused with 410,
+    since the records of deletes they would need may have been purged.
+    How old the rows at the position are does not matter, so cursors of a
+    quiet catalogue do not expire.
+    """
+    ordering = ('updated_at', 'id')
+
+    def __init__(self, ordering=None, horizon=None, settled=None):
+        super().__init__(ordering)
+        self.horizon = horizon
+        self.settled = settled
+        self.since = settled
+        self.position = None
+
+    def encode_cursor(self, row):
+        values = [str(getattr(row, name)) for name in self.ordering_fields(self.ordering)]
+        return self.pack(values + [str(self.since)])
+
+    def decode_cursor(self, cursor):
+        values = self.unpack(cursor)
+        # Cursors issued before the start of a sync was recorded count from their position
+        since = values.pop() if len(values) == len(self.fields) + 1 else None
+        position = self.parse_position(values)
+        try:
+            self.since = position[0] if since is None else self.fields[0].to_python(since)
+        except Exception:
+            raise NotFound('Invalid cursor')
+        if self.horizon is not None and self.since < self.horizon:
+            raise CursorExpired()
+        self.position = values
+        return position
+
+    def get_cursor(self):
+        if not self.has_next and self.settled is not None:
+            # Every change up to settled has now been seen
+            self.since = self.settled
+        if self.page:
+            return self.encode_cursor(self.page[-1])
+        if self.position is not None:
+            return self.pack(self.position + [str(self.since)])
+        return None
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('cursor', self.get_cursor()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema['properties']['cursor'] = {'type': 'string', 'nullable': True}
+        return response_schema
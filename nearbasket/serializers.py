@@ -0,0 +1,213 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.core.files.storage import default_storage
+from django.db.models import Prefetch
+from rest_framework import serializers
+
+
+def _unique(items):
+    return list(dict.fromkeys(items))
+
+
+def _all_columns(model, prefix=''):
+    return [prefix + field.name for field in model._meta.concrete_fields]
+
+
+def _split_paths(values):
+    """Turn ``['id', 'shop.name', 'shop.owner_name']`` into ``{'id': [], 'shop': ['name', 'owner_name']}``"""
+    tree = {}
+    for value in values:
+        head, _, rest = value.strip().partition('.')
+        if not head:
+            continue
+        tree.setdefault(head, [])
+        if rest:
+            tree[head].append(rest)
+    return tree
+
+
+def load_plan(serializer, prefix=''):
+    """
+    Work out what a serializer will read so rendering it never touches the
+    database again.
+
+    Returns ``(select, prefetch, only)``: nested serializers become
+    select_related joins (or a Prefetch when ``many=True``), dotted sources
+    such as ``product.name`` select their relation, ``related_fields`` lists
+    relations that method fields use, and ``only`` names just the columns
+    the rendered fields need.
+    """
+    model = serializer.Meta.model
+    select, prefetch = [], []
+    only = [prefix + model._meta.pk.name]
+
+    for path in getattr(serializer, 'related_fields', []):
+        related = model
+        for attr in path.split('__'):
+            related = related._meta.get_field(attr).related_model
+        select.append(prefix + path)
+        only += _all_columns(related, prefix + path + '__')
+
+    for field in serializer.fields.values():
+        if field.write_only:
+            continue
+        if field.source == '*':
+            only += _all_columns(model, prefix)
+            continue
+
+        if isinstance(field, (serializers.ListSerializer, serializers.ManyRelatedField)):
+            relation = model._meta.get_field(field.source)
+            if isinstance(field, serializers.ListSerializer):
+                child_select, child_prefetch, child_only = load_plan(field.child)
+            else:
+                child_select, child_prefetch, child_only = [], [], [relation.related_model._meta.pk.name]
+            if relation.one_to_many:
+                child_only.append(relation.field.name)
+            queryset = relation.related_model._default_manager.only(*_unique(child_only))
+            if child_select:
+                queryset = queryset.select_related(*child_select)
+            if child_prefetch:
+                queryset = queryset.prefetch_related(*child_prefetch)
+            prefetch.append(Prefetch(prefix + field.source, queryset=queryset))
+        elif isinstance(field, serializers.ModelSerializer):
+            path = prefix + field.source
+            nested_select, nested_prefetch, nested_only = load_plan(field, path + '__')
+            select += [path] + nested_select
+            prefetch += nested_prefetch
+            only += [path] + nested_only
+        else:
+            current, path = model, []
+            for attr in field.source_attrs[:-1]:
+                try:
+                    relation = current._meta.get_field(attr)
+                except FieldDoesNotExist:
+                    break
+                if not relation.is_relation or relation.one_to_many or relation.many_to_many:
+                    break
+                path.append(attr)
+                only.append(prefix + '__'.join(path))
+                current = relation.related_model
+            if path:
+                select.append(prefix + '__'.join(path))
+
+            try:
+                current._meta.get_field(field.source_attrs[len(path)])
+                only.append(prefix + '__'.join(field.source_attrs[:len(path) + 1]))
+            except FieldDoesNotExist:
+                # Properties and other computed attributes may read anything
+                only += _all_columns(current, prefix + ''.join(attr + '__' for attr in path))
+
+    return _unique(select), prefetch, _unique(only)
+
+
+class EagerLoadingMixin:
+    """Load everything a serializer renders with a fixed number of queries"""
+    related_fields = []
+
+    @classmethod
+    def setup_eager_loading(cls, queryset, context=None, required=()):
+        """
+        Apply the serializer's load plan to ``queryset``.
+
+        ``context`` carries the request so sparse fieldsets shrink the plan,
+        and ``required`` lists extra ORM paths the view itself reads.
+        """
+        select, prefetch, only = load_plan(cls(context=context or {}))
+        for path in required:
+            parts = path.split('__')
+            select += ['__'.join(parts[:index]) for index in range(1, len(parts))]
+            only += ['__'.join(parts[:index]) for index in range(1, len(parts) + 1)]
+
+        if select:
+            queryset = queryset.select_related(*_unique(select))
+        if prefetch:
+            queryset = queryset.prefetch_related(*prefetch)
+        return queryset.only(*_unique(only))
+
+
+class DynamicFieldsMixin:
+    """
+    Support sparse fieldsets and opt-in expansion of nested serializers.
+
+    ``?fields=id,name,shop.name`` renders only the listed fields, and
+    ``?expand=shop`` renders a nested serializer in full. Once either
+    parameter is given, nested serializers that are neither expanded nor
+    narrowed with dotted fields collapse to their primary key. Without
+    either parameter the full shape is rendered.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._sparse_fields = kwargs.pop('fields', None)
+        self._expand = kwargs.pop('expand', None)
+        super().__init__(*args, **kwargs)
+
+    def _is_root(self):
+        parent = self.parent
+        if isinstance(parent, serializers.ListSerializer):
+            parent = parent.parent
+        return parent is None
+
+    def get_requested_shape(self):
+        if self._sparse_fields is not None or self._expand is not None:
+            return self._sparse_fields, self._expand
+        request = self.context.get('request')
+        if request is None or not self._is_root():
+            return None, None
+
+        fields = request.query_params.get('fields')
+        expand = request.query_params.get('expand')
+        return (
+            fields.split(',') if fields else None,
+            expand.split(',') if expand else None,
+        )
+
+    def get_fields(self):
+        fields = super().get_fields()
+        requested, expand = self.get_requested_shape()
+        if requested is None and expand is None:
+            return fields
+
+        requested = _split_paths(requested) if requested is not None else {name: [] for name in fields}
+        expand = _split_paths(expand or [])
+
+        sparse = {}
+        for name, subfields in requested.items():
+            field = fields.get(name)
+            if field is None:
+                continue
+
+            many = isinstance(field, serializers.ListSerializer)
+            nested = field.child if many else field
+            if not isinstance(nested, serializers.BaseSerializer):
+                sparse[name] = field
+            elif subfields or name in expand:
+                nested._sparse_fields = subfields or None
+                nested._expand = expand.get(name) or None
+                sparse[name] = field
+            else:
+                kwargs = {'source': field.source} if field.source not in (None, name) else {}
+                sparse[name] = serializers.PrimaryKeyRelatedField(
+                    many=many, read_only=True, **kwargs
+                )
+        return sparse
+
+
+class ImageFilesField(serializers.ReadOnlyField):
+    """
+    Render an image files dict (see ``nearbasket.images``) as absolute URLs:
+    ``{'original': url, 'thumbnail': {'webp': url, 'jpeg': url}, ...}``,
+    or None when no image was uploaded.
+    """
+
+    def url(self, name):
+        url = default_storage.url(name)
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request is not None else url
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        return {
+            key: {extension: self.url(name) for extension, name in names.items()}
+            if isinstance(names, dict) else self.url(names)
+            for key, names in value.items()
+        }
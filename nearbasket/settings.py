@@ -1,4 +1,5 @@
 import os
+import sys
 from pathlib import Path
 from decouple import config
 import dj_database_url
@@ -22,6 +23,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework_simplejwt',
     'corsheaders',
@@ -84,6 +86,90 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 20,
 }
 
+# Fail views that run more queries than their @query_budget (debug and tests)
+TESTING = sys.argv[1:2] == ['test']
+QUERY_BUDGET_ENFORCED = config('QUERY_BUDGET_ENFORCED', default=DEBUG or TESTING, cast=bool)
+
+# Order event stream (server-sent events)
+ORDER_EVENT_POLL_SECONDS = config('ORDER_EVENT_POLL_SECONDS', default=2, cast=float)
+ORDER_EVENT_HEARTBEAT_SECONDS = config('ORDER_EVENT_HEARTBEAT_SECONDS', default=20, cast=float)
+ORDER_EVENT_RETRY_MS = 3000
+
+# How long an Idempotency-Key on order placement is remembered
+IDEMPOTENCY_KEY_TTL_HOURS = config('IDEMPOTENCY_KEY_TTL_HOURS', default=24, cast=int)
+
+# Minutes a placed order holds its stock while waiting for the shop to accept it
+STOCK_HOLD_MINUTES = config('STOCK_HOLD_MINUTES', default=30, cast=int)
+
+# Finished orders older than this move to the archive tables (see archive_orders)
+ORDER_ARCHIVE_AFTER_DAYS = config('ORDER_ARCHIVE_AFTER_DAYS', default=30, cast=int)
+
+# Bulk product imports: rows validated and written per batch, and the most rows one upload may hold
+PRODUCT_IMPORT_BATCH_SIZE = config('PRODUCT_IMPORT_BATCH_SIZE', default=500, cast=int)
+PRODUCT_IMPORT_MAX_ROWS = config('PRODUCT_IMPORT_MAX_ROWS', default=50000, cast=int)
+
+# Most products one stock and price sync request may change
+PRODUCT_SYNC_MAX_ITEMS = config('PRODUCT_SYNC_MAX_ITEMS', default=20000, cast=int)
+
+# Most mobile numbers and user ids one bulk add or remove of shop customers may list
+SHOP_CUSTOMER_BULK_MAX_ITEMS = config('SHOP_CUSTOMER_BULK_MAX_ITEMS', default=5000, cast=int)
+
+# Nearby shop search: widest radius a customer may search and most shops one search returns
+NEARBY_SHOPS_MAX_RADIUS_KM = config('NEARBY_SHOPS_MAX_RADIUS_KM', default=50, cast=float)
+NEARBY_SHOPS_MAX_RESULTS = config('NEARBY_SHOPS_MAX_RESULTS', default=50, cast=int)
+
+# Product delete records kept for catalogue delta sync (see purge_product_tombstones); older sync
+# cursors must resync from scratch. Changes newer than the settle delay wait for the next sync, so
+# transactions that commit out of order are never skipped
+PRODUCT_TOMBSTONE_TTL_DAYS = config('PRODUCT_TOMBSTONE_TTL_DAYS', default=30, cast=int)
+PRODUCT_CHANGES_SETTLE_SECONDS = config('PRODUCT_CHANGES_SETTLE_SECONDS', default=5, cast=int)
+
+# Image uploads: largest accepted file, and worker processes rendering thumbnails (0 renders inline)
+IMAGE_UPLOAD_MAX_BYTES = config('IMAGE_UPLOAD_MAX_BYTES', default=10 * 1024 * 1024, cast=int)
+IMAGE_WORKERS = config('IMAGE_WORKERS', default=2, cast=int)
+
+# Rendered product catalogue cache. CATALOGUE_CACHE_URL picks the backend:
+# locmem:// (per process), file:///path/to/dir, db://table_name (shared, run
+# `manage.py createcachetable` first) or redis://host:6379/0 (shared, needs the redis package)
+CATALOGUE_CACHE_URL = config('CATALOGUE_CACHE_URL', default='locmem://')
+CATALOGUE_CACHE_TTL = config('CATALOGUE_CACHE_TTL', default=3600, cast=int)
+CATALOGUE_CACHE_LOCK_SECONDS = config('CATALOGUE_CACHE_LOCK_SECONDS', default=5, cast=float)
+
+CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'db': 'django.core.cache.backends.db.DatabaseCache',
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+}
+
+# Per-user shop ownership and membership used for permission checks, same URL
+# schemes as above. Use a shared backend with several worker processes: a
+# per-process cache only drops a removed customer's access on the worker that
+# removed them, the others keep it for up to SHOP_ACCESS_CACHE_TTL seconds.
+# That is why the default TTL is only a few seconds with locmem://.
+SHOP_ACCESS_CACHE_URL = config('SHOP_ACCESS_CACHE_URL', default='locmem://')
+SHOP_ACCESS_CACHE_TTL = config(
+    'SHOP_ACCESS_CACHE_TTL', default=5 if SHOP_ACCESS_CACHE_URL.startswith('locmem://') else 300, cast=int
+)
+
+
+def _cache_from_url(url, name, timeout):
+    scheme, _, location = url.partition('://')
+    return {
+        'BACKEND': CACHE_BACKENDS[scheme],
+        'LOCATION': url if scheme == 'redis' else location or name,
+        'TIMEOUT': timeout,
+    }
+
+
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKENDS['locmem'],
+    },
+    'catalogue': _cache_from_url(CATALOGUE_CACHE_URL, 'catalogue', CATALOGUE_CACHE_TTL),
+    'shop_access': _cache_from_url(SHOP_ACCESS_CACHE_URL, 'shop_access', SHOP_ACCESS_CACHE_TTL),
+}
+
 # JWT Configuration
 from datetime import timedelta
 SIMPLE_JWT = {
@@ -130,6 +216,10 @@ STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
+# Uploaded product photos and shop logos, stored through the default file storage
+MEDIA_URL = '/media/'
+MEDIA_ROOT = config('MEDIA_ROOT', default=os.path.join(BASE_DIR, 'media'))
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -0,0 +1,61 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+from products.models import Product
+from shops.models import Shop, ShopCustomer
+from users.models import User
+
+
+@override_settings(QUERY_BUDGET_ENFORCED=True, SECURE_SSL_REDIRECT=False)
+class APITestCase(TestCase):
+    """
+    Base for API tests: query budgets are enforced, so a view that grows an
+    N+1 fails its tests, and the shared caches start empty, so ids reused
+    after a rolled back test never hit a stale entry. Requests are plain
+    HTTP, so the production HTTPS redirect is off.
+    """
+
+    def setUp(self):
+        super().setUp()
+        for alias in settings.CACHES:
+            caches[alias].clear()
+
+    @staticmethod
+    def client_for(user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    @staticmethod
+    def make_user(mobile_number, role='CUSTOMER', **fields):
+        return User.objects.create(mobile_number=mobile_number, name=fields.pop('name', mobile_number), role=role, **fields)
+
+    def make_shop(self, owner_number='9000000000', customers=1, **fields):
+        """A shop with ``customers`` joined customers, available as ``shop.test_customers``"""
+        owner = self.make_user(owner_number, role='SHOPKEEPER')
+        shop = Shop.objects.create(owner=owner, name=fields.pop('name', 'Corner Store'), address='1 Main Road', **fields)
+        shop.test_customers = []
+        for index in range(customers):
+            customer = self.make_user(f'{owner_number[:6]}1{index:03d}')
+            ShopCustomer.objects.create(shop=shop, customer=customer)
+            shop.test_customers.append(customer)
+        return shop
+
+    @staticmethod
+    def make_product(shop, name, price='10.00', stock=100, **fields):
+        return Product.objects.create(shop=shop, name=name, price=price, stock=stock, **fields)
+
+    def place_order(self, customer, shop, quantities, **headers):
+        """Place an order for ``{product: quantity}`` through the API, returning the response"""
+        return self.client_for(customer).post(
+            f'/api/orders/shops/{shop.pk}/orders/',
+            {'items': [{'product_id': product.pk, 'quantity': quantity} for product, quantity in quantities.items()]},
+            format='json',
+            **headers
+        )
+
+    def set_status(self, order_id, shop, new_status):
+        return self.client_for(shop.owner).put(
+            f'/api/orders/{order_id}/status/', {'status': new_status}, format='json'
+        )
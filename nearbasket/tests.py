@@ -0,0 +1,29 @@
+from django.test import RequestFactory, TestCase, override_settings
+from shops.models import Shop
+from .decorators import QueryBudgetExceeded, query_budget
+
+
+class QueryBudgetTests(TestCase):
+    def setUp(self):
+        self.request = RequestFactory().get('/')
+
+        @query_budget(1)
+        def view(request, queries):
+            for _ in range(queries):
+                list(Shop.objects.all())
+            return 'done'
+
+        self.view = view
+
+    @override_settings(QUERY_BUDGET_ENFORCED=True)
+    def test_within_budget(self):
+        self.assertEqual(self.view(self.request, 1), 'done')
+
+    @override_settings(QUERY_BUDGET_ENFORCED=True)
+    def test_over_budget_raises_with_the_sql(self):
+        with self.assertRaisesMessage(QueryBudgetExceeded, 'view ran 2 queries, budget is 1'):
+            self.view(self.request, 2)
+
+    @override_settings(QUERY_BUDGET_ENFORCED=False)
+    def test_not_enforced(self):
+        self.assertEqual(self.view(self.request, 2), 'done')
@@ -27,6 +27,7 @@ urlpatterns = [
     path('api/orders/', include('orders.urls')),
 ]
 
-# Serve static files during development
+# Serve static and uploaded files during development
 if settings.DEBUG:
     urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
+    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -1,5 +1,8 @@
 from django.contrib import admin
-from .models import Order, OrderItem
+from .models import (
+    ArchivedOrder, ArchivedOrderItem, DailyShopSales, IdempotencyKey, Order, OrderItem, ShopOrderStats,
+    StockHold
+)
 
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
@@ -18,4 +21,56 @@ class OrderAdmin(admin.ModelAdmin):
 class OrderItemAdmin(admin.ModelAdmin):
     list_display = ['order', 'product', 'quantity', 'price']
     list_filter = ['order__created_at']
-    search_fields = ['order__id', 'product__name']
\ No newline at end of file
+    search_fields = ['order__id', 'product__name']
+
+
+@admin.register(ShopOrderStats)
+class ShopOrderStatsAdmin(admin.ModelAdmin):
+    list_display = ['shop', 'pending_count', 'accepted_count', 'delivered_count', 'lifetime_revenue', 'updated_at']
+    search_fields = ['shop__name']
+    readonly_fields = ['updated_at']
+
+
+@admin.register(IdempotencyKey)
+class IdempotencyKeyAdmin(admin.ModelAdmin):
+    list_display = ['user', 'key', 'status_code', 'created_at', 'expires_at']
+    search_fields = ['key', 'user__mobile_number']
+    readonly_fields = ['fingerprint', 'response_body', 'created_at']
+
+
+@admin.register(StockHold)
+class StockHoldAdmin(admin.ModelAdmin):
+    list_display = ['order', 'product', 'quantity', 'expires_at']
+    search_fields = ['order__id', 'product__name']
+    # Holds are mirrored in Product.reserved, so they are only changed through orders.holds
+    readonly_fields = ['order', 'product', 'quantity', 'expires_at']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        # Deleting a hold here would leave its quantity reserved forever; expired holds are released by release_expired_holds
+        return False
+
+
+class ArchivedOrderItemInline(admin.TabularInline):
+    model = ArchivedOrderItem
+    extra = 0
+    can_delete = False
+    readonly_fields = ['id', 'product', 'quantity', 'price']
+
+
+@admin.register(ArchivedOrder)
+class ArchivedOrderAdmin(admin.ModelAdmin):
+    list_display = ['id', 'customer', 'shop', 'status', 'total_amount', 'created_at', 'archived_at']
+    list_filter = ['status', 'shop']
+    search_fields = ['customer__name', 'shop__name']
+    readonly_fields = ['total_amount', 'created_at', 'updated_at', 'archived_at']
+    inlines = [ArchivedOrderItemInline]
+
+
+@admin.register(DailyShopSales)
+class DailyShopSalesAdmin(admin.ModelAdmin):
+    list_display = ['shop', 'day', 'order_count', 'item_count', 'revenue']
+    list_filter = ['shop']
+    date_hierarchy = 'day'
@@ -1,6 +1,14 @@
 from django.apps import AppConfig
+from django.db.models.signals import pre_delete
 
 
 class OrdersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'orders'
+
+    def ready(self):
+        from .holds import release_deleted_order_holds
+        from .models import Order
+
+        # Deleting an order (admin, queryset or a cascade from its customer or shop) must not strand reserved stock
+        pre_delete.connect(release_deleted_order_holds, sender=Order, dispatch_uid='Order_release_holds')
@@ -0,0 +1,53 @@
+from django.db import transaction
+from .models import ArchivedOrder, ArchivedOrderItem, Order, OrderItem
+
+FINISHED_STATUSES = ['DELIVERED', 'REJECTED']
+
+
+def archive_orders(before, batch_size=1000):
+    """
+    Move finished orders last updated before ``before`` into the archive
+    tables, yielding the number moved per chunk.
+
+    Each chunk is copied and deleted in its own transaction, so the job can
+    be stopped at any point and simply run again. Archived rows keep their
+    ids, which is what lets history listings merge both tables.
+    """
+    while True:
+        with transaction.atomic():
+            orders = list(
+                Order.objects.select_for_update()
+                .filter(status__in=FINISHED_STATUSES, updated_at__lt=before)
+                .order_by('id')[:batch_size]
+            )
+            if not orders:
+                return
+            ids = [order.id for order in orders]
+            items = OrderItem.objects.filter(order_id__in=ids)
+            
+            ArchivedOrder.objects.bulk_create([
+                ArchivedOrder(
+                    id=order.id,
+                    customer_id=order.customer_id,
+                    shop_id=order.shop_id,
+                    status=order.status,
+                    total_amount=order.total_amount,
+                    created_at=order.created_at,
+                    updated_at=order.updated_at,
+                )
+                for order in orders
+            ], ignore_conflicts=True)
+            ArchivedOrderItem.objects.bulk_create([
+                ArchivedOrderItem(
+                    id=item.id,
+                    order_id=item.order_id,
+                    product_id=item.product_id,
+                    quantity=item.quantity,
+                    price=item.price,
+                )
+                for item in items
+            ], ignore_conflicts=True)
+            
+            items.delete()
+            Order.objects.filter(id__in=ids).delete()
+        yield len(orders)
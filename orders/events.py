@@ -0,0 +1,111 @@
+import asyncio
+import json
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Max
+from .models import OrderEvent
+
+
+class OrderEventBus:
+    """
+    Wakes event streams waiting on a shop when new order events commit.
+
+    Writers in this process notify the bus directly from ``on_commit``.
+    Events committed by other worker processes are picked up by a single
+    poller per process that checks the event table while anyone is
+    subscribed, so an idle stream costs one ``asyncio.Event`` and no
+    queries of its own.
+    """
+
+    def __init__(self):
+        self._waiters = {}
+        self._loop = None
+        self._poller = None
+        self._last_id = None
+
+    def subscribe(self, shop_id):
+        self._loop = asyncio.get_running_loop()
+        wake = asyncio.Event()
+        self._waiters.setdefault(shop_id, set()).add(wake)
+        if self._poller is None or self._poller.done():
+            self._poller = self._loop.create_task(self._poll())
+        return wake
+
+    def unsubscribe(self, shop_id, wake):
+        waiters = self._waiters.get(shop_id)
+        if waiters is not None:
+            waiters.discard(wake)
+            if not waiters:
+                del self._waiters[shop_id]
+
+    def notify(self, *shop_ids):
+        """Wake streams for ``shop_ids``; safe to call from any thread"""
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            loop.call_soon_threadsafe(self._wake, shop_ids)
+        except RuntimeError:
+            pass
+
+    def _wake(self, shop_ids):
+        for shop_id in shop_ids:
+            for wake in self._waiters.get(shop_id, ()):
+                wake.set()
+
+    async def _poll(self):
+        if self._last_id is None:
+            self._last_id = await sync_to_async(latest_event_id)()
+        while self._waiters:
+            await asyncio.sleep(settings.ORDER_EVENT_POLL_SECONDS)
+            rows = await sync_to_async(list)(
+                OrderEvent.objects.filter(id__gt=self._last_id)
+                .values('shop_id').annotate(last_id=Max('id')).order_by()
+            )
+            if rows:
+                self._last_id = max(row['last_id'] for row in rows)
+                self._wake([row['shop_id'] for row in rows])
+
+
+bus = OrderEventBus()
+
+
+def latest_event_id(shop_id=None):
+    events = OrderEvent.objects.all()
+    if shop_id is not None:
+        events = events.filter(shop_id=shop_id)
+    return events.aggregate(last_id=Max('id'))['last_id'] or 0
+
+
+def events_after(shop_id, last_id, limit=100):
+    return list(OrderEvent.objects.filter(shop_id=shop_id, id__gt=last_id).order_by('id')[:limit])
+
+
+def format_event(event):
+    payload = json.dumps(event.as_payload())
+    return f"id: {event.id}\nevent: {event.type}\ndata: {payload}\n\n"
+
+
+async def stream_events(shop_id, last_id=None, batch_size=100):
+    """Yield server-sent events for ``shop_id`` after ``last_id``, forever"""
+    wake = bus.subscribe(shop_id)
+    try:
+        if last_id is None:
+            last_id = await sync_to_async(latest_event_id)(shop_id)
+        yield f"retry: {settings.ORDER_EVENT_RETRY_MS}\n\n"
+
+        while True:
+            wake.clear()
+            events = await sync_to_async(events_after)(shop_id, last_id, batch_size)
+            for event in events:
+                last_id = event.id
+                yield format_event(event)
+            if len(events) == batch_size:
+                continue
+
+            try:
+                await asyncio.wait_for(wake.wait(), timeout=settings.ORDER_EVENT_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+    finally:
+        bus.unsubscribe(shop_id, wake)
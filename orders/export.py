@@ -0,0 +1,99 @@
+import csv
+import heapq
+import json
+from itertools import groupby, islice
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+CHUNK_SIZE = 2000
+
+# One row per order item, with its order, customer and product joined in
+ROW_FIELDS = {
+    'order_id': 'order_id',
+    'created_at': 'order__created_at',
+    'status': 'order__status',
+    'customer_id': 'order__customer_id',
+    'customer_name': 'order__customer__name',
+    'customer_mobile': 'order__customer__mobile_number',
+    'order_total': 'order__total_amount',
+    'product_id': 'product_id',
+    'product_name': 'product__name',
+    'quantity': 'quantity',
+    'price': 'price',
+}
+
+CSV_COLUMNS = list(ROW_FIELDS) + ['line_total']
+
+
+def item_rows(*querysets):
+    """
+    Stream order item rows from one or more OrderItem-like querysets,
+    oldest order first. Each queryset is read with a server-side cursor in
+    chunks and the streams are merged, so memory stays flat.
+    """
+    ordering = ['order__created_at', 'order_id', 'id']
+    streams = [
+        queryset.order_by(*ordering).values_list(*ROW_FIELDS.values(), 'id').iterator(chunk_size=CHUNK_SIZE)
+        for queryset in querysets
+    ]
+    for row in heapq.merge(*streams, key=lambda row: (row[1], row[0], row[-1])):
+        yield dict(zip(ROW_FIELDS, row))
+
+
+class _Echo:
+    """File-like object that hands back what csv.writer writes"""
+
+    def write(self, value):
+        return value
+
+
+def csv_stream(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CSV_COLUMNS)
+    for row in rows:
+        row['created_at'] = timezone.localtime(row['created_at']).isoformat()
+        row['line_total'] = row['quantity'] * row['price']
+        yield writer.writerow([row[column] for column in CSV_COLUMNS])
+
+
+def ndjson_stream(rows):
+    """One JSON object per order, with its items nested"""
+    for order_id, items in groupby(rows, key=lambda row: row['order_id']):
+        items = list(items)
+        first = items[0]
+        order = {
+            'order_id': order_id,
+            'created_at': timezone.localtime(first['created_at']),
+            'status': first['status'],
+            'customer': {
+                'id': first['customer_id'],
+                'name': first['customer_name'],
+                'mobile_number': first['customer_mobile'],
+            },
+            'total_amount': first['order_total'],
+            'items': [
+                {
+                    'product_id': item['product_id'],
+                    'product_name': item['product_name'],
+                    'quantity': item['quantity'],
+                    'price': item['price'],
+                }
+                for item in items
+            ],
+        }
+        yield json.dumps(order, cls=DjangoJSONEncoder) + '\n'
+
+
+async def stream_async(pieces, batch_size=None):
+    """
+    Serve the sync stream ``pieces`` to an ASGI server, which would
+    otherwise read a sync streaming response to the end before sending its
+    first byte. Pieces are pulled ``batch_size`` (default ``CHUNK_SIZE``)
+    at a time in Django's sync thread, where the cursor behind them lives,
+    and each batch is sent as one chunk.
+    """
+    pieces = iter(pieces)
+    next_batch = sync_to_async(lambda: ''.join(islice(pieces, batch_size or CHUNK_SIZE)), thread_sensitive=True)
+    while chunk := await next_batch():
+        yield chunk
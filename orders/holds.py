@@ -0,0 +1,90 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from products.stock import release_reserved_stock, reserve_stock
+from .models import StockHold
+
+
+def hold_stock(order, quantities):
+    """
+    Reserve ``{product_id: quantity}`` for a new pending order for
+    ``STOCK_HOLD_MINUTES``. Raises ``InsufficientStock`` if any product no
+    longer has that much available, in which case nothing is held.
+
+    Call inside the transaction that creates the order.
+    """
+    reserve_stock(quantities)
+    expires_at = timezone.now() + timedelta(minutes=settings.STOCK_HOLD_MINUTES)
+    StockHold.objects.bulk_create([
+        StockHold(order=order, product_id=product_id, quantity=quantity, expires_at=expires_at)
+        for product_id, quantity in quantities.items()
+    ])
+
+
+def held_stock(order_ids):
+    """
+    Lock the holds of ``order_ids`` and return
+    ``{order_id: {product_id: quantity}}`` of what they hold. Locked holds
+    are left alone by the sweeper until the transaction ends.
+    """
+    held = {}
+    for order_id, product_id, quantity in StockHold.objects.select_for_update().filter(
+        order_id__in=list(order_ids)
+    ).values_list('order_id', 'product_id', 'quantity'):
+        lines = held.setdefault(order_id, {})
+        lines[product_id] = lines.get(product_id, 0) + quantity
+    return held
+
+
+def take_holds(order_ids):
+    """
+    Lock and delete the holds of ``order_ids``, returning what they held
+    like ``held_stock``.
+
+    The caller must give the quantities back to ``Product.reserved`` in the
+    same transaction: ``decrement_stock(..., held=...)`` for an accepted
+    order, ``release_reserved_stock`` otherwise. Holds are locked first, so
+    a hold the sweeper is releasing concurrently is never released twice.
+    """
+    held = held_stock(order_ids) if order_ids else {}
+    if held:
+        StockHold.objects.filter(order_id__in=list(held)).delete()
+    return held
+
+
+def release_deleted_order_holds(sender, instance, **kwargs):
+    """
+    Give the stock a deleted pending order holds back to ``Product.reserved``
+    before its holds are deleted with it, however the order is deleted.
+    Only pending orders hold stock, so archiving finished orders costs no
+    extra queries.
+    """
+    if instance.status != 'PENDING':
+        return
+    release_reserved_stock(take_holds([instance.pk]).get(instance.pk, {}))
+
+
+def release_expired_holds(now=None, batch_size=1000):
+    """
+    Release holds that expired before ``now``, yielding the number released
+    per chunk. Each chunk is its own transaction and skips holds another
+    transaction is busy with, so the sweeper never blocks checkouts.
+    """
+    now = now or timezone.now()
+    while True:
+        with transaction.atomic():
+            holds = list(
+                StockHold.objects.select_for_update(skip_locked=True)
+                .filter(expires_at__lte=now)
+                .order_by('expires_at')
+                .values_list('id', 'product_id', 'quantity')[:batch_size]
+            )
+            if not holds:
+                return
+            StockHold.objects.filter(id__in=[hold[0] for hold in holds]).delete()
+            released = {}
+            for _, product_id, quantity in holds:
+                released[product_id] = released.get(product_id, 0) + quantity
+            release_reserved_stock(released)
+        yield len(holds)
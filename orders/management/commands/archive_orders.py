@@ -0,0 +1,23 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from orders.archive import archive_orders
+
+
+class Command(BaseCommand):
+    help = 'Move finished orders older than the archive window into the archive tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.ORDER_ARCHIVE_AFTER_DAYS,
+                            help='Archive orders finished more than this many days ago')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        moved = 0
+        for count in archive_orders(cutoff, batch_size=options['batch_size']):
+            moved += count
+            self.stdout.write(f'Archived {moved} orders so far')
+
+        self.stdout.write(self.style.SUCCESS(f'Archived {moved} orders'))
@@ -0,0 +1,24 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from orders.models import OrderEvent
+
+
+class Command(BaseCommand):
+    help = 'Delete order stream events older than the retention window'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7, help='Keep events newer than this many days')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        deleted = 0
+        while True:
+            ids = list(OrderEvent.objects.filter(created_at__lt=cutoff)
+                       .order_by('id').values_list('id', flat=True)[:options['batch_size']])
+            if not ids:
+                break
+            deleted += OrderEvent.objects.filter(id__in=ids).delete()[0]
+
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} order events'))
@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+from orders.models import ArchivedOrder, Order, ShopOrderStats
+from shops.models import Shop
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the per-shop order counters from live and archived orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shop', type=int, action='append', dest='shops',
+                            help='Only rebuild this shop id (repeatable)')
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        open_orders = Q(status__in=ShopOrderStats.OPEN_STATUSES)
+        delivered = Q(status='DELIVERED')
+        delivered_today = delivered & Q(updated_at__date=today)
+
+        empty = {field: 0 for field in [
+            'pending_count', 'accepted_count', 'rejected_count', 'delivered_count',
+            'open_order_value', 'lifetime_revenue', 'delivered_today', 'today_revenue',
+        ]}
+
+        shops = Shop.objects.all()
+        if options['shops']:
+            shops = shops.filter(pk__in=options['shops'])
+
+        totals = {}
+        for model in [Order, ArchivedOrder]:
+            rows = model.objects.values('shop_id').annotate(
+                pending_count=Count('id', filter=Q(status='PENDING')),
+                accepted_count=Count('id', filter=Q(status='ACCEPTED')),
+                rejected_count=Count('id', filter=Q(status='REJECTED')),
+                delivered_count=Count('id', filter=delivered),
+                open_order_value=Sum('total_amount', filter=open_orders, default=0),
+                lifetime_revenue=Sum('total_amount', filter=delivered, default=0),
+                delivered_today=Count('id', filter=delivered_today),
+                today_revenue=Sum('total_amount', filter=delivered_today, default=0),
+            ).order_by()
+            if options['shops']:
+                rows = rows.filter(shop_id__in=options['shops'])
+            for row in rows:
+                total = totals.setdefault(row.pop('shop_id'), dict(empty))
+                for field, value in row.items():
+                    total[field] += value
+        rows = [
+            ShopOrderStats(shop_id=shop_id, stats_date=today, **totals.get(shop_id, empty))
+            for shop_id in shops.values_list('id', flat=True)
+        ]
+
+        with transaction.atomic():
+            stale = ShopOrderStats.objects.all()
+            if options['shops']:
+                stale = stale.filter(shop_id__in=options['shops'])
+            stale.delete()
+            ShopOrderStats.objects.bulk_create(rows, batch_size=500)
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt order stats for {len(rows)} shops'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from orders.rollups import refresh_sales_rollups
+
+
+class Command(BaseCommand):
+    help = 'Fold orders changed since the last run into the daily sales rollups'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Rebuild every rollup from scratch')
+
+    def handle(self, *args, **options):
+        written = refresh_sales_rollups(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(f'Refreshed {written} shop-day sales rollups'))
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.5 on 2026-10-17 20:35
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0002_initial'),
+        ('shops', '0003_alter_shop_unique_together_alter_shop_owner'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['shop', 'created_at', 'id'], name='order_shop_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['customer', 'created_at', 'id'], name='order_customer_created_idx'),
+        ),
+    ]
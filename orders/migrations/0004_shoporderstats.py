@@ -0,0 +1,32 @@
+# Generated by Django 5.2.5 on 2026-10-17 20:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0003_order_list_indexes'),
+        ('shops', '0003_alter_shop_unique_together_alter_shop_owner'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShopOrderStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pending_count', models.PositiveIntegerField(default=0)),
+                ('accepted_count', models.PositiveIntegerField(default=0)),
+                ('rejected_count', models.PositiveIntegerField(default=0)),
+                ('delivered_count', models.PositiveIntegerField(default=0)),
+                ('open_order_value', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('lifetime_revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('stats_date', models.DateField(blank=True, null=True)),
+                ('delivered_today', models.PositiveIntegerField(default=0)),
+                ('today_revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('shop', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='order_stats', to='shops.shop')),
+            ],
+        ),
+    ]
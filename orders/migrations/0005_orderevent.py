@@ -0,0 +1,30 @@
+# Generated by Django 5.2.5 on 2026-10-17 20:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0004_shoporderstats'),
+        ('shops', '0003_alter_shop_unique_together_alter_shop_owner'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order_id', models.BigIntegerField()),
+                ('type', models.CharField(choices=[('order_created', 'Order created'), ('status_changed', 'Status changed')], max_length=20)),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('ACCEPTED', 'Accepted'), ('REJECTED', 'Rejected'), ('DELIVERED', 'Delivered')], max_length=20)),
+                ('total_amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_events', to='shops.shop')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['shop', 'id'], name='order_event_shop_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.5 on 2026-10-17 20:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0007_archivedorder'),
+        ('products', '0002_initial'),
+        ('shops', '0003_alter_shop_unique_together_alter_shop_owner'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesRollupState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('high_water_mark', models.DateTimeField(blank=True, null=True)),
+                ('refreshed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyProductSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('quantity', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='products.product')),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_product_sales', to='shops.shop')),
+            ],
+            options={
+                'unique_together': {('shop', 'day', 'product')},
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyShopSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('order_count', models.PositiveIntegerField(default=0)),
+                ('item_count', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='shops.shop')),
+            ],
+            options={
+                'unique_together': {('shop', 'day')},
+            },
+        ),
+    ]
@@ -1,6 +1,14 @@
+import hashlib
+import json
+from datetime import timedelta
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from django.core.exceptions import ValidationError
-from django.db import transaction
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
 from users.models import User
 from shops.models import Shop, ShopCustomer
 from products.models import Product
@@ -20,13 +28,19 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['shop', 'created_at', 'id'], name='order_shop_created_idx'),
+            models.Index(fields=['customer', 'created_at', 'id'], name='order_customer_created_idx'),
+        ]
+    
     def clean(self):
         super().clean()
         if self.customer and self.customer.role != 'CUSTOMER':
             raise ValidationError('Only customers can place orders')
         
-        if self.customer and self.shop:
-            if not ShopCustomer.objects.filter(shop=self.shop, customer=self.customer).exists():
+        if self.customer and self.shop_id:
+            if not ShopCustomer.objects.filter(shop_id=self.shop_id, customer=self.customer).exists():
                 raise ValidationError('Customer must be linked to shop to place order')
     
     def save(self, *args, **kwargs):
@@ -67,4 +81,287 @@ class OrderItem(models.Model):
         super().save(*args, **kwargs)
     
     def __str__(self):
-        return f"{self.product.name} x {self.quantity}"
\ No newline at end of file
+        return f"{self.product.name} x {self.quantity}"
+
+class ShopOrderStats(models.Model):
+    """Per-shop order counters, kept in step with every order write"""
+    OPEN_STATUSES = ['PENDING', 'ACCEPTED']
+    
+    shop = models.OneToOneField(Shop, on_delete=models.CASCADE, related_name='order_stats')
+    pending_count = models.PositiveIntegerField(default=0)
+    accepted_count = models.PositiveIntegerField(default=0)
+    rejected_count = models.PositiveIntegerField(default=0)
+    delivered_count = models.PositiveIntegerField(default=0)
+    open_order_value = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    lifetime_revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    stats_date = models.DateField(null=True, blank=True)  # Day the "today" counters belong to
+    delivered_today = models.PositiveIntegerField(default=0)
+    today_revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    @classmethod
+    def record_transition(cls, shop_id, old_status, new_status, amount):
+        """
+        Apply an order moving from ``old_status`` (None for a new order) to
+        ``new_status`` with a single UPDATE. Call inside the order's transaction.
+        """
+        cls.record_transitions(shop_id, [(old_status, new_status, amount)])
+    
+    @classmethod
+    def record_transitions(cls, shop_id, transitions):
+        """Apply many ``(old_status, new_status, amount)`` moves with a single UPDATE"""
+        counts = {}
+        open_delta = 0
+        delivered, delivered_amount = 0, 0
+        for old_status, new_status, amount in transitions:
+            if old_status:
+                counts[old_status] = counts.get(old_status, 0) - 1
+            counts[new_status] = counts.get(new_status, 0) + 1
+            if old_status in cls.OPEN_STATUSES:
+                open_delta -= amount
+            if new_status in cls.OPEN_STATUSES:
+                open_delta += amount
+            if new_status == 'DELIVERED':
+                delivered += 1
+                delivered_amount += amount
+        
+        changes = {'updated_at': timezone.now()}
+        for status, delta in counts.items():
+            field = f'{status.lower()}_count'
+            if delta > 0:
+                changes[field] = F(field) + delta
+            elif delta < 0:
+                # Never let a drifted counter push the row below zero
+                changes[field] = Greatest(F(field) + delta, 0)
+        
+        if open_delta:
+            changes['open_order_value'] = F('open_order_value') + open_delta
+        
+        if delivered:
+            today = timezone.localdate()
+            changes['lifetime_revenue'] = F('lifetime_revenue') + delivered_amount
+            changes['stats_date'] = today
+            changes['delivered_today'] = Case(
+                When(stats_date=today, then=F('delivered_today') + delivered), default=Value(delivered)
+            )
+            changes['today_revenue'] = Case(
+                When(stats_date=today, then=F('today_revenue') + delivered_amount),
+                default=Value(delivered_amount),
+                output_field=models.DecimalField(max_digits=14, decimal_places=2)
+            )
+        
+        if cls.objects.filter(shop_id=shop_id).update(**changes):
+            return
+        
+        # First order for this shop: create the row, then apply the change
+        try:
+            with transaction.atomic():
+                cls.objects.create(shop_id=shop_id)
+        except IntegrityError:
+            pass
+        cls.objects.filter(shop_id=shop_id).update(**changes)
+    
+    def as_of_today(self):
+        """Reset the "today" counters if they were last touched on an earlier day"""
+        if self.stats_date != timezone.localdate():
+            self.delivered_today = 0
+            self.today_revenue = 0
+        return self
+    
+    def __str__(self):
+        return f"Order stats - {self.shop.name}"
+
+
+class OrderEvent(models.Model):
+    """Append-only log of order changes, read by the shopkeeper event stream"""
+    TYPE_CHOICES = [
+        ('order_created', 'Order created'),
+        ('status_changed', 'Status changed'),
+    ]
+    
+    shop = models.ForeignKey(Shop, on_delete=models.CASCADE, related_name='order_events')
+    order_id = models.BigIntegerField()  # Not a foreign key so events outlive archived orders
+    type = models.CharField(max_length=20, choices=TYPE_CHOICES)
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    total_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['shop', 'id'], name='order_event_shop_idx'),
+        ]
+    
+    @classmethod
+    def record(cls, order, type):
+        """Log an order change and wake the shop's streams once it commits"""
+        from .events import bus
+        
+        event = cls.objects.create(
+            shop_id=order.shop_id,
+            order_id=order.id,
+            type=type,
+            status=order.status,
+            total_amount=order.total_amount,
+        )
+        transaction.on_commit(lambda: bus.notify(order.shop_id))
+        return event
+    
+    @classmethod
+    def record_many(cls, orders, type):
+        """Log the same change for many orders with one INSERT"""
+        from .events import bus
+        
+        events = cls.objects.bulk_create([
+            cls(
+                shop_id=order.shop_id,
+                order_id=order.id,
+                type=type,
+                status=order.status,
+                total_amount=order.total_amount,
+            )
+            for order in orders
+        ])
+        shop_ids = {order.shop_id for order in orders}
+        transaction.on_commit(lambda: bus.notify(*shop_ids))
+        return events
+    
+    def as_payload(self):
+        return {
+            'id': self.id,
+            'type': self.type,
+            'order_id': self.order_id,
+            'status': self.status,
+            'total_amount': str(self.total_amount),
+            'created_at': self.created_at.isoformat(),
+        }
+    
+    def __str__(self):
+        return f"{self.type} - Order #{self.order_id}"
+
+
+class IdempotencyKey(models.Model):
+    """Stored response for a client-supplied Idempotency-Key, replayed on retries"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)  # SHA-256 of the request it was first used with
+    status_code = models.PositiveSmallIntegerField()
+    response_body = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+    
+    class Meta:
+        unique_together = ['user', 'key']
+    
+    @staticmethod
+    def fingerprint_request(request):
+        body = json.dumps(request.data, sort_keys=True, cls=DjangoJSONEncoder)
+        return hashlib.sha256(f"{request.method} {request.path}\n{body}".encode()).hexdigest()
+    
+    @classmethod
+    def lookup(cls, user, key):
+        """Return the live stored entry for ``key``, dropping it if it has expired"""
+        entry = cls.objects.filter(user=user, key=key).first()
+        if entry is not None and entry.expires_at <= timezone.now():
+            entry.delete()
+            return None
+        return entry
+    
+    @classmethod
+    def store(cls, user, key, fingerprint, status_code, data):
+        return cls.objects.create(
+            user=user,
+            key=key,
+            fingerprint=fingerprint,
+            status_code=status_code,
+            response_body=json.dumps(data, cls=DjangoJSONEncoder),
+            expires_at=timezone.now() + timedelta(hours=settings.IDEMPOTENCY_KEY_TTL_HOURS),
+        )
+    
+    def __str__(self):
+        return f"{self.key} - {self.user.name}"
+
+
+class StockHold(models.Model):
+    """Stock of one product held for a pending order until it expires; counted in ``Product.reserved``"""
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='stock_holds')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_holds')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField(db_index=True)
+    
+    def __str__(self):
+        return f"{self.quantity} x {self.product.name} for order #{self.order_id}"
+
+
+class ArchivedOrder(models.Model):
+    """Finished order moved out of the hot Order table, keeping its original id"""
+    id = models.BigIntegerField(primary_key=True)
+    customer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_orders')
+    shop = models.ForeignKey(Shop, on_delete=models.CASCADE, related_name='archived_orders')
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    total_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['shop', 'created_at', 'id'], name='archived_order_shop_idx'),
+            models.Index(fields=['customer', 'created_at', 'id'], name='archived_order_customer_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Archived order #{self.id} - {self.customer.name} - {self.shop.name}"
+
+
+class ArchivedOrderItem(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE, related_name='order_items')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField()
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    
+    def __str__(self):
+        return f"{self.product.name} x {self.quantity}"
+
+
+class DailyShopSales(models.Model):
+    """Per-shop sales for one day (by order date), refreshed by ``refresh_sales_rollups``"""
+    shop = models.ForeignKey(Shop, on_delete=models.CASCADE, related_name='daily_sales')
+    day = models.DateField()
+    order_count = models.PositiveIntegerField(default=0)
+    item_count = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    
+    class Meta:
+        unique_together = ['shop', 'day']
+    
+    def __str__(self):
+        return f"{self.shop.name} - {self.day}"
+
+
+class DailyProductSales(models.Model):
+    """Per-product sales for one shop and day, refreshed by ``refresh_sales_rollups``"""
+    shop = models.ForeignKey(Shop, on_delete=models.CASCADE, related_name='daily_product_sales')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='daily_sales')
+    day = models.DateField()
+    quantity = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    
+    class Meta:
+        unique_together = ['shop', 'day', 'product']
+    
+    def __str__(self):
+        return f"{self.product.name} - {self.day}"
+
+
+class SalesRollupState(models.Model):
+    """Single row holding how far the sales rollups have been refreshed"""
+    high_water_mark = models.DateTimeField(null=True, blank=True)  # Latest Order.updated_at folded in
+    refreshed_at = models.DateTimeField(null=True, blank=True)
+    
+    @classmethod
+    def get(cls):
+        return cls.objects.get_or_create(pk=1)[0]
+    
+    def __str__(self):
+        return f"Sales rollups up to {self.high_water_mark}"
@@ -0,0 +1,121 @@
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, Max, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from .models import (
+    ArchivedOrder, ArchivedOrderItem, DailyProductSales, DailyShopSales,
+    Order, OrderItem, SalesRollupState
+)
+
+COUNTED_STATUSES = ['ACCEPTED', 'DELIVERED']
+
+# Re-read this far behind the high-water mark so orders whose transaction
+# committed after a later-stamped one are not skipped
+REWIND = timedelta(minutes=5)
+
+
+def _order_totals(model, **lookup):
+    return (
+        model.objects.filter(status__in=COUNTED_STATUSES, **lookup)
+        .annotate(day=TruncDate('created_at'))
+        .values('shop_id', 'day')
+        .annotate(order_count=Count('id'), revenue=Sum('total_amount'))
+        .order_by()
+    )
+
+
+def _item_totals(model, **lookup):
+    lookup = {f'order__{key}': value for key, value in lookup.items()}
+    return (
+        model.objects.filter(order__status__in=COUNTED_STATUSES, **lookup)
+        .annotate(shop_id=F('order__shop_id'), day=TruncDate('order__created_at'))
+        .values('shop_id', 'day', 'product_id')
+        .annotate(
+            units=Sum('quantity'),
+            sales=Sum(F('quantity') * F('price'), output_field=DecimalField(max_digits=14, decimal_places=2)),
+        )
+        .order_by()
+    )
+
+
+def _build_rows(**lookup):
+    """Aggregate live and archived orders matching ``lookup`` into rollup rows"""
+    shops, products = {}, {}
+    
+    def shop_total(row):
+        return shops.setdefault((row['shop_id'], row['day']), {'order_count': 0, 'item_count': 0, 'revenue': 0})
+    
+    for order_model, item_model in [(Order, OrderItem), (ArchivedOrder, ArchivedOrderItem)]:
+        for row in _order_totals(order_model, **lookup):
+            total = shop_total(row)
+            total['order_count'] += row['order_count']
+            total['revenue'] += row['revenue']
+        # Each query reads its own snapshot, so an order that became counted in between can show up
+        # here only; its status change moved updated_at, and the next refresh recomputes the bucket
+        for row in _item_totals(item_model, **lookup):
+            shop_total(row)['item_count'] += row['units']
+            total = products.setdefault((row['shop_id'], row['day'], row['product_id']), {'quantity': 0, 'revenue': 0})
+            total['quantity'] += row['units']
+            total['revenue'] += row['sales']
+    
+    return (
+        [DailyShopSales(shop_id=shop_id, day=day, **total) for (shop_id, day), total in shops.items()],
+        [
+            DailyProductSales(shop_id=shop_id, day=day, product_id=product_id, **total)
+            for (shop_id, day, product_id), total in products.items()
+        ],
+    )
+
+
+def refresh_sales_rollups(full=False):
+    """
+    Bring DailyShopSales and DailyProductSales up to date.
+
+    Every (shop, day) bucket holding an order updated since the last run is
+    recomputed from scratch with grouped queries, so status changes that
+    remove an order from the counts are handled too. ``full`` rebuilds
+    every bucket. Returns the number of shop-day buckets written.
+    """
+    SalesRollupState.get()
+    with transaction.atomic():
+        # Concurrent refreshes queue up here instead of racing on the same buckets
+        state = SalesRollupState.objects.select_for_update().get(pk=1)
+        
+        if full or state.high_water_mark is None:
+            lookup = {}
+            stale = DailyShopSales.objects.all(), DailyProductSales.objects.all()
+            mark = Order.objects.aggregate(latest=Max('updated_at'))['latest']
+        else:
+            touched = list(
+                Order.objects.filter(updated_at__gte=state.high_water_mark - REWIND)
+                .annotate(day=TruncDate('created_at'))
+                .values('shop_id', 'day')
+                .annotate(latest=Max('updated_at'))
+                .order_by()
+            )
+            if not touched:
+                state.refreshed_at = timezone.now()
+                state.save(update_fields=['refreshed_at'])
+                return 0
+            
+            shop_ids = {row['shop_id'] for row in touched}
+            days = {row['day'] for row in touched}
+            # Buckets outside the touched pairs are recomputed to the same values, which is harmless
+            lookup = {'shop_id__in': shop_ids, 'created_at__date__in': days}
+            stale = (
+                DailyShopSales.objects.filter(shop_id__in=shop_ids, day__in=days),
+                DailyProductSales.objects.filter(shop_id__in=shop_ids, day__in=days),
+            )
+            mark = max(state.high_water_mark, *[row['latest'] for row in touched])
+        
+        shop_rows, product_rows = _build_rows(**lookup)
+        for queryset in stale:
+            queryset.delete()
+        DailyShopSales.objects.bulk_create(shop_rows, batch_size=500)
+        DailyProductSales.objects.bulk_create(product_rows, batch_size=500)
+        
+        state.high_water_mark = mark
+        state.refreshed_at = timezone.now()
+        state.save()
+    return len(shop_rows)
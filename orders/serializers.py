@@ -1,11 +1,18 @@
 from rest_framework import serializers
 from django.db import transaction
-from .models import Order, OrderItem
+from django.utils import timezone
+from .models import (
+    ArchivedOrder, ArchivedOrderItem, DailyShopSales, Order, OrderEvent, OrderItem, ShopOrderStats,
+    StockHold
+)
 from products.models import Product
+from products.stock import decrement_stock, release_reserved_stock, restore_stock
+from .holds import held_stock, hold_stock, take_holds
 from users.serializers import UserProfileSerializer
 from shops.serializers import ShopSerializer
+from nearbasket.serializers import DynamicFieldsMixin, EagerLoadingMixin
 
-class OrderItemSerializer(serializers.ModelSerializer):
+class OrderItemSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     product_name = serializers.CharField(source='product.name', read_only=True)
     
     class Meta:
@@ -13,7 +20,7 @@ class OrderItemSerializer(serializers.ModelSerializer):
         fields = ['id', 'product', 'product_name', 'quantity', 'price']
         read_only_fields = ['id', 'price', 'product_name']
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(DynamicFieldsMixin, EagerLoadingMixin, serializers.ModelSerializer):
     customer = UserProfileSerializer(read_only=True)
     shop = ShopSerializer(read_only=True)
     order_items = OrderItemSerializer(many=True, read_only=True)
@@ -24,6 +31,17 @@ class OrderSerializer(serializers.ModelSerializer):
                  'created_at', 'updated_at', 'order_items']
         read_only_fields = ['id', 'total_amount', 'created_at', 'updated_at']
 
+class ArchivedOrderItemSerializer(OrderItemSerializer):
+    class Meta(OrderItemSerializer.Meta):
+        model = ArchivedOrderItem
+
+class ArchivedOrderSerializer(OrderSerializer):
+    """Same shape as OrderSerializer, read from the archive tables"""
+    order_items = ArchivedOrderItemSerializer(many=True, read_only=True)
+    
+    class Meta(OrderSerializer.Meta):
+        model = ArchivedOrder
+
 class CreateOrderSerializer(serializers.Serializer):
     items = serializers.ListField(
         child=serializers.DictField(
@@ -39,6 +57,11 @@ class CreateOrderSerializer(serializers.Serializer):
                     "Each item must have 'product_id' and 'quantity'"
                 )
             
+            try:
+                int(item['product_id'])
+            except (ValueError, TypeError):
+                raise serializers.ValidationError("Product id must be a valid integer")
+            
             try:
                 quantity = int(item['quantity'])
                 if quantity <= 0:
@@ -48,36 +71,63 @@ class CreateOrderSerializer(serializers.Serializer):
         
         return value
     
+    def validate(self, data):
+        """Resolve every line item with a single product query.
+        
+        Duplicate product lines are merged, and all missing products and
+        stock shortfalls are reported together instead of one at a time.
+        Stock held for other pending orders does not count as available.
+        """
+        shop_id = self.context['shop_id']
+        
+        quantities = {}
+        for item in data['items']:
+            product_id = int(item['product_id'])
+            quantities[product_id] = quantities.get(product_id, 0) + int(item['quantity'])
+        
+        products = Product.objects.filter(shop_id=shop_id).in_bulk(list(quantities))
+        
+        errors = []
+        for product_id, quantity in quantities.items():
+            product = products.get(product_id)
+            if product is None:
+                errors.append(f"Product {product_id} does not exist in this shop")
+            elif quantity > product.available_stock:
+                errors.append(
+                    f"Not enough stock for {product.name}. Available: {product.available_stock}"
+                )
+        
+        if errors:
+            raise serializers.ValidationError({'items': errors})
+        
+        data['lines'] = [
+            (products[product_id], quantity)
+            for product_id, quantity in quantities.items()
+        ]
+        return data
+    
     def create(self, validated_data):
         customer = self.context['customer']
-        shop = self.context['shop']
+        shop_id = self.context['shop_id']
+        lines = validated_data['lines']
+        
+        total = sum(product.price * quantity for product, quantity in lines)
         
         with transaction.atomic():
-            # Create order
-            order = Order.objects.create(customer=customer, shop=shop)
-            
-            # Create order items
-            for item_data in validated_data['items']:
-                product = Product.objects.get(
-                    id=item_data['product_id'], 
-                    shop=shop
-                )
-                quantity = int(item_data['quantity'])
-                
-                if quantity > product.stock:
-                    raise serializers.ValidationError(
-                        f"Not enough stock for {product.name}. Available: {product.stock}"
-                    )
-                
-                OrderItem.objects.create(
-                    order=order,
-                    product=product,
-                    quantity=quantity,
-                    price=product.price
-                )
+            # Create order with its final total so it is only written once
+            order = Order.objects.create(customer=customer, shop_id=shop_id, total_amount=total)
+            
+            # Lines were validated above, so insert them in one statement
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=product, quantity=quantity, price=product.price)
+                for product, quantity in lines
+            ])
+            
+            # Hold the stock until the shop answers; raises InsufficientStock if it ran out meanwhile
+            hold_stock(order, {product.id: quantity for product, quantity in lines})
             
-            # Calculate total
-            order.calculate_total()
+            ShopOrderStats.record_transition(shop_id, None, order.status, total)
+            OrderEvent.record(order, 'order_created')
             
         return order
 
@@ -97,26 +147,219 @@ class UpdateOrderStatusSerializer(serializers.ModelSerializer):
         old_status = instance.status
         new_status = validated_data.get('status', instance.status)
         
-        # If order is being accepted, reduce product stock
-        if old_status == 'PENDING' and new_status == 'ACCEPTED':
-            with transaction.atomic():
-                for item in instance.order_items.all():
-                    product = item.product
-                    if product.stock < item.quantity:
-                        raise serializers.ValidationError(
-                            f"Not enough stock for {product.name}"
-                        )
-                    product.stock -= item.quantity
-                    product.save()
+        quantities = {}
+        if (old_status, new_status) in [('PENDING', 'ACCEPTED'), ('ACCEPTED', 'REJECTED')]:
+            for product_id, quantity in instance.order_items.values_list('product_id', 'quantity'):
+                quantities[product_id] = quantities.get(product_id, 0) + quantity
         
-        # If order is being rejected after acceptance, restore stock
-        elif old_status == 'ACCEPTED' and new_status == 'REJECTED':
-            with transaction.atomic():
-                for item in instance.order_items.all():
-                    product = item.product
-                    product.stock += item.quantity
-                    product.save()
+        now = timezone.now()
+        with transaction.atomic():
+            # Only move the order on if nobody else changed its status meanwhile
+            changed = Order.objects.filter(pk=instance.pk, status=old_status).update(
+                status=new_status, updated_at=now
+            )
+            if not changed:
+                raise serializers.ValidationError({
+                    'status': "Order status was changed by another request"
+                })
+            
+            # A pending order gives up its held stock whatever it moves to
+            held = {}
+            if old_status == 'PENDING' and new_status != 'PENDING':
+                held = take_holds([instance.pk]).get(instance.pk, {})
+            
+            # If order is being accepted, reduce product stock by what was held for it
+            if old_status == 'PENDING' and new_status == 'ACCEPTED':
+                decrement_stock(quantities, held=held)
+            
+            # If order is being rejected after acceptance, restore stock
+            elif old_status == 'ACCEPTED' and new_status == 'REJECTED':
+                restore_stock(quantities)
+            
+            else:
+                release_reserved_stock(held)
+            
+            instance.status = new_status
+            instance.updated_at = now
+            if old_status != new_status:
+                ShopOrderStats.record_transition(
+                    instance.shop_id, old_status, new_status, instance.total_amount
+                )
+                OrderEvent.record(instance, 'status_changed')
         
-        instance.status = new_status
-        instance.save()
-        return instance
\ No newline at end of file
+        return instance
+
+
+class ShopOrderStatsSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ShopOrderStats
+        fields = ['pending_count', 'accepted_count', 'rejected_count', 'delivered_count',
+                 'delivered_today', 'today_revenue', 'lifetime_revenue', 'open_order_value',
+                 'updated_at']
+
+
+class DailyShopSalesSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DailyShopSales
+        fields = ['day', 'order_count', 'item_count', 'revenue']
+
+
+class SalesTotalsSerializer(serializers.Serializer):
+    order_count = serializers.IntegerField()
+    item_count = serializers.IntegerField()
+    revenue = serializers.DecimalField(max_digits=14, decimal_places=2)
+    average_order_value = serializers.DecimalField(max_digits=14, decimal_places=2)
+    average_items_per_order = serializers.DecimalField(max_digits=10, decimal_places=2)
+
+
+class TopProductSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField()
+    product_name = serializers.CharField()
+    quantity = serializers.IntegerField(source='units')
+    revenue = serializers.DecimalField(source='sales', max_digits=14, decimal_places=2)
+
+
+class OrderStatusChangeSerializer(serializers.Serializer):
+    order_id = serializers.IntegerField()
+    status = serializers.ChoiceField(choices=Order.STATUS_CHOICES)
+
+
+class BulkOrderStatusSerializer(serializers.Serializer):
+    """Apply many status changes to one shop's orders in a single transaction"""
+    updates = OrderStatusChangeSerializer(many=True, allow_empty=False, max_length=500)
+    
+    def validate_updates(self, value):
+        order_ids = [update['order_id'] for update in value]
+        if len(order_ids) != len(set(order_ids)):
+            raise serializers.ValidationError("Each order can only appear once")
+        return value
+    
+    def save(self):
+        shop_id = self.context['shop_id']
+        requested = {update['order_id']: update['status'] for update in self.validated_data['updates']}
+        outcomes = {}
+        
+        with transaction.atomic():
+            # Lock the orders so their status cannot change underneath us
+            orders = {
+                order.id: order
+                for order in Order.objects.select_for_update().filter(
+                    shop_id=shop_id, id__in=list(requested)
+                ).only('id', 'shop', 'status', 'total_amount').order_by('id')
+            }
+            
+            changes = []
+            for order_id, new_status in requested.items():
+                order = orders.get(order_id)
+                if order is None:
+                    outcomes[order_id] = {'outcome': 'not_found', 'error': 'Order not found in this shop'}
+                elif order.status in ['DELIVERED', 'REJECTED']:
+                    outcomes[order_id] = {
+                        'outcome': 'invalid_transition',
+                        'error': 'Cannot modify order that is already delivered or rejected',
+                    }
+                elif order.status == new_status:
+                    outcomes[order_id] = {'outcome': 'unchanged'}
+                else:
+                    changes.append((order, new_status))
+            
+            # Ids follow placement order, so sorting hands stock to the oldest orders first
+            accepting = sorted(order.id for order, new_status in changes
+                               if order.status == 'PENDING' and new_status == 'ACCEPTED')
+            restoring = [order.id for order, new_status in changes
+                         if order.status == 'ACCEPTED' and new_status == 'REJECTED']
+            
+            items = {}
+            for order_id, product_id, quantity in OrderItem.objects.filter(
+                order_id__in=accepting + restoring
+            ).values_list('order_id', 'product_id', 'quantity'):
+                lines = items.setdefault(order_id, {})
+                lines[product_id] = lines.get(product_id, 0) + quantity
+            
+            held = held_stock([order.id for order, _ in changes if order.status == 'PENDING'])
+            rejected = self._allocate_stock(accepting, items, held, outcomes)
+            changes = [(order, new_status) for order, new_status in changes if order.id not in rejected]
+            
+            # Orders leaving PENDING give up their holds; accepted ones turn them into a decrement
+            accepted = [order_id for order_id in accepting if order_id not in rejected]
+            releasing = [order.id for order, new_status in changes
+                         if order.status == 'PENDING' and new_status != 'ACCEPTED']
+            if any(order_id in held for order_id in accepted + releasing):
+                StockHold.objects.filter(order_id__in=accepted + releasing).delete()
+            release_reserved_stock(self._sum_lines(held, releasing))
+            decrement_stock(self._sum_lines(items, accepted), held=self._sum_lines(held, accepted))
+            restore_stock(self._sum_lines(items, restoring))
+            
+            # One compare-and-set UPDATE per (old, new) status pair
+            now = timezone.now()
+            groups = {}
+            for order, new_status in changes:
+                groups.setdefault((order.status, new_status), []).append(order.id)
+            for (old_status, new_status), order_ids in groups.items():
+                Order.objects.filter(id__in=order_ids, status=old_status).update(
+                    status=new_status, updated_at=now
+                )
+            
+            transitions = []
+            for order, new_status in changes:
+                transitions.append((order.status, new_status, order.total_amount))
+                order.status = new_status
+                outcomes[order.id] = {'outcome': 'updated', 'status': new_status}
+            
+            if changes:
+                ShopOrderStats.record_transitions(shop_id, transitions)
+                OrderEvent.record_many([order for order, _ in changes], 'status_changed')
+        
+        return [{'order_id': order_id, **outcomes[order_id]} for order_id in requested]
+    
+    def _allocate_stock(self, accepting, items, held, outcomes):
+        """
+        Decide which orders being accepted fit in the remaining stock, oldest
+        first, and return the ids of those that do not. An order may use
+        unreserved stock plus whatever is held for it; holds of orders being
+        rejected or delivered are freed up first.
+        """
+        product_ids = {product_id for order_id in accepting for product_id in items.get(order_id, {})}
+        stock = {
+            product_id: stock - reserved
+            for product_id, stock, reserved in Product.objects.select_for_update().filter(
+                id__in=product_ids
+            ).values_list('id', 'stock', 'reserved')
+        }
+        for order_id, lines in held.items():
+            if order_id not in accepting:
+                for product_id, quantity in lines.items():
+                    if product_id in stock:
+                        stock[product_id] += quantity
+        
+        rejected = set()
+        for order_id in accepting:
+            lines = items.get(order_id, {})
+            own = held.get(order_id, {})
+            shortfalls = [
+                {
+                    'product_id': product_id,
+                    'requested': quantity,
+                    'available': max(stock.get(product_id, 0) + own.get(product_id, 0), 0),
+                }
+                for product_id, quantity in lines.items()
+                if stock.get(product_id, 0) + own.get(product_id, 0) < quantity
+            ]
+            if shortfalls:
+                rejected.add(order_id)
+                outcomes[order_id] = {
+                    'outcome': 'insufficient_stock',
+                    'error': 'Not enough stock for some items',
+                    'items': shortfalls,
+                }
+                continue
+            for product_id, quantity in lines.items():
+                stock[product_id] += own.get(product_id, 0) - quantity
+        return rejected
+    
+    def _sum_lines(self, items, order_ids):
+        totals = {}
+        for order_id in order_ids:
+            for product_id, quantity in items.get(order_id, {}).items():
+                totals[product_id] = totals.get(product_id, 0) + quantity
+        return totals
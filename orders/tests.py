@@ -1,3 +1,604 @@
-from django.test import TestCase
+import asyncio
+import csv
+import json
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+from asgiref.sync import sync_to_async
+from django.contrib import admin
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import call_command
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections, connection
+from django.test import AsyncClient, RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import RefreshToken
+from nearbasket.testing import APITestCase
+from products.models import Product
+from shops.models import ShopCustomer
+from . import rollups
+from .export import item_rows
+from .models import (
+    ArchivedOrder, ArchivedOrderItem, DailyShopSales, IdempotencyKey, Order, OrderEvent, ShopOrderStats, StockHold
+)
+from .rollups import refresh_sales_rollups
 
-# Create your tests here.
+
+class QueryBudgetTests(APITestCase):
+    """Every budgeted order view stays within its budget on a shop with several multi-item orders"""
+
+    def setUp(self):
+        super().setUp()
+        self.shop = self.make_shop(customers=3)
+        self.products = [self.make_product(self.shop, f'Product {index}') for index in range(4)]
+        self.order_ids = []
+        for customer in self.shop.test_customers:
+            for _ in range(2):
+                response = self.place_order(customer, self.shop, {product: 1 for product in self.products})
+                self.assertEqual(response.status_code, 201)
+                self.order_ids.append(response.data['id'])
+        self.keeper = self.client_for(self.shop.owner)
+        self.customer = self.client_for(self.shop.test_customers[0])
+
+    def test_create_order(self):
+        response = self.place_order(
+            self.shop.test_customers[1], self.shop, {product: 2 for product in self.products},
+            HTTP_IDEMPOTENCY_KEY='checkout-1'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data['order_items']), 4)
+
+    def test_my_orders(self):
+        response = self.customer.get('/api/orders/my-orders/?history=true')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 2)
+
+    def test_order_detail(self):
+        response = self.keeper.get(f'/api/orders/{self.order_ids[0]}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['order_items']), 4)
+
+    def test_shop_orders(self):
+        response = self.keeper.get(f'/api/orders/shops/{self.shop.pk}/orders/list/?history=true&status=pending')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 6)
+
+    def test_export_shop_orders(self):
+        response = self.keeper.get(f'/api/orders/shops/{self.shop.pk}/orders/export/?type=ndjson')
+        self.assertEqual(response.status_code, 200)
+        orders = b''.join(response.streaming_content).splitlines()
+        self.assertEqual(len(orders), 6)
+        self.assertEqual(len(json.loads(orders[0])['items']), 4)
+
+    def test_update_order_status(self):
+        response = self.set_status(self.order_ids[0], self.shop, 'ACCEPTED')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'ACCEPTED')
+
+    def test_shop_dashboard(self):
+        response = self.keeper.get(f'/api/orders/shops/{self.shop.pk}/dashboard/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['pending_count'], 6)
+
+    def test_shop_analytics(self):
+        today = timezone.localdate()
+        response = self.keeper.get(
+            f'/api/orders/shops/{self.shop.pk}/analytics/?date_from={today - timedelta(days=7)}&date_to={today}'
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_bulk_update_order_status(self):
+        updates = [{'order_id': order_id, 'status': 'ACCEPTED'} for order_id in self.order_ids]
+        response = self.keeper.post('/api/orders/bulk-status/', {'updates': updates}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Order.objects.filter(status='ACCEPTED').count(), 6)
+
+
+class OrderPlacementTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.shop = self.make_shop()
+        self.customer = self.shop.test_customers[0]
+        self.products = [self.make_product(self.shop, f'Product {index}', price='2.50', stock=5) for index in range(40)]
+
+    def queries_to_place(self, products):
+        # A shop's first order creates its counters row and fills the shop access cache; measure later ones
+        self.place_order(self.customer, self.shop, {self.products[-1]: 1})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.place_order(self.customer, self.shop, {product: 1 for product in products})
+        self.assertEqual(response.status_code, 201)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_the_basket(self):
+        self.assertEqual(self.queries_to_place(self.products[:2]), self.queries_to_place(self.products[:39]))
+
+    def test_duplicate_lines_are_merged_and_totalled_once(self):
+        response = self.client_for(self.customer).post(f'/api/orders/shops/{self.shop.pk}/orders/', {'items': [
+            {'product_id': self.products[0].pk, 'quantity': 2},
+            {'product_id': self.products[0].pk, 'quantity': 1},
+            {'product_id': self.products[1].pk, 'quantity': 1},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['total_amount'], '10.00')
+        self.assertEqual(sorted(item['quantity'] for item in response.data['order_items']), [1, 3])
+
+    def test_every_missing_product_and_shortfall_is_reported(self):
+        response = self.client_for(self.customer).post(f'/api/orders/shops/{self.shop.pk}/orders/', {'items': [
+            {'product_id': self.products[0].pk, 'quantity': 6},
+            {'product_id': 999999, 'quantity': 1},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(response.data['items']), 2)
+        self.assertFalse(Order.objects.exists())
+
+
+class OrderStatusStockTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.shop = self.make_shop()
+        self.rice, self.dal = self.make_product(self.shop, 'Rice', stock=5), self.make_product(self.shop, 'Dal', stock=5)
+        response = self.place_order(self.shop.test_customers[0], self.shop, {self.rice: 3, self.dal: 2})
+        self.order_id = response.data['id']
+
+    def stock(self):
+        return list(Product.objects.order_by('name').values_list('name', 'stock', 'reserved'))
+
+    def test_accept_takes_stock_and_reject_after_accepting_restores_it(self):
+        self.assertEqual(self.set_status(self.order_id, self.shop, 'ACCEPTED').status_code, 200)
+        self.assertEqual(self.stock(), [('Dal', 3, 0), ('Rice', 2, 0)])
+        self.assertEqual(self.set_status(self.order_id, self.shop, 'REJECTED').status_code, 200)
+        self.assertEqual(self.stock(), [('Dal', 5, 0), ('Rice', 5, 0)])
+
+    def test_accept_without_enough_stock_changes_nothing(self):
+        # The shopkeeper counted the shelf again after the order was placed
+        Product.objects.filter(pk=self.rice.pk).update(stock=1)
+        response = self.set_status(self.order_id, self.shop, 'ACCEPTED')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([item['product_name'] for item in response.data['items']], ['Rice'])
+        self.assertEqual(Order.objects.get(pk=self.order_id).status, 'PENDING')
+        self.assertEqual(self.stock(), [('Dal', 5, 2), ('Rice', 1, 3)])
+
+    def test_finished_orders_cannot_change(self):
+        self.set_status(self.order_id, self.shop, 'REJECTED')
+        self.assertEqual(self.set_status(self.order_id, self.shop, 'ACCEPTED').status_code, 400)
+        self.assertEqual(self.stock(), [('Dal', 5, 0), ('Rice', 5, 0)])
+
+
+class OrderListTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.shop = self.make_shop()
+        self.customer = self.shop.test_customers[0]
+        rice = self.make_product(self.shop, 'Rice')
+        self.order_ids = [self.place_order(self.customer, self.shop, {rice: 1}).data['id'] for _ in range(5)]
+        self.set_status(self.order_ids[0], self.shop, 'ACCEPTED')
+        self.keeper = self.client_for(self.shop.owner)
+        self.url = f'/api/orders/shops/{self.shop.pk}/orders/list/'
+
+    def walk(self, client, url, **params):
+        ids, params = [], {'page_size': 2, **params}
+        while True:
+            response = client.get(url, params)
+            self.assertEqual(response.status_code, 200, response.data)
+            ids += [order['id'] for order in response.data['results']]
+            if not response.data['next']:
+                return ids
+            params['cursor'] = parse_qs(urlparse(response.data['next']).query)['cursor'][0]
+
+    def test_pages_walk_every_order_newest_first(self):
+        self.assertEqual(self.walk(self.keeper, self.url), self.order_ids[::-1])
+        self.assertEqual(self.walk(self.client_for(self.customer), '/api/orders/my-orders/'), self.order_ids[::-1])
+
+    def test_status_and_date_filters(self):
+        self.assertEqual(self.walk(self.keeper, self.url, status='accepted'), self.order_ids[:1])
+        self.assertEqual(len(self.walk(self.keeper, self.url, status='pending,accepted')), 5)
+        today = timezone.localdate()
+        self.assertEqual(len(self.walk(self.keeper, self.url, date_from=today, date_to=today)), 5)
+        self.assertEqual(self.walk(self.keeper, self.url, date_to=today - timedelta(days=1)), [])
+
+    def test_bad_parameters(self):
+        self.assertEqual(self.keeper.get(self.url, {'status': 'lost'}).status_code, 400)
+        self.assertEqual(self.keeper.get(self.url, {'date_from': '18/10/2026'}).status_code, 400)
+        self.assertEqual(self.keeper.get(self.url, {'cursor': 'nonsense'}).status_code, 404)
+
+
+class SparseFieldsetTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.shop = self.make_shop()
+        self.customer = self.client_for(self.shop.test_customers[0])
+        self.place_order(self.shop.test_customers[0], self.shop, {self.make_product(self.shop, 'Rice'): 2})
+
+    def test_fields_pick_top_level_and_nested_fields(self):
+        response = self.customer.get('/api/orders/my-orders/?fields=id,status,shop.name')
+        self.assertEqual(response.status_code, 200)
+        order = response.data['results'][0]
+        self.assertEqual(set(order), {'id', 'status', 'shop'})
+        self.assertEqual(order['shop'], {'name': 'Corner Store'})
+
+    def test_unexpanded_nested_objects_collapse_to_their_id(self):
+        order = self.customer.get('/api/orders/my-orders/?fields=id,shop,customer').data['results'][0]
+        self.assertEqual((order['shop'], order['customer']), (self.shop.pk, self.shop.test_customers[0].pk))
+        order = self.customer.get('/api/orders/my-orders/?expand=shop').data['results'][0]
+        self.assertEqual(order['shop']['name'], 'Corner Store')
+        self.assertEqual(order['customer'], self.shop.test_customers[0].pk)
+
+    def test_no_parameters_keep_the_full_shape(self):
+        order = self.customer.get('/api/orders/my-orders/').data['results'][0]
+        self.assertEqual(order['shop']['name'], 'Corner Store')
+        self.assertEqual(order['order_items'][0]['product_name'], 'Rice')
+
+
+class ShopDashboardTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.shop = self.make_shop()
+        rice = self.make_product(self.shop, 'Rice', price='10.00')
+        customer = self.shop.test_customers[0]
+        self.order_ids = [self.place_order(customer, self.shop, {rice: quantity}).data['id'] for quantity in (1, 2, 3)]
+        self.set_status(self.order_ids[0], self.shop, 'ACCEPTED')
+        self.set_status(self.order_ids[0], self.shop, 'DELIVERED')
+        self.set_status(self.order_ids[1], self.shop, 'REJECTED')
+        self.url = f'/api/orders/shops/{self.shop.pk}/dashboard/'
+
+    def dashboard(self):
+        response = self.client_for(self.shop.owner).get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return {field: str(value) for field, value in response.data.items() if field != 'updated_at'}
+
+    def test_counters_follow_every_status_change(self):
+        self.assertEqual(self.dashboard(), {
+            'pending_count': '1', 'accepted_count': '0', 'rejected_count': '1', 'delivered_count': '1',
+            'delivered_today': '1', 'today_revenue': '10.00', 'lifetime_revenue': '10.00',
+            'open_order_value': '30.00',
+        })
+
+    def test_today_counters_reset_on_a_new_day(self):
+        ShopOrderStats.objects.update(stats_date=timezone.localdate() - timedelta(days=1))
+        stats = self.dashboard()
+        self.assertEqual((stats['delivered_today'], stats['today_revenue']), ('0', '0.00'))
+        self.assertEqual(stats['lifetime_revenue'], '10.00')
+
+    def test_rebuild_recovers_drifted_counters(self):
+        expected = self.dashboard()
+        ShopOrderStats.objects.update(pending_count=7, open_order_value=0)
+        call_command('rebuild_order_stats', shop=[self.shop.pk], stdout=StringIO())
+        self.assertEqual(self.dashboard(), expected)
+
+    def test_only_the_owner(self):
+        self.assertEqual(self.client_for(self.shop.test_customers[0]).get(self.url).status_code, 403)
+        other = self.make_shop('9100000000', customers=0)
+        self.assertEqual(self.client_for(other.owner).get(self.url).status_code, 403)
+
+
+class OrderEventStreamTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.shop = self.make_shop()
+        rice = self.make_product(self.shop, 'Rice', price='10.00')
+        self.order_id = self.place_order(self.shop.test_customers[0], self.shop, {rice: 2}).data['id']
+        self.set_status(self.order_id, self.shop, 'ACCEPTED')
+
+    async def open_stream(self, user, **headers):
+        token = await sync_to_async(lambda: str(RefreshToken.for_user(user).access_token))()
+        return await AsyncClient().get('/api/orders/stream/', headers={'Authorization': f'Bearer {token}', **headers})
+
+    def test_order_changes_are_recorded(self):
+        self.assertEqual(
+            list(OrderEvent.objects.order_by('id').values_list('type', 'order_id', 'status')),
+            [('order_created', self.order_id, 'PENDING'), ('status_changed', self.order_id, 'ACCEPTED')]
+        )
+
+    async def test_stream_resumes_after_the_last_event_id(self):
+        first = await OrderEvent.objects.order_by('id').afirst()
+        response = await self.open_stream(self.shop.owner, **{'Last-Event-ID': str(first.id)})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        chunks = aiter(response.streaming_content)
+        self.assertTrue((await anext(chunks)).startswith(b'retry: '))
+        event = (await anext(chunks)).decode().splitlines()
+        await response.streaming_content.aclose()
+        self.assertEqual(event[:2], [f'id: {first.id + 1}', 'event: status_changed'])
+        payload = json.loads(event[2].removeprefix('data: '))
+        self.assertEqual((payload['order_id'], payload['status'], payload['total_amount']), (self.order_id, 'ACCEPTED', '20.00'))
+
+    async def test_only_shopkeepers_with_a_shop(self):
+        self.assertEqual((await AsyncClient().get('/api/orders/stream/')).status_code, 401)
+        self.assertEqual((await self.open_stream(self.shop.test_customers[0])).status_code, 403)
+        response = await self.open_stream(self.shop.owner, **{'Last-Event-ID': 'latest'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_purge_keeps_recent_events(self):
+        OrderEvent.objects.filter(type='order_created').update(created_at=timezone.now() - timedelta(days=8))
+        call_command('purge_order_events', batch_size=1, stdout=StringIO())
+        self.assertEqual(list(OrderEvent.objects.values_list('type', flat=True)), ['status_changed'])
+
+
+class BulkOrderStatusTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.shop = self.make_shop()
+        self.rice = self.make_product(self.shop, 'Rice', stock=10)
+        customer = self.shop.test_customers[0]
+        self.first, self.second, self.rejected = [
+            self.place_order(customer, self.shop, {self.rice: quantity}).data['id'] for quantity in (3, 2, 1)
+        ]
+        self.set_status(self.rejected, self.shop, 'REJECTED')
+        # The shopkeeper counted the shelf again after the orders were placed
+        Product.objects.filter(pk=self.rice.pk).update(stock=4)
+
+    def bulk(self, *updates):
+        return self.client_for(self.shop.owner).post('/api/orders/bulk-status/', {
+            'updates': [{'order_id': order_id, 'status': new_status} for order_id, new_status in updates]
+        }, format='json')
+
+    def test_each_update_gets_an_outcome(self):
+        response = self.bulk((self.first, 'ACCEPTED'), (self.second, 'REJECTED'),
+                             (self.rejected, 'ACCEPTED'), (999999, 'ACCEPTED'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['outcome'] for result in response.data['results']],
+                         ['updated', 'updated', 'invalid_transition', 'not_found'])
+        # Rejecting the second order frees the stock held for it in time for the first
+        self.rice.refresh_from_db()
+        self.assertEqual((self.rice.stock, self.rice.reserved), (1, 0))
+        self.assertEqual(self.bulk((self.first, 'ACCEPTED')).data['results'][0]['outcome'], 'unchanged')
+
+    def test_stock_held_for_other_orders_is_not_taken(self):
+        result = self.bulk((self.second, 'ACCEPTED')).data['results'][0]
+        self.assertEqual(result['outcome'], 'insufficient_stock')
+        self.assertEqual(result['items'], [{'product_id': self.rice.pk, 'requested': 2, 'available': 1}])
+        self.assertEqual(Order.objects.get(pk=self.second).status, 'PENDING')
+        self.rice.refresh_from_db()
+        self.assertEqual((self.rice.stock, self.rice.reserved), (4, 5))
+
+    def test_oldest_orders_get_the_stock_first(self):
+        StockHold.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+        call_command('release_expired_holds', stdout=StringIO())
+        results = self.bulk((self.second, 'ACCEPTED'), (self.first, 'ACCEPTED')).data['results']
+        self.assertEqual([(result['order_id'], result['outcome']) for result in results],
+                         [(self.second, 'insufficient_stock'), (self.first, 'updated')])
+
+    def test_an_order_listed_twice_is_refused(self):
+        response = self.bulk((self.first, 'ACCEPTED'), (self.first, 'REJECTED'))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Order.objects.get(pk=self.first).status, 'PENDING')
+
+
+class IdempotentOrderTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.shop = self.make_shop()
+        self.customer = self.shop.test_customers[0]
+        self.rice = self.make_product(self.shop, 'Rice', stock=10)
+
+    def checkout(self, quantity, key='checkout-1', customer=None):
+        return self.place_order(customer or self.customer, self.shop, {self.rice: quantity}, HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_the_first_response(self):
+        first = self.checkout(2)
+        retry = self.checkout(2)
+        self.assertEqual((first.status_code, retry.status_code), (201, 201))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.data['id'], first.data['id'])
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(ShopOrderStats.objects.get(shop=self.shop).pending_count, 1)
+        self.rice.refresh_from_db()
+        self.assertEqual(self.rice.reserved, 2)
+
+    def test_key_reused_with_another_body_is_refused(self):
+        self.checkout(2)
+        self.assertEqual(self.checkout(3).status_code, 422)
+        self.assertEqual(self.checkout(3, key='x' * 256).status_code, 400)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_keys_are_per_customer_and_expire(self):
+        other = self.make_user('9000001999')
+        ShopCustomer.objects.create(shop=self.shop, customer=other)
+        self.checkout(2)
+        self.assertNotIn('Idempotent-Replayed', self.checkout(2, customer=other))
+
+        IdempotencyKey.objects.update(expires_at=timezone.now())
+        self.assertNotIn('Idempotent-Replayed', self.checkout(2))
+        self.assertEqual(Order.objects.count(), 3)
+
+
+class OrderArchiveTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.shop = self.make_shop()
+        rice = self.make_product(self.shop, 'Rice')
+        self.customer = self.shop.test_customers[0]
+        self.delivered, self.rejected, self.pending, self.recent = [
+            self.place_order(self.customer, self.shop, {rice: 1}).data['id'] for _ in range(4)
+        ]
+        for order_id in (self.delivered, self.recent):
+            self.set_status(order_id, self.shop, 'ACCEPTED')
+            self.set_status(order_id, self.shop, 'DELIVERED')
+        self.set_status(self.rejected, self.shop, 'REJECTED')
+        Order.objects.exclude(pk=self.recent).update(updated_at=timezone.now() - timedelta(days=40))
+        call_command('archive_orders', batch_size=1, stdout=StringIO())
+
+    def test_only_old_finished_orders_move(self):
+        self.assertEqual(sorted(Order.objects.values_list('id', flat=True)), [self.pending, self.recent])
+        self.assertEqual(sorted(ArchivedOrder.objects.values_list('id', flat=True)), [self.delivered, self.rejected])
+        self.assertEqual(ArchivedOrderItem.objects.filter(order_id=self.delivered).count(), 1)
+
+    def test_history_merges_archived_orders_back_in(self):
+        client = self.client_for(self.customer)
+        ids = [order['id'] for order in client.get('/api/orders/my-orders/').data['results']]
+        self.assertEqual(ids, [self.recent, self.pending])
+        response = client.get('/api/orders/my-orders/?history=true&page_size=3')
+        self.assertEqual([order['id'] for order in response.data['results']], [self.recent, self.pending, self.rejected])
+        ids = [order['id'] for order in client.get(response.data['next']).data['results']]
+        self.assertEqual(ids, [self.delivered])
+
+    def test_archived_order_detail_needs_history(self):
+        client = self.client_for(self.customer)
+        self.assertEqual(client.get(f'/api/orders/{self.delivered}/').status_code, 404)
+        response = client.get(f'/api/orders/{self.delivered}/?history=true')
+        self.assertEqual((response.status_code, response.data['status']), (200, 'DELIVERED'))
+        self.assertEqual(response.data['order_items'][0]['product_name'], 'Rice')
+
+
+class SalesRollupTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.shop = self.make_shop()
+        self.rice = self.make_product(self.shop, 'Rice', price='10.00')
+        customer = self.shop.test_customers[0]
+        self.order_ids = [self.place_order(customer, self.shop, {self.rice: 2}).data['id'] for _ in range(2)]
+
+    def test_refresh_counts_accepted_orders(self):
+        self.set_status(self.order_ids[0], self.shop, 'ACCEPTED')
+        self.assertEqual(refresh_sales_rollups(full=True), 1)
+        day = DailyShopSales.objects.get(shop=self.shop)
+        self.assertEqual((day.order_count, day.item_count, str(day.revenue)), (1, 2, '20.00'))
+
+    def test_order_accepted_between_the_totals_queries(self):
+        item_totals = rollups._item_totals
+
+        def accept_then_read(model, **lookup):
+            Order.objects.filter(pk__in=self.order_ids).update(status='ACCEPTED', updated_at=timezone.now())
+            return item_totals(model, **lookup)
+
+        with mock.patch('orders.rollups._item_totals', side_effect=accept_then_read):
+            refresh_sales_rollups(full=True)
+        # The next run recomputes the bucket the order moved into
+        refresh_sales_rollups()
+        day = DailyShopSales.objects.get(shop=self.shop)
+        self.assertEqual((day.order_count, day.item_count, str(day.revenue)), (2, 4, '40.00'))
+
+    def test_analytics_reads_the_rollups(self):
+        for order_id in self.order_ids:
+            self.set_status(order_id, self.shop, 'ACCEPTED')
+        refresh_sales_rollups(full=True)
+        response = self.client_for(self.shop.owner).get(f'/api/orders/shops/{self.shop.pk}/analytics/?top=1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['totals']['revenue'], '40.00')
+        self.assertEqual(response.data['totals']['average_items_per_order'], '2.00')
+        self.assertEqual(response.data['top_products'], [
+            {'product_id': self.rice.pk, 'product_name': 'Rice', 'quantity': 4, 'revenue': '40.00'}
+        ])
+        self.assertEqual(len(response.data['daily']), 1)
+
+
+class OrderExportTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.shop = self.make_shop()
+        self.rice = self.make_product(self.shop, 'Rice', price='10.00')
+        self.dal = self.make_product(self.shop, 'Dal', price='2.50')
+        customer = self.shop.test_customers[0]
+        self.first = self.place_order(customer, self.shop, {self.rice: 1, self.dal: 2}).data['id']
+        self.second = self.place_order(customer, self.shop, {self.dal: 4}).data['id']
+        self.set_status(self.first, self.shop, 'REJECTED')
+        self.url = f'/api/orders/shops/{self.shop.pk}/orders/export/'
+
+    def export(self, **params):
+        response = self.client_for(self.shop.owner).get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_has_one_row_per_item_oldest_order_first(self):
+        rows = list(csv.DictReader(StringIO(self.export(type='csv'))))
+        self.assertEqual(
+            [(int(row['order_id']), row['product_name'], row['line_total']) for row in rows],
+            [(self.first, 'Rice', '10.00'), (self.first, 'Dal', '5.00'), (self.second, 'Dal', '10.00')]
+        )
+
+    def test_ndjson_nests_items_and_merges_the_archive(self):
+        Order.objects.filter(pk=self.first).update(updated_at=timezone.now() - timedelta(days=40))
+        call_command('archive_orders', stdout=StringIO())
+        self.assertEqual([json.loads(line)['order_id'] for line in self.export(type='ndjson').splitlines()], [self.second])
+
+        orders = [json.loads(line) for line in self.export(type='ndjson', history='true').splitlines()]
+        self.assertEqual([(order['order_id'], len(order['items'])) for order in orders], [(self.first, 2), (self.second, 1)])
+        self.assertEqual(orders[0]['customer']['mobile_number'], self.shop.test_customers[0].mobile_number)
+
+    def test_filters_and_type(self):
+        lines = self.export(type='ndjson', status='pending').splitlines()
+        self.assertEqual([json.loads(line)['order_id'] for line in lines], [self.second])
+        self.assertEqual(self.client_for(self.shop.owner).get(self.url, {'type': 'xlsx'}).status_code, 400)
+
+    async def test_asgi_sends_rows_as_they_are_read(self):
+        token = await sync_to_async(lambda: str(RefreshToken.for_user(self.shop.owner).access_token))()
+        scope = {
+            'type': 'http', 'method': 'GET', 'path': self.url, 'query_string': b'type=csv',
+            'headers': [(b'host', b'testserver'), (b'authorization', f'Bearer {token}'.encode())],
+        }
+        requests = asyncio.Queue()
+        requests.put_nowait({'type': 'http.request', 'body': b''})
+        read, chunks = [], []
+
+        def counted_rows(*querysets):
+            for row in item_rows(*querysets):
+                read.append(row)
+                yield row
+
+        async def send(message):
+            if message['type'] == 'http.response.body' and message.get('body'):
+                chunks.append((len(read), message['body']))
+
+        # Like the test client, keep the test's connection open across the request
+        for signal in (request_started, request_finished):
+            signal.disconnect(close_old_connections)
+            self.addCleanup(signal.connect, close_old_connections)
+        with mock.patch('orders.views.item_rows', counted_rows), mock.patch('orders.export.CHUNK_SIZE', 2):
+            await ASGIHandler()(scope, requests.get, send)
+
+        # The header and first row go out before the other rows are read
+        self.assertEqual([rows_read for rows_read, _ in chunks], [1, 3])
+        rows = list(csv.DictReader(StringIO(b''.join(chunk for _, chunk in chunks).decode())))
+        self.assertEqual([int(row['order_id']) for row in rows], [self.first, self.first, self.second])
+
+
+class StockHoldTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.shop = self.make_shop(customers=2)
+        self.rice = self.make_product(self.shop, 'Rice', stock=5)
+        self.order_id = self.place_order(self.shop.test_customers[0], self.shop, {self.rice: 3}).data['id']
+
+    def stock(self):
+        self.rice.refresh_from_db()
+        return self.rice.stock, self.rice.reserved, self.rice.available_stock
+
+    def test_checkout_holds_stock_until_the_order_is_accepted(self):
+        self.assertEqual(self.stock(), (5, 3, 2))
+        response = self.place_order(self.shop.test_customers[1], self.shop, {self.rice: 3})
+        self.assertEqual(response.status_code, 400)
+
+        self.assertEqual(self.set_status(self.order_id, self.shop, 'ACCEPTED').status_code, 200)
+        self.assertEqual(self.stock(), (2, 0, 2))
+        self.assertFalse(StockHold.objects.exists())
+
+    def test_expired_holds_are_released_by_the_sweeper(self):
+        StockHold.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+        call_command('release_expired_holds', batch_size=1, stdout=StringIO())
+        self.assertEqual(self.stock(), (5, 0, 5))
+        self.assertFalse(StockHold.objects.exists())
+
+        # The order can still be accepted from unreserved stock
+        self.assertEqual(self.set_status(self.order_id, self.shop, 'ACCEPTED').status_code, 200)
+        self.assertEqual(self.stock(), (2, 0, 2))
+
+    def test_deleting_a_pending_order_releases_its_holds(self):
+        Order.objects.filter(pk=self.order_id).delete()
+        self.assertEqual(self.stock(), (5, 0, 5))
+
+        # Also when the order goes with its customer
+        self.place_order(self.shop.test_customers[1], self.shop, {self.rice: 2})
+        self.assertEqual(self.stock(), (5, 2, 3))
+        self.shop.test_customers[1].delete()
+        self.assertEqual(self.stock(), (5, 0, 5))
+        self.assertFalse(StockHold.objects.exists())
+
+
+class StockHoldAdminTests(APITestCase):
+    def test_holds_cannot_be_deleted_without_releasing_stock(self):
+        request = RequestFactory().get('/admin/')
+        request.user = self.make_user('9999999999', role='SHOPKEEPER', is_staff=True, is_superuser=True)
+        hold_admin = admin.site._registry[StockHold]
+        self.assertFalse(hold_admin.has_delete_permission(request))
+        self.assertFalse(hold_admin.has_add_permission(request))
@@ -6,5 +6,10 @@ urlpatterns = [
     path('my-orders/', views.my_orders, name='my_orders'),
     path('<int:pk>/', views.order_detail, name='order_detail'),
     path('shops/<int:shop_id>/orders/list/', views.shop_orders, name='shop_orders'),
+    path('shops/<int:shop_id>/orders/export/', views.export_shop_orders, name='export_shop_orders'),
     path('<int:pk>/status/', views.update_order_status, name='update_order_status'),
+    path('bulk-status/', views.bulk_update_order_status, name='bulk_update_order_status'),
+    path('shops/<int:shop_id>/dashboard/', views.shop_dashboard, name='shop_dashboard'),
+    path('shops/<int:shop_id>/analytics/', views.shop_analytics, name='shop_analytics'),
+    path('stream/', views.order_event_stream, name='order_event_stream'),
 ]
\ No newline at end of file
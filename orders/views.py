@@ -1,45 +1,177 @@
-from rest_framework import status
+import json
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from rest_framework import serializers, status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
 from django.shortcuts import get_object_or_404
-from .models import Order, OrderItem
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from nearbasket.decorators import query_budget
+from nearbasket.pagination import KeysetPagination
+from .events import stream_events
+from .export import csv_stream, item_rows, ndjson_stream, stream_async
+from .models import (
+    ArchivedOrder, ArchivedOrderItem, DailyProductSales, DailyShopSales, IdempotencyKey, Order, OrderItem,
+    SalesRollupState, ShopOrderStats
+)
 from .serializers import (
     OrderSerializer, 
+    ArchivedOrderSerializer,
     CreateOrderSerializer, 
-    UpdateOrderStatusSerializer
+    UpdateOrderStatusSerializer,
+    BulkOrderStatusSerializer,
+    ShopOrderStatsSerializer,
+    DailyShopSalesSerializer,
+    SalesTotalsSerializer,
+    TopProductSerializer
 )
-from shops.models import Shop, ShopCustomer
+from shops.access import is_shop_customer
+from shops.models import Shop
 from products.models import Product
+from products.stock import InsufficientStock
+
+def filter_orders(orders, request, prefix=''):
+    """
+    Apply the ``status``, ``date_from`` and ``date_to`` query filters.
+    ``prefix`` points the lookups at a related order, e.g. ``'order__'``.
+    """
+    statuses = request.query_params.get('status')
+    if statuses:
+        statuses = [value.strip().upper() for value in statuses.split(',')]
+        valid = dict(Order.STATUS_CHOICES)
+        if any(value not in valid for value in statuses):
+            raise serializers.ValidationError({
+                'status': f"Status must be one of {', '.join(valid)}"
+            })
+        orders = orders.filter(**{prefix + 'status__in': statuses})
+    
+    for param, lookup in [('date_from', 'created_at__gte'), ('date_to', 'created_at__lt')]:
+        value = request.query_params.get(param)
+        if not value:
+            continue
+        day = parse_date(value)
+        if day is None:
+            raise serializers.ValidationError({param: 'Date must be in YYYY-MM-DD format'})
+        if param == 'date_to':
+            day += timedelta(days=1)
+        start = timezone.make_aware(datetime.combine(day, time.min))
+        orders = orders.filter(**{prefix + lookup: start})
+    
+    return orders
+
+def wants_history(request):
+    """True when the client asked to include archived orders with ``?history=true``"""
+    return request.query_params.get('history', '').lower() in ('1', 'true', 'yes')
+
+def paginate_orders(request, **lookup):
+    """
+    Keyset-paginated, filtered orders matching ``lookup``. With ``?history=true``
+    the archive tables are merged into the same listing.
+    """
+    context = {'request': request}
+    sources = [(OrderSerializer, Order.objects)]
+    if wants_history(request):
+        # Hot rows are read first: an order archived in between is then seen twice and deduplicated, never missed
+        sources.append((ArchivedOrderSerializer, ArchivedOrder.objects))
+    
+    querysets = [
+        serializer_class.setup_eager_loading(
+            filter_orders(manager.filter(**lookup), request),
+            context=context,
+            required=KeysetPagination.ordering_fields()
+        )
+        for serializer_class, manager in sources
+    ]
+    paginator = KeysetPagination()
+    page = paginator.paginate_querysets(querysets, request)
+    
+    rendered = {}
+    for serializer_class, manager in sources:
+        positions = [index for index, row in enumerate(page) if isinstance(row, manager.model)]
+        serializer = serializer_class([page[index] for index in positions], many=True, context=context)
+        rendered.update(zip(positions, serializer.data))
+    return paginator.get_paginated_response([rendered[index] for index in range(len(page))])
+
+def replay_idempotent(user, key, fingerprint):
+    """Return the stored response for ``key``, or None if it has not been used"""
+    entry = IdempotencyKey.lookup(user, key)
+    if entry is None:
+        return None
+    
+    if entry.fingerprint != fingerprint:
+        return Response({
+            'error': 'Idempotency-Key was already used with a different request'
+        }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+    
+    response = Response(json.loads(entry.response_body), status=entry.status_code)
+    response['Idempotent-Replayed'] = 'true'
+    return response
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@query_budget(26)
 def create_order(request, shop_id):
     if request.user.role != 'CUSTOMER':
         return Response({
             'error': 'Only customers can place orders'
         }, status=status.HTTP_403_FORBIDDEN)
     
-    shop = get_object_or_404(Shop, pk=shop_id)
+    # A retried request with a known Idempotency-Key gets the original response back
+    idempotency_key = request.headers.get('Idempotency-Key')
+    if idempotency_key is not None:
+        if not 0 < len(idempotency_key) <= 255:
+            return Response({
+                'error': 'Idempotency-Key must be between 1 and 255 characters'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        fingerprint = IdempotencyKey.fingerprint_request(request)
+        replay = replay_idempotent(request.user, idempotency_key, fingerprint)
+        if replay is not None:
+            return replay
     
-    # Check if customer is linked to shop
-    if not ShopCustomer.objects.filter(shop=shop, customer=request.user).exists():
+    # Check if customer is linked to shop, from the shop access cache
+    if not is_shop_customer(request.user, shop_id):
+        get_object_or_404(Shop.objects.only('id'), pk=shop_id)
         return Response({
             'error': 'You must be a customer of this shop to place orders'
         }, status=status.HTTP_403_FORBIDDEN)
     
     serializer = CreateOrderSerializer(
         data=request.data, 
-        context={'customer': request.user, 'shop': shop}
+        context={'customer': request.user, 'shop_id': shop_id}
     )
     
     if serializer.is_valid():
         try:
-            order = serializer.save()
-            return Response(
-                OrderSerializer(order).data, 
-                status=status.HTTP_201_CREATED
-            )
+            with transaction.atomic():
+                order = serializer.save()
+                order = OrderSerializer.setup_eager_loading(Order.objects).get(pk=order.pk)
+                data = OrderSerializer(order).data
+                if idempotency_key is not None:
+                    IdempotencyKey.store(
+                        request.user, idempotency_key, fingerprint, status.HTTP_201_CREATED, data
+                    )
+            return Response(data, status=status.HTTP_201_CREATED)
+        except IntegrityError:
+            # A concurrent request with the same key committed first
+            replay = idempotency_key and replay_idempotent(request.user, idempotency_key, fingerprint)
+            if replay:
+                return replay
+            raise
+        except InsufficientStock as e:
+            # Another checkout took the last units between validation and the hold
+            return Response({
+                'error': str(e),
+                'items': e.items
+            }, status=status.HTTP_409_CONFLICT)
         except Exception as e:
             return Response({
                 'error': str(e)
@@ -49,36 +181,50 @@ def create_order(request, shop_id):
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@query_budget(4)
 def my_orders(request):
     if request.user.role != 'CUSTOMER':
         return Response({
             'error': 'Only customers can view orders'
         }, status=status.HTTP_403_FORBIDDEN)
     
-    orders = Order.objects.filter(customer=request.user).order_by('-created_at')
-    serializer = OrderSerializer(orders, many=True)
-    return Response(serializer.data)
+    return paginate_orders(request, customer=request.user)
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@query_budget(4)
 def order_detail(request, pk):
-    order = get_object_or_404(Order, pk=pk)
+    serializer_class = OrderSerializer
+    order = OrderSerializer.setup_eager_loading(
+        Order.objects, context={'request': request}, required=['customer', 'shop__owner']
+    ).filter(pk=pk).first()
+    
+    # Finished orders may have been moved to the archive
+    if order is None and wants_history(request):
+        serializer_class = ArchivedOrderSerializer
+        order = ArchivedOrderSerializer.setup_eager_loading(
+            ArchivedOrder.objects, context={'request': request}, required=['customer', 'shop__owner']
+        ).filter(pk=pk).first()
+    
+    if order is None:
+        raise Http404('No Order matches the given query.')
     
     # Check permissions
-    if request.user.role == 'CUSTOMER' and order.customer != request.user:
+    if request.user.role == 'CUSTOMER' and order.customer_id != request.user.id:
         return Response({
             'error': 'Access denied'
         }, status=status.HTTP_403_FORBIDDEN)
-    elif request.user.role == 'SHOPKEEPER' and order.shop.owner != request.user:
+    elif request.user.role == 'SHOPKEEPER' and order.shop.owner_id != request.user.id:
         return Response({
             'error': 'Access denied'
         }, status=status.HTTP_403_FORBIDDEN)
     
-    serializer = OrderSerializer(order)
+    serializer = serializer_class(order, context={'request': request})
     return Response(serializer.data)
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@query_budget(5)
 def shop_orders(request, shop_id):
     if request.user.role != 'SHOPKEEPER':
         return Response({
@@ -87,26 +233,65 @@ def shop_orders(request, shop_id):
     
     shop = get_object_or_404(Shop, pk=shop_id)
     
-    if shop.owner != request.user:
+    if shop.owner_id != request.user.id:
         return Response({
             'error': 'Access denied'
         }, status=status.HTTP_403_FORBIDDEN)
     
-    orders = Order.objects.filter(shop=shop).order_by('-created_at')
-    serializer = OrderSerializer(orders, many=True)
-    return Response(serializer.data)
+    return paginate_orders(request, shop=shop)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@query_budget(1)
+def export_shop_orders(request, shop_id):
+    """Stream every matching order item of the shop as CSV or NDJSON"""
+    if request.user.role != 'SHOPKEEPER':
+        return Response({
+            'error': 'Only shopkeepers can export shop orders'
+        }, status=status.HTTP_403_FORBIDDEN)
+    
+    shop = get_object_or_404(Shop.objects.only('id', 'owner_id'), pk=shop_id)
+    
+    if shop.owner_id != request.user.id:
+        return Response({
+            'error': 'Access denied'
+        }, status=status.HTTP_403_FORBIDDEN)
+    
+    export_type = request.query_params.get('type', 'csv').lower()
+    if export_type not in ('csv', 'ndjson'):
+        return Response({
+            'error': 'type must be csv or ndjson'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    # Rows are read lazily while the response streams, outside this view's query budget
+    querysets = [filter_orders(OrderItem.objects.filter(order__shop=shop), request, prefix='order__')]
+    if wants_history(request):
+        querysets.append(filter_orders(ArchivedOrderItem.objects.filter(order__shop=shop), request, prefix='order__'))
+    rows = item_rows(*querysets)
+    
+    if export_type == 'csv':
+        content, content_type = csv_stream(rows), 'text/csv'
+    else:
+        content, content_type = ndjson_stream(rows), 'application/x-ndjson'
+    if isinstance(request._request, ASGIRequest):
+        content = stream_async(content)
+    response = StreamingHttpResponse(content, content_type=content_type)
+    filename = f"shop-{shop.id}-orders-{timezone.localdate().isoformat()}.{export_type}"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
 
 @api_view(['PUT'])
 @permission_classes([IsAuthenticated])
+@query_budget(15)
 def update_order_status(request, pk):
     if request.user.role != 'SHOPKEEPER':
         return Response({
             'error': 'Only shopkeepers can update order status'
         }, status=status.HTTP_403_FORBIDDEN)
     
-    order = get_object_or_404(Order, pk=pk)
+    order = get_object_or_404(Order.objects.select_related('shop'), pk=pk)
     
-    if order.shop.owner != request.user:
+    if order.shop.owner_id != request.user.id:
         return Response({
             'error': 'Access denied'
         }, status=status.HTTP_403_FORBIDDEN)
@@ -115,10 +300,185 @@ def update_order_status(request, pk):
     if serializer.is_valid():
         try:
             serializer.save()
+            order = OrderSerializer.setup_eager_loading(Order.objects).get(pk=order.pk)
             return Response(OrderSerializer(order).data)
+        except InsufficientStock as e:
+            return Response({
+                'error': str(e),
+                'items': e.items
+            }, status=status.HTTP_400_BAD_REQUEST)
+        except serializers.ValidationError as e:
+            return Response(e.detail, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             return Response({
                 'error': str(e)
             }, status=status.HTTP_400_BAD_REQUEST)
     
-    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@query_budget(20)
+def bulk_update_order_status(request):
+    """Accept, reject or deliver many of the shopkeeper's orders at once"""
+    if request.user.role != 'SHOPKEEPER':
+        return Response({
+            'error': 'Only shopkeepers can update order status'
+        }, status=status.HTTP_403_FORBIDDEN)
+    
+    shop_id = Shop.objects.filter(owner=request.user).values_list('id', flat=True).first()
+    if shop_id is None:
+        return Response({
+            'error': 'No shop found for this shopkeeper'
+        }, status=status.HTTP_404_NOT_FOUND)
+    
+    serializer = BulkOrderStatusSerializer(data=request.data, context={'shop_id': shop_id})
+    if serializer.is_valid():
+        try:
+            results = serializer.save()
+        except InsufficientStock as e:
+            # Only reachable if stock moved between our locked read and the update
+            return Response({
+                'error': 'Stock changed while updating orders, please retry',
+                'items': e.items
+            }, status=status.HTTP_409_CONFLICT)
+        return Response({'results': results})
+    
+    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@query_budget(1)
+def shop_dashboard(request, shop_id):
+    """Order counters and revenue for the shopkeeper's home screen"""
+    if request.user.role != 'SHOPKEEPER':
+        return Response({
+            'error': 'Only shopkeepers can view the shop dashboard'
+        }, status=status.HTTP_403_FORBIDDEN)
+    
+    shop = Shop.objects.select_related('order_stats').only(
+        'id', 'owner_id', *[f'order_stats__{field.name}' for field in ShopOrderStats._meta.concrete_fields]
+    ).filter(pk=shop_id).first()
+    if shop is None:
+        return Response({
+            'error': 'Shop not found'
+        }, status=status.HTTP_404_NOT_FOUND)
+    
+    if shop.owner_id != request.user.id:
+        return Response({
+            'error': 'Access denied'
+        }, status=status.HTTP_403_FORBIDDEN)
+    
+    try:
+        stats = shop.order_stats
+    except ShopOrderStats.DoesNotExist:
+        stats = ShopOrderStats(shop=shop)
+    
+    serializer = ShopOrderStatsSerializer(stats.as_of_today())
+    return Response(serializer.data)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@query_budget(4)
+def shop_analytics(request, shop_id):
+    """Daily revenue, basket size and top products for a date range, read from the sales rollups"""
+    if request.user.role != 'SHOPKEEPER':
+        return Response({
+            'error': 'Only shopkeepers can view shop analytics'
+        }, status=status.HTTP_403_FORBIDDEN)
+    
+    shop = get_object_or_404(Shop.objects.only('id', 'owner_id'), pk=shop_id)
+    
+    if shop.owner_id != request.user.id:
+        return Response({
+            'error': 'Access denied'
+        }, status=status.HTTP_403_FORBIDDEN)
+    
+    date_to = timezone.localdate()
+    date_from = date_to - timedelta(days=29)
+    for param in ['date_from', 'date_to']:
+        value = request.query_params.get(param)
+        if not value:
+            continue
+        day = parse_date(value)
+        if day is None:
+            return Response({param: 'Date must be in YYYY-MM-DD format'}, status=status.HTTP_400_BAD_REQUEST)
+        if param == 'date_from':
+            date_from = day
+        else:
+            date_to = day
+    if date_from > date_to:
+        return Response({
+            'error': 'date_from must not be after date_to'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        top = max(1, min(int(request.query_params.get('top', 10)), 50))
+    except ValueError:
+        return Response({'top': 'Must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    daily = list(DailyShopSales.objects.filter(shop=shop, day__range=(date_from, date_to)).order_by('day'))
+    top_products = (
+        DailyProductSales.objects.filter(shop=shop, day__range=(date_from, date_to))
+        .values('product_id', product_name=F('product__name'))
+        .annotate(units=Sum('quantity'), sales=Sum('revenue'))
+        .order_by('-sales', '-units')[:top]
+    )
+    
+    order_count = sum(row.order_count for row in daily)
+    item_count = sum(row.item_count for row in daily)
+    revenue = sum((row.revenue for row in daily), Decimal(0))
+    totals = {
+        'order_count': order_count,
+        'item_count': item_count,
+        'revenue': revenue,
+        'average_order_value': revenue / order_count if order_count else Decimal(0),
+        'average_items_per_order': Decimal(item_count) / order_count if order_count else Decimal(0),
+    }
+    
+    return Response({
+        'date_from': date_from,
+        'date_to': date_to,
+        'as_of': SalesRollupState.objects.filter(pk=1).values_list('high_water_mark', flat=True).first(),
+        'totals': SalesTotalsSerializer(totals).data,
+        'daily': DailyShopSalesSerializer(daily, many=True).data,
+        'top_products': TopProductSerializer(top_products, many=True).data,
+    })
+
+
+async def order_event_stream(request):
+    """Stream new orders and status changes for the shopkeeper's shop as server-sent events"""
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Method not allowed'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+    
+    try:
+        authenticated = await sync_to_async(JWTAuthentication().authenticate)(request)
+    except AuthenticationFailed as e:
+        return JsonResponse({'error': str(e.detail)}, status=status.HTTP_401_UNAUTHORIZED)
+    if authenticated is None:
+        return JsonResponse({
+            'error': 'Authentication credentials were not provided.'
+        }, status=status.HTTP_401_UNAUTHORIZED)
+    user = authenticated[0]
+    
+    if user.role != 'SHOPKEEPER':
+        return JsonResponse({
+            'error': 'Only shopkeepers can stream shop orders'
+        }, status=status.HTTP_403_FORBIDDEN)
+    
+    shop_id = await Shop.objects.filter(owner=user).values_list('id', flat=True).afirst()
+    if shop_id is None:
+        return JsonResponse({
+            'error': 'No shop found for this shopkeeper'
+        }, status=status.HTTP_404_NOT_FOUND)
+    
+    last_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    try:
+        last_id = int(last_id) if last_id else None
+    except ValueError:
+        return JsonResponse({'error': 'Invalid last event id'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    response = StreamingHttpResponse(stream_events(shop_id, last_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -1,9 +1,16 @@
 from django.contrib import admin
-from .models import Product
+from .models import CatalogueVersion, Product
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ['name', 'shop', 'price', 'stock', 'created_at']
+    list_display = ['name', 'shop', 'price', 'stock', 'reserved', 'created_at']
     list_filter = ['shop', 'created_at']
     search_fields = ['name', 'shop__name']
-    readonly_fields = ['created_at']
\ No newline at end of file
+    readonly_fields = ['reserved', 'created_at']
+
+
+@admin.register(CatalogueVersion)
+class CatalogueVersionAdmin(admin.ModelAdmin):
+    list_display = ['shop', 'version']
+    search_fields = ['shop__name']
+    readonly_fields = ['version']
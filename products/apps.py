@@ -1,6 +1,25 @@
 from django.apps import AppConfig
+from django.db import connections
+from django.db.models.signals import post_migrate, pre_delete
+
+
+def install_search_index(sender, using, **kwargs):
+    connection = connections[using]
+    if connection.vendor != 'sqlite' or 'products_product' not in connection.introspection.table_names():
+        return
+    from .search import install_sqlite_fts
+    install_sqlite_fts(connection)
 
 
 class ProductsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'products'
+
+    def ready(self):
+        # PostgreSQL gets its search indexes from migrations; SQLite's FTS5 table is kept here
+        post_migrate.connect(install_search_index, sender=self)
+
+        from .models import Product, product_deleted
+
+        # Catalogue sync and ETags need every delete, including queryset, admin bulk and shop cascade deletes
+        pre_delete.connect(product_deleted, sender=Product, dispatch_uid='Product_deleted')
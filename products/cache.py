@@ -0,0 +1,53 @@
+import hashlib
+import time
+import uuid
+from django.conf import settings
+from django.core.cache import caches
+
+
+def catalogue_cache():
+    return caches['catalogue']
+
+
+def catalogue_cache_key(request, shop):
+    variant = hashlib.sha256(f"{request.build_absolute_uri()}\x1f{request.accepted_media_type}".encode())
+    return f"catalogue:{shop.pk}:{variant.hexdigest()[:32]}"
+
+
+def get_or_build(key, etag, build):
+    """
+    Return the cached entry for ``key`` if it was built for ``etag``,
+    otherwise rebuild it with ``build()``.
+
+    Entries are dicts holding at least ``etag``. Concurrent misses are
+    coalesced with a short lock: the caller that takes it rebuilds, while
+    the others serve the previous (stale) entry if there is one or wait
+    for the rebuild. If the rebuild does not land within the lock timeout
+    the waiter builds for itself without caching.
+    """
+    cache = catalogue_cache()
+    entry = cache.get(key)
+    if entry is not None and entry['etag'] == etag:
+        return entry
+
+    lock_key = f"{key}:lock"
+    token = uuid.uuid4().hex
+    if cache.add(lock_key, token, timeout=settings.CATALOGUE_CACHE_LOCK_SECONDS):
+        try:
+            entry = build()
+            cache.set(key, entry)
+            return entry
+        finally:
+            if cache.get(lock_key) == token:
+                cache.delete(lock_key)
+
+    if entry is not None:
+        return entry
+
+    deadline = time.monotonic() + settings.CATALOGUE_CACHE_LOCK_SECONDS
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        entry = cache.get(key)
+        if entry is not None and entry['etag'] == etag:
+            return entry
+    return build()
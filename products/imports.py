@@ -0,0 +1,185 @@
+import codecs
+import csv
+import json
+from itertools import islice
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.serializers import as_serializer_error
+from .models import CatalogueVersion, Product
+from .serializers import ProductImportRowSerializer
+
+READ_SIZE = 64 * 1024
+
+# Columns an import may set on an existing product
+UPDATE_FIELDS = ['price', 'stock', 'product_image_url', 'description']
+
+MAX_REPORTED_ERRORS = 100
+
+
+class ImportFileError(Exception):
+    """Raised when an upload cannot be parsed as CSV or a JSON array"""
+
+
+def csv_rows(stream):
+    """Yield one dict per CSV record, read incrementally; blank cells count as missing"""
+    reader = csv.DictReader(codecs.getreader('utf-8-sig')(stream))
+    try:
+        for row in reader:
+            yield {key.strip(): value for key, value in row.items() if key and value not in (None, '')}
+    except (csv.Error, UnicodeDecodeError) as exc:
+        raise ImportFileError(f'Invalid CSV on line {reader.line_num}: {exc}')
+
+
+def json_rows(stream):
+    """
+    Yield the elements of a top-level JSON array one at a time, decoding
+    only as much of the stream as the next element needs.
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder('utf-8-sig')()
+    buffer, position, exhausted = '', 0, False
+
+    def fill():
+        nonlocal buffer, position, exhausted
+        try:
+            chunk = stream.read(READ_SIZE)
+            buffer = buffer[position:] + text.decode(chunk or b'', final=not chunk)
+        except UnicodeDecodeError as exc:
+            raise ImportFileError(f'Invalid JSON: {exc}')
+        position, exhausted = 0, not chunk
+
+    def skip(separators):
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position] in separators:
+                position += 1
+            if position < len(buffer) or exhausted:
+                return buffer[position:position + 1]
+            fill()
+
+    if skip(' \t\r\n') != '[':
+        raise ImportFileError('Invalid JSON: expected an array of products')
+    position += 1
+    expect_value = True
+    while True:
+        token = skip(' \t\r\n')
+        if token == ']':
+            return
+        if not expect_value:
+            if token != ',':
+                raise ImportFileError('Invalid JSON: expected "," or "]" between products')
+            position += 1
+            skip(' \t\r\n')
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError as exc:
+                # An element cut off by the end of the buffer decodes once more is read
+                if exhausted:
+                    raise ImportFileError(f'Invalid JSON: {exc.msg}')
+                fill()
+                continue
+            # A number ending exactly at the buffer edge may continue in the next chunk
+            if end == len(buffer) and not exhausted:
+                fill()
+                continue
+            break
+        position = end
+        expect_value = False
+        yield value
+
+
+def _batches(rows, size):
+    rows = enumerate(rows, start=1)
+    while batch := list(islice(rows, size)):
+        yield batch
+
+
+def import_products(shop, rows, batch_size=None, max_rows=None):
+    """
+    Upsert products into ``shop`` from an iterable of row dicts, keyed on
+    product name.
+
+    Rows are validated and written in batches: each batch costs one lookup
+    of the names it contains, one bulk INSERT and one bulk UPDATE. Invalid
+    rows are skipped and reported; a later row for the same name wins. The
+    whole import runs in one transaction and bumps the catalogue version
+    once. Returns ``{created, updated, error_count, errors}``.
+    """
+    batch_size = batch_size or settings.PRODUCT_IMPORT_BATCH_SIZE
+    max_rows = max_rows or settings.PRODUCT_IMPORT_MAX_ROWS
+    created = updated = error_count = 0
+    errors = []
+
+    def reject(row_number, detail):
+        nonlocal error_count
+        error_count += 1
+        if len(errors) < MAX_REPORTED_ERRORS:
+            errors.append({'row': row_number, 'errors': detail})
+
+    # One serializer validates every row; building its fields per row costs more than the INSERTs
+    validator = ProductImportRowSerializer(partial=True)
+
+    with transaction.atomic():
+        # Read one row past the limit so an oversized upload is reported, but never further
+        for batch in _batches(islice(rows, max_rows + 1), batch_size):
+            valid = {}
+            for number, row in batch:
+                if number > max_rows:
+                    reject(number, {'non_field_errors': [f'Imports are limited to {max_rows} rows']})
+                    continue
+                if not isinstance(row, dict):
+                    reject(number, {'non_field_errors': ['Each product must be an object']})
+                    continue
+                try:
+                    data = validator.run_validation(row)
+                except serializers.ValidationError as exc:
+                    reject(number, as_serializer_error(exc))
+                    continue
+                if 'name' not in data:
+                    reject(number, {'name': ['This field is required.']})
+                else:
+                    merged = valid.pop(data['name'], (number, {}))[1]
+                    valid[data['name']] = (number, {**merged, **data})
+
+            existing = {
+                product.name: product
+                for product in Product.objects.filter(shop=shop, name__in=list(valid))
+            }
+            new, changed, fields = [], [], set()
+            for name, (number, data) in valid.items():
+                product = existing.get(name)
+                if product is None:
+                    if 'price' not in data:
+                        reject(number, {'price': ['This field is required.']})
+                        continue
+                    new.append(Product(shop=shop, **data))
+                    continue
+                for field in UPDATE_FIELDS:
+                    if field in data:
+                        setattr(product, field, data[field])
+                        fields.add(field)
+                changed.append(product)
+
+            if new:
+                # A product created concurrently since the lookup is updated instead
+                Product.objects.bulk_create(
+                    new, update_conflicts=True, unique_fields=['shop', 'name'],
+                    update_fields=UPDATE_FIELDS + ['updated_at']
+                )
+            if changed:
+                # bulk_update() skips auto_now, so the change time is set here
+                now = timezone.now()
+                for product in changed:
+                    product.updated_at = now
+                Product.objects.bulk_update(changed, sorted(fields) + ['updated_at'])
+            created += len(new)
+            updated += len(changed)
+
+        if created or updated:
+            CatalogueVersion.bump(shop.pk)
+
+    errors.sort(key=lambda error: error['row'])
+    return {'created': created, 'updated': updated, 'error_count': error_count, 'errors': errors}
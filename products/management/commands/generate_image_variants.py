@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from nearbasket.images import generate_variants
+from products.models import Product
+from shops.models import Shop
+
+
+class Command(BaseCommand):
+    help = 'Render missing thumbnail variants for uploaded product photos and shop logos'
+
+    def handle(self, *args, **options):
+        sources = [
+            (Product, 'image_files', Product.image_variants_ready),
+            (Shop, 'logo_files', Shop.logo_variants_ready),
+        ]
+        rendered = failed = 0
+        for model, field, ready in sources:
+            # Uploads whose background rendering was lost, e.g. to a restart
+            pending = model.objects.filter(**{f'{field}__has_key': 'original'}).exclude(
+                **{f'{field}__has_key': 'thumbnail'}
+            ).values_list('pk', field)
+            for pk, files in pending.iterator():
+                try:
+                    generate_variants(files, lambda variants: ready(pk, variants), inline=True)
+                except Exception as exc:
+                    failed += 1
+                    self.stderr.write(f'{model.__name__} {pk}: {exc}')
+                else:
+                    rendered += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Rendered variants for {rendered} images ({failed} failed)'))
@@ -0,0 +1,26 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from products.models import ProductTombstone
+
+
+class Command(BaseCommand):
+    help = 'Delete records of deleted products older than the delta sync horizon, in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.PRODUCT_TOMBSTONE_TTL_DAYS,
+                            help='Keep tombstones from this many days back')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(days=options['days'])
+        deleted = 0
+        while True:
+            ids = list(ProductTombstone.objects.filter(updated_at__lt=before)
+                       .order_by('updated_at').values_list('id', flat=True)[:options['batch_size']])
+            if not ids:
+                break
+            deleted += ProductTombstone.objects.filter(id__in=ids).delete()[0]
+
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} product tombstones'))
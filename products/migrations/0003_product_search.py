@@ -0,0 +1,49 @@
+# Generated by Django 5.2.5 on 2026-10-17 20:52
+
+from django.db import migrations, models
+
+
+def create_postgres_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    from django.contrib.postgres.indexes import GinIndex
+    from django.contrib.postgres.search import SearchVector
+
+    Product = apps.get_model('products', 'Product')
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    # Must stay identical to products.search.product_search_vector() for the planner to use it
+    schema_editor.add_index(Product, GinIndex(
+        SearchVector('name', weight='A', config='simple') + SearchVector('description', weight='B', config='simple'),
+        name='product_search_idx',
+    ))
+    schema_editor.add_index(Product, GinIndex(
+        fields=['name'], opclasses=['gin_trgm_ops'], name='product_name_trgm_idx',
+    ))
+
+
+def drop_postgres_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS product_search_idx')
+    schema_editor.execute('DROP INDEX IF EXISTS product_name_trgm_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0002_initial'),
+        ('shops', '0003_alter_shop_unique_together_alter_shop_owner'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['shop', 'created_at', 'id'], name='product_shop_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['shop', 'price', 'id'], name='product_shop_price_idx'),
+        ),
+        # The SQLite FTS5 equivalent is created by products.apps after migrate
+        migrations.RunPython(create_postgres_search_indexes, drop_postgres_search_indexes),
+    ]
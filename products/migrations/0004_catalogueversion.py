@@ -0,0 +1,33 @@
+# Generated by Django 5.2.5 on 2026-10-17 20:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def create_versions(apps, schema_editor):
+    Shop = apps.get_model('shops', 'Shop')
+    CatalogueVersion = apps.get_model('products', 'CatalogueVersion')
+    CatalogueVersion.objects.bulk_create(
+        [CatalogueVersion(shop_id=shop_id) for shop_id in Shop.objects.values_list('id', flat=True)],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0003_product_search'),
+        ('shops', '0003_alter_shop_unique_together_alter_shop_owner'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogueVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveBigIntegerField(default=0)),
+                ('shop', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='catalogue_version', to='shops.shop')),
+            ],
+        ),
+        migrations.RunPython(create_versions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.5 on 2026-10-17 23:40
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def backfill_updated_at(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    Product.objects.update(updated_at=models.F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0004_catalogueversion'),
+        ('shops', '0003_alter_shop_unique_together_alter_shop_owner'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_updated_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['shop', 'updated_at', 'id'], name='product_shop_updated_idx'),
+        ),
+        migrations.CreateModel(
+            name='ProductTombstone',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='product_tombstones', to='shops.shop')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['shop', 'updated_at', 'id'], name='tombstone_shop_updated_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 21:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0005_product_updated_at_producttombstone'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='image_files',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
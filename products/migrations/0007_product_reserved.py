@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 21:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_product_image_files'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='reserved',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
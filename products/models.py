@@ -1,4 +1,7 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
+from django.utils import timezone
+from nearbasket.images import delete_images
 from django.core.exceptions import ValidationError
 from shops.models import Shop
 
@@ -7,12 +10,23 @@ class Product(models.Model):
     name = models.CharField(max_length=100)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     stock = models.PositiveIntegerField(default=0)
+    # Part of stock held for pending orders (see orders.holds), not available to other customers
+    reserved = models.PositiveIntegerField(default=0)
     product_image_url = models.URLField(blank=True, null=True)
+    # Uploaded photo and its generated variants, see nearbasket.images
+    image_files = models.JSONField(default=dict, blank=True)
     description = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Set on every change, including bulk stock and price updates, for catalogue delta sync
+    updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         unique_together = ['shop', 'name']
+        indexes = [
+            models.Index(fields=['shop', 'created_at', 'id'], name='product_shop_created_idx'),
+            models.Index(fields=['shop', 'price', 'id'], name='product_shop_price_idx'),
+            models.Index(fields=['shop', 'updated_at', 'id'], name='product_shop_updated_idx'),
+        ]
     
     def clean(self):
         super().clean()
@@ -23,7 +37,100 @@ class Product(models.Model):
     
     def save(self, *args, **kwargs):
         self.full_clean()
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # reserved only changes with F() updates (see products.stock); saving a loaded copy would undo newer holds
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields if not field.primary_key and field.name != 'reserved'
+            ]
         super().save(*args, **kwargs)
+        CatalogueVersion.bump(self.shop_id)
+    
+    @classmethod
+    def image_variants_ready(cls, pk, files):
+        """Store generated image variants unless the product's photo was replaced meanwhile"""
+        updated = cls.objects.filter(pk=pk, image_files__original=files['original']).update(
+            image_files=files, updated_at=timezone.now()
+        )
+        if updated:
+            CatalogueVersion.bump_for_products([pk])
+        return bool(updated)
+    
+    @property
+    def available_stock(self):
+        return max(self.stock - self.reserved, 0)
+    
+    def __str__(self):
+        return f"{self.name} - {self.shop.name}"
+
+
+class CatalogueVersion(models.Model):
+    """
+    Per-shop counter bumped whenever any of the shop's products changes,
+    used to build catalogue ETags. Only ever changed with F() updates so
+    concurrent bumps are never lost and a version is never reused.
+    """
+    shop = models.OneToOneField(Shop, on_delete=models.CASCADE, related_name='catalogue_version')
+    version = models.PositiveBigIntegerField(default=0)
+    
+    @classmethod
+    def bump(cls, shop_id):
+        if cls.objects.filter(shop_id=shop_id).update(version=F('version') + 1):
+            return
+        
+        # First change for this shop: create the row, then bump it
+        try:
+            with transaction.atomic():
+                cls.objects.create(shop_id=shop_id)
+        except IntegrityError:
+            pass
+        cls.objects.filter(shop_id=shop_id).update(version=F('version') + 1)
+    
+    @classmethod
+    def bump_for_products(cls, product_ids):
+        """Bump the shops owning ``product_ids`` with a single UPDATE"""
+        cls.objects.filter(shop__products__in=list(product_ids)).update(version=F('version') + 1)
+    
+    @staticmethod
+    def for_shop(shop):
+        """Current version of a shop loaded with ``select_related('catalogue_version')``"""
+        try:
+            return shop.catalogue_version.version
+        except CatalogueVersion.DoesNotExist:
+            return 0
     
     def __str__(self):
-        return f"{self.name} - {self.shop.name}"
\ No newline at end of file
+        return f"{self.shop.name} catalogue v{self.version}"
+
+
+class ProductTombstone(models.Model):
+    """
+    Record of a deleted product, so clients syncing the catalogue learn
+    about deletes. Keyed by the deleted product's id, which is never
+    reused, and ordered by ``updated_at`` like live products so both can
+    be read as one change feed. Purged by ``purge_product_tombstones``.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    shop = models.ForeignKey(Shop, on_delete=models.CASCADE, related_name='product_tombstones')
+    # When the product was deleted
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['shop', 'updated_at', 'id'], name='tombstone_shop_updated_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Deleted product {self.id} of shop {self.shop_id}"
+
+
+def product_deleted(sender, instance, **kwargs):
+    """
+    Leave a tombstone for a product about to be deleted and bump its
+    shop's catalogue version, however it is deleted. Sent before the
+    delete's cascades run, so when the whole shop is being deleted both
+    go with it. The product's photo files are removed once it commits.
+    """
+    ProductTombstone.objects.create(id=instance.pk, shop_id=instance.shop_id)
+    CatalogueVersion.bump(instance.shop_id)
+    image_files = instance.image_files
+    transaction.on_commit(lambda: delete_images(image_files), robust=True)
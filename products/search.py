@@ -0,0 +1,117 @@
+import re
+from django.db import connections
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+# SQLite full-text index over Product.name and description, kept in step by triggers
+SQLITE_FTS_TABLE = 'products_product_fts'
+SQLITE_FTS_SQL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_FTS_TABLE} USING fts5(
+        name, description, content='products_product', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TABLE}_insert AFTER INSERT ON products_product BEGIN
+        INSERT INTO {SQLITE_FTS_TABLE}(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TABLE}_delete AFTER DELETE ON products_product BEGIN
+        INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TABLE}_update AFTER UPDATE OF name, description ON products_product BEGIN
+        INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO {SQLITE_FTS_TABLE}(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END""",
+]
+
+# Name matches weigh more than description matches
+NAME_WEIGHT, DESCRIPTION_WEIGHT = 10.0, 1.0
+
+MAX_TERMS = 10
+
+
+def search_terms(query):
+    """Split free text into plain word tokens, safe to build engine-specific queries from"""
+    return re.findall(r'\w+', query.lower())[:MAX_TERMS]
+
+
+def install_sqlite_fts(connection):
+    """
+    Create the FTS5 table and its sync triggers if they are missing.
+
+    Run after every migrate: SQLite migrations that rebuild the product
+    table drop its triggers, so they are recreated here and the index is
+    rebuilt from the table whenever that happens.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE %s",
+            [f'{SQLITE_FTS_TABLE}_%'],
+        )
+        if cursor.fetchone()[0] == 3:
+            return
+        for statement in SQLITE_FTS_SQL:
+            cursor.execute(statement)
+        cursor.execute(f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}) VALUES ('rebuild')")
+
+
+def product_search_vector():
+    """The tsvector the PostgreSQL GIN index is built on; queries must use exactly this expression"""
+    from django.contrib.postgres.search import SearchVector
+
+    return (
+        SearchVector('name', weight='A', config='simple')
+        + SearchVector('description', weight='B', config='simple')
+    )
+
+
+def _search_postgresql(queryset, terms, query):
+    from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
+
+    # Every term must match, each as a prefix so partial words find results while typing
+    search = SearchQuery(' & '.join(f'{term}:*' for term in terms), search_type='raw', config='simple')
+    return queryset.alias(search_vector=product_search_vector()).filter(
+        # Trigram similarity on the name catches typos the word index cannot
+        Q(search_vector=search) | Q(name__trigram_similar=query)
+    ).annotate(
+        search_rank=SearchRank(F('search_vector'), search) + TrigramSimilarity('name', query)
+    )
+
+
+def _search_sqlite(queryset, terms):
+    match = ' '.join(f'"{term}"*' for term in terms)
+    return queryset.extra(
+        tables=[SQLITE_FTS_TABLE],
+        where=[f'{SQLITE_FTS_TABLE}.rowid = products_product.id', f'{SQLITE_FTS_TABLE} MATCH %s'],
+        params=[match],
+    ).annotate(
+        # bm25() is lower for better matches
+        search_rank=RawSQL(
+            f'-bm25({SQLITE_FTS_TABLE}, %s, %s)', [NAME_WEIGHT, DESCRIPTION_WEIGHT], output_field=FloatField()
+        )
+    )
+
+
+def search_products(queryset, query):
+    """
+    Narrow a Product queryset to matches for ``query`` and annotate each
+    row with ``search_rank`` (higher is more relevant).
+
+    PostgreSQL uses the weighted tsvector and name trigram GIN indexes,
+    SQLite the FTS5 table. Other databases fall back to unindexed
+    ``icontains`` matching with a constant rank.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return queryset.annotate(search_rank=Value(0.0, output_field=FloatField())).none()
+
+    vendor = connections[queryset.db].vendor
+    if vendor == 'postgresql':
+        return _search_postgresql(queryset, terms, query)
+    if vendor == 'sqlite':
+        return _search_sqlite(queryset, terms)
+
+    condition = Q()
+    for term in terms:
+        condition &= Q(name__icontains=term) | Q(description__icontains=term)
+    return queryset.filter(condition).annotate(search_rank=Value(0.0, output_field=FloatField()))
@@ -1,14 +1,17 @@
+from django.conf import settings
 from rest_framework import serializers
-from .models import Product
+from .models import Product, ProductTombstone
+from nearbasket.serializers import DynamicFieldsMixin, EagerLoadingMixin, ImageFilesField
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(DynamicFieldsMixin, EagerLoadingMixin, serializers.ModelSerializer):
     shop_name = serializers.CharField(source='shop.name', read_only=True)
+    images = ImageFilesField(source='image_files')
     
     class Meta:
         model = Product
-        fields = ['id', 'name', 'price', 'stock', 'product_image_url', 
-                 'description', 'created_at', 'shop_name']
-        read_only_fields = ['id', 'created_at', 'shop_name']
+        fields = ['id', 'name', 'price', 'stock', 'available_stock', 'product_image_url', 'images',
+                 'description', 'created_at', 'updated_at', 'shop_name']
+        read_only_fields = ['id', 'available_stock', 'created_at', 'updated_at', 'shop_name']
     
     def validate_price(self, value):
         if value <= 0:
@@ -19,6 +22,18 @@ class ProductSerializer(serializers.ModelSerializer):
         if value < 0:
             raise serializers.ValidationError("Stock cannot be negative")
         return value
+    
+    def update(self, instance, validated_data):
+        # Only write the edited columns, so stock changed by an order meanwhile is kept
+        for field, value in validated_data.items():
+            setattr(instance, field, value)
+        instance.save(update_fields=[*validated_data, 'updated_at'])
+        return instance
+
+class ProductTombstoneSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ProductTombstone
+        fields = ['id', 'updated_at']
 
 class ProductCreateSerializer(serializers.ModelSerializer):
     class Meta:
@@ -27,4 +42,46 @@ class ProductCreateSerializer(serializers.ModelSerializer):
     
     def create(self, validated_data):
         validated_data['shop'] = self.context['shop']
-        return super().create(validated_data)
\ No newline at end of file
+        return super().create(validated_data)
+
+class ProductImportRowSerializer(serializers.ModelSerializer):
+    """One row of a bulk import; rows are matched to existing products by name"""
+    
+    class Meta:
+        model = Product
+        fields = ['name', 'price', 'stock', 'product_image_url', 'description']
+        validators = []
+    
+    def validate_price(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("Price must be greater than 0")
+        return value
+
+class ProductAdjustmentSerializer(serializers.Serializer):
+    stock = serializers.IntegerField(min_value=0, required=False)
+    stock_delta = serializers.IntegerField(required=False)
+    price = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+    
+    def validate_price(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("Price must be greater than 0")
+        return value
+    
+    def validate(self, data):
+        if not data:
+            raise serializers.ValidationError("Give stock, stock_delta or price")
+        if 'stock' in data and 'stock_delta' in data:
+            raise serializers.ValidationError("Give either stock or stock_delta, not both")
+        return data
+
+class ProductSyncSerializer(serializers.Serializer):
+    """Set or adjust stock and prices for many of one shop's products at once"""
+    key = serializers.ChoiceField(choices=['id', 'name'], default='id')
+    products = serializers.DictField(child=ProductAdjustmentSerializer(), allow_empty=False)
+    
+    def validate_products(self, value):
+        if len(value) > settings.PRODUCT_SYNC_MAX_ITEMS:
+            raise serializers.ValidationError(
+                f"At most {settings.PRODUCT_SYNC_MAX_ITEMS} products can be synced at once"
+            )
+        return value
@@ -0,0 +1,205 @@
+from django.db import connections, transaction
+from django.db.models import Case, DecimalField, F, IntegerField, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from .models import CatalogueVersion, Product
+
+# Products set per UPDATE statement when syncing stock and prices
+SYNC_BATCH_SIZE = 1000
+
+# Join the new values in as a VALUES table: (id, stock, stock_delta, price), NULL where not given
+SYNC_UPDATE_SQL = """
+    UPDATE products_product SET
+        stock = CASE
+            WHEN changes.column2 IS NOT NULL THEN CAST(changes.column2 AS INTEGER)
+            WHEN changes.column3 IS NOT NULL THEN {greatest}(products_product.stock + CAST(changes.column3 AS INTEGER), 0)
+            ELSE products_product.stock
+        END,
+        price = COALESCE(CAST(changes.column4 AS NUMERIC), products_product.price),
+        updated_at = %s
+    FROM (VALUES {rows}) AS changes
+    WHERE products_product.id = changes.column1
+"""
+
+
+class InsufficientStock(Exception):
+    """Raised when one or more products cannot cover the requested quantity"""
+
+    def __init__(self, items):
+        self.items = items
+        super().__init__('Not enough stock for some items')
+
+
+def _quantity_case(quantities):
+    return Case(
+        *[When(pk=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+
+
+def _take_available(quantities, released=None, **values):
+    """
+    Apply ``values`` to the products in ``{product_id: quantity}`` in a single
+    UPDATE, only if every one of them has that quantity available (stock
+    not already reserved). ``released`` quantities are taken off the
+    reservations in the same UPDATE and count as available. Otherwise
+    nothing is changed and ``InsufficientStock`` is raised listing every
+    failing product.
+    """
+    released = released or {}
+    reserved = F('reserved')
+    if released:
+        reserved = reserved - _quantity_case(released)
+        values['reserved'] = reserved
+    with transaction.atomic():
+        updated = Product.objects.filter(
+            pk__in=list(quantities), stock__gte=reserved + _quantity_case(quantities)
+        ).update(**values, updated_at=timezone.now())
+
+        if updated == len(quantities):
+            CatalogueVersion.bump_for_products(quantities)
+            return
+        transaction.set_rollback(True)
+
+    found = {
+        row['id']: row
+        for row in Product.objects.filter(pk__in=list(quantities)).values('id', 'name', 'stock', 'reserved')
+    }
+
+    items = []
+    for product_id, quantity in quantities.items():
+        row = found.get(product_id)
+        available = max(row['stock'] - row['reserved'] + released.get(product_id, 0), 0) if row else 0
+        if row is not None and available >= quantity:
+            continue
+        items.append({
+            'product_id': product_id,
+            'product_name': row['name'] if row else None,
+            'requested': quantity,
+            'available': available,
+        })
+    raise InsufficientStock(items)
+
+
+def decrement_stock(quantities, held=None):
+    """
+    Take ``{product_id: quantity}`` out of stock in a single UPDATE.
+
+    Each row is only updated while enough unreserved stock is left, so
+    concurrent callers can never drive stock negative, eat into other
+    orders' holds or lose an update. ``held`` is what was reserved for the
+    order itself (see ``orders.holds``) and is released by the same UPDATE.
+    """
+    if not quantities:
+        release_reserved_stock(held)
+        return
+
+    _take_available(quantities, released=held, stock=F('stock') - _quantity_case(quantities))
+
+
+def reserve_stock(quantities):
+    """
+    Hold ``{product_id: quantity}`` for a pending order in a single UPDATE,
+    on the same terms as ``decrement_stock``. Held stock stays in ``stock``
+    but is no longer available to anyone else.
+    """
+    if not quantities:
+        return
+
+    _take_available(quantities, reserved=F('reserved') + _quantity_case(quantities))
+
+
+def release_reserved_stock(quantities):
+    """Make held ``{product_id: quantity}`` available again in a single UPDATE"""
+    if not quantities:
+        return
+
+    Product.objects.filter(pk__in=list(quantities)).update(
+        reserved=F('reserved') - _quantity_case(quantities), updated_at=timezone.now()
+    )
+    CatalogueVersion.bump_for_products(quantities)
+
+
+def restore_stock(quantities):
+    """Put ``{product_id: quantity}`` back into stock in a single UPDATE"""
+    if not quantities:
+        return
+
+    Product.objects.filter(pk__in=list(quantities)).update(
+        stock=F('stock') + _quantity_case(quantities), updated_at=timezone.now()
+    )
+    CatalogueVersion.bump_for_products(quantities)
+
+
+def adjust_products(shop_id, changes, key='id'):
+    """
+    Apply ``{key: {stock | stock_delta, price}}`` to a shop's products,
+    matched by ``id`` or ``name``.
+
+    Each batch of products costs one lookup and one UPDATE joined against
+    the batch's new values, so a sync of thousands of products is a
+    handful of statements. ``stock_delta`` is added to the stored stock in
+    the database, never below zero. Returns the keys that matched nothing.
+    """
+    items = list(changes.items())
+    unmatched = []
+
+    with transaction.atomic():
+        for start in range(0, len(items), SYNC_BATCH_SIZE):
+            batch = items[start:start + SYNC_BATCH_SIZE]
+            if key == 'id':
+                lookups = {int(name): name for name, _ in batch if name.isdigit()}
+            else:
+                lookups = {name: name for name, _ in batch}
+            ids = {
+                lookups[value]: product_id
+                for value, product_id in Product.objects.filter(
+                    shop_id=shop_id, **{f'{key}__in': list(lookups)}
+                ).values_list(key, 'id')
+            }
+
+            rows = []
+            for name, change in batch:
+                if name not in ids:
+                    unmatched.append(name)
+                    continue
+                rows.append((ids[name], change.get('stock'), change.get('stock_delta'), change.get('price')))
+            if rows:
+                _update_products(rows)
+
+        if len(unmatched) < len(items):
+            CatalogueVersion.bump(shop_id)
+
+    return unmatched
+
+
+def _update_products(rows):
+    """Write ``(id, stock, stock_delta, price)`` rows in one UPDATE"""
+    connection = connections[Product.objects.db]
+    if connection.vendor in ('postgresql', 'sqlite'):
+        greatest = 'MAX' if connection.vendor == 'sqlite' else 'GREATEST'
+        placeholders = ', '.join(['(%s, %s, %s, %s)'] * len(rows))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                SYNC_UPDATE_SQL.format(greatest=greatest, rows=placeholders),
+                [connection.ops.adapt_datetimefield_value(timezone.now())] + [value for row in rows for value in row],
+            )
+        return
+
+    # Other databases have no UPDATE ... FROM; build the same CASE with the ORM
+    stock, price = [], []
+    for product_id, new_stock, delta, new_price in rows:
+        if new_stock is not None:
+            stock.append(When(pk=product_id, then=Value(new_stock)))
+        elif delta is not None:
+            stock.append(When(pk=product_id, then=Greatest(F('stock') + Value(delta), Value(0))))
+        if new_price is not None:
+            price.append(When(pk=product_id, then=Value(new_price)))
+
+    values = {'updated_at': timezone.now()}
+    if stock:
+        values['stock'] = Case(*stock, default=F('stock'), output_field=IntegerField())
+    if price:
+        values['price'] = Case(*price, default=F('price'), output_field=DecimalField(max_digits=10, decimal_places=2))
+    Product.objects.filter(pk__in=[row[0] for row in rows]).update(**values)
@@ -1,3 +1,416 @@
-from django.test import TestCase
+import io
+import json
+import shutil
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from nearbasket.testing import APITestCase
+from orders.models import Order
+from .cache import catalogue_cache, get_or_build
+from .models import Product, ProductTombstone
 
-# Create your tests here.
+
+class ProductSearchTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.shop = self.make_shop()
+        self.client = self.client_for(self.shop.test_customers[0])
+        self.url = f'/api/products/shops/{self.shop.pk}/products/'
+        self.make_product(self.shop, 'Fresh Tomatoes', price='50.00', description='Red and ripe')
+        self.make_product(self.shop, 'Tomato Ketchup', price='120.00', stock=0)
+        self.make_product(self.shop, 'Basmati Rice', price='90.00', description='Goes well with tomato curry')
+        self.make_product(self.make_shop('9100000000'), 'Cherry Tomatoes')
+
+    def names(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        # Plain catalogue pages come from the rendered page cache, not a DRF Response
+        return [product['name'] for product in response.json()['results']]
+
+    def test_words_match_as_prefixes_and_names_rank_first(self):
+        self.assertEqual(self.names(q='tomat')[-1], 'Basmati Rice')
+        self.assertEqual(set(self.names(q='tomat')), {'Fresh Tomatoes', 'Tomato Ketchup', 'Basmati Rice'})
+        self.assertEqual(self.names(q='fresh tomat'), ['Fresh Tomatoes'])
+        self.assertEqual(self.names(q='mango'), [])
+
+    def test_filters_and_sorting(self):
+        self.assertEqual(self.names(min_price='60', max_price='100'), ['Basmati Rice'])
+        self.assertEqual(self.names(q='tomat', in_stock='true', sort='price'), ['Fresh Tomatoes', 'Basmati Rice'])
+        self.assertEqual(self.names(sort='-price', page_size=2), ['Tomato Ketchup', 'Basmati Rice'])
+        self.assertEqual(self.client.get(self.url, {'sort': 'colour'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'min_price': 'cheap'}).status_code, 400)
+
+    def test_renamed_product_is_found_by_its_new_name(self):
+        product = Product.objects.get(name='Basmati Rice')
+        product.name = 'Sona Masoori'
+        product.save()
+        self.assertEqual(self.names(q='sona'), ['Sona Masoori'])
+        self.assertEqual(self.names(q='basmati'), [])
+
+
+class CatalogueETagTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.shop = self.make_shop()
+        self.customer = self.shop.test_customers[0]
+        self.client = self.client_for(self.customer)
+        self.rice = self.make_product(self.shop, 'Rice', stock=10)
+        self.list_url = f'/api/products/shops/{self.shop.pk}/products/'
+        self.detail_url = f'{self.list_url}{self.rice.pk}/'
+
+    def revalidate(self, url):
+        etag = self.client.get(url)['ETag']
+        return etag, self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_unchanged_catalogue_answers_304(self):
+        for url in (self.list_url, self.detail_url, f'{self.list_url}?q=rice'):
+            etag, response = self.revalidate(url)
+            self.assertEqual((response.status_code, response.content), (304, b''))
+            self.assertEqual(response['ETag'], etag)
+        self.assertNotEqual(self.client.get(self.list_url)['ETag'], self.client.get(self.detail_url)['ETag'])
+
+    def test_accepted_orders_and_edits_change_the_etag(self):
+        etag, _ = self.revalidate(self.list_url)
+        order_id = self.place_order(self.customer, self.shop, {self.rice: 2}).data['id']
+        self.set_status(order_id, self.shop, 'ACCEPTED')
+        response = self.client.get(self.list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['stock'], 8)
+
+        etag = response['ETag']
+        self.shop.name = 'Corner Store & Bakery'
+        self.shop.save()
+        self.assertEqual(self.client.get(self.list_url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_queryset_deletes_change_the_etag(self):
+        self.make_product(self.shop, 'Dal')
+        etag, _ = self.revalidate(self.list_url)
+        Product.objects.filter(pk=self.rice.pk).delete()
+        response = self.client.get(self.list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([product['name'] for product in response.json()['results']], ['Dal'])
+
+
+class CataloguePageCacheTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.shop = self.make_shop()
+        self.client = self.client_for(self.shop.test_customers[0])
+        self.url = f'/api/products/shops/{self.shop.pk}/products/'
+        self.make_product(self.shop, 'Rice')
+
+    def test_repeat_reads_do_not_query_products(self):
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(any('products_product' in query['sql'] for query in queries))
+
+        self.make_product(self.shop, 'Dal')
+        self.assertEqual(len(self.client.get(self.url).json()['results']), 2)
+
+    def test_concurrent_miss_serves_the_stale_entry(self):
+        cache = catalogue_cache()
+        cache.set('page', {'etag': 'old', 'content': b'stale'})
+        cache.add('page:lock', 'another worker')
+        build = mock.Mock(return_value={'etag': 'new', 'content': b'fresh'})
+        self.assertEqual(get_or_build('page', 'new', build)['content'], b'stale')
+        build.assert_not_called()
+
+        cache.delete('page:lock')
+        self.assertEqual(get_or_build('page', 'new', build)['content'], b'fresh')
+        self.assertEqual(cache.get('page')['etag'], 'new')
+        self.assertFalse(cache.get('page:lock'))
+
+    @override_settings(CATALOGUE_CACHE_LOCK_SECONDS=0.1)
+    def test_cold_miss_builds_for_itself_when_the_lock_holder_stalls(self):
+        catalogue_cache().add('page:lock', 'another worker')
+        build = mock.Mock(return_value={'etag': 'new', 'content': b'fresh'})
+        self.assertEqual(get_or_build('page', 'new', build)['content'], b'fresh')
+        self.assertIsNone(catalogue_cache().get('page'))
+
+
+class ProductImportTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.shop = self.make_shop()
+        self.keeper = self.client_for(self.shop.owner)
+        self.url = f'/api/products/shops/{self.shop.pk}/products/import/'
+        self.make_product(self.shop, 'Bread', price='30.00', stock=5, description='Whole wheat')
+
+    def catalogue(self):
+        return list(Product.objects.filter(shop=self.shop).order_by('name').values_list('name', 'price', 'stock', 'description'))
+
+    def test_csv_upserts_by_name_and_skips_bad_rows(self):
+        body = 'name,price,stock,description\nFresh Tomatoes,40.00,100,Farm fresh\nBread,,25,\nMilk,-1,10,\n'
+        response = self.keeper.generic('POST', self.url, body, content_type='text/csv')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['created'], response.data['updated'], response.data['error_count']), (1, 1, 1))
+        self.assertEqual(response.data['errors'][0]['row'], 3)
+        self.assertEqual(self.catalogue(), [
+            ('Bread', Decimal('30.00'), 25, 'Whole wheat'),
+            ('Fresh Tomatoes', Decimal('40.00'), 100, 'Farm fresh'),
+        ])
+
+    def test_json_upload_with_a_repeated_name_keeps_the_last_row(self):
+        rows = [{'name': 'Dal', 'price': '80.00', 'stock': 1}, {'name': 'Dal', 'price': '85.00', 'stock': 2}]
+        upload = SimpleUploadedFile('products.json', json.dumps(rows).encode(), content_type='application/json')
+        response = self.keeper.post(self.url, {'file': upload})
+        self.assertEqual((response.status_code, response.data['created']), (200, 1))
+        self.assertEqual(self.catalogue()[1], ('Dal', Decimal('85.00'), 2, None))
+
+    def test_unreadable_uploads_import_nothing(self):
+        response = self.keeper.generic('POST', self.url, '{"name": "Dal"}', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.keeper.generic('POST', self.url, 'x', content_type='text/plain').status_code, 415)
+        customer = self.client_for(self.shop.test_customers[0])
+        self.assertEqual(customer.generic('POST', self.url, '[]', content_type='application/json').status_code, 403)
+        self.assertEqual(len(self.catalogue()), 1)
+
+
+class ProductSyncTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.shop = self.make_shop()
+        self.keeper = self.client_for(self.shop.owner)
+        self.url = f'/api/products/shops/{self.shop.pk}/products/sync/'
+        self.rice = self.make_product(self.shop, 'Rice', price='10.00', stock=10)
+        self.dal = self.make_product(self.shop, 'Dal', price='20.00', stock=4)
+
+    def catalogue(self):
+        return list(Product.objects.order_by('name').values_list('name', 'price', 'stock'))
+
+    def test_sync_by_id(self):
+        response = self.keeper.post(self.url, {'products': {
+            str(self.rice.pk): {'stock': 7, 'price': '11.50'}, str(self.dal.pk): {'stock_delta': 3}, '999999': {'stock': 1},
+        }}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'updated': 2, 'unmatched': ['999999']})
+        self.assertEqual(self.catalogue(), [('Dal', Decimal('20.00'), 7), ('Rice', Decimal('11.50'), 7)])
+
+    def test_sync_by_name_never_takes_stock_below_zero(self):
+        response = self.keeper.post(self.url, {'key': 'name', 'products': {'Dal': {'stock_delta': -10}}}, format='json')
+        self.assertEqual(response.data['updated'], 1)
+        self.assertEqual(self.catalogue()[0], ('Dal', Decimal('20.00'), 0))
+
+    def test_any_invalid_value_changes_nothing(self):
+        response = self.keeper.post(self.url, {'products': {
+            str(self.rice.pk): {'stock': 7}, str(self.dal.pk): {'stock': 1, 'stock_delta': 1},
+        }}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(str(self.dal.pk), str(response.data))
+        self.assertEqual(self.catalogue(), [('Dal', Decimal('20.00'), 4), ('Rice', Decimal('10.00'), 10)])
+        customer = self.client_for(self.shop.test_customers[0])
+        self.assertEqual(customer.post(self.url, {'products': {}}, format='json').status_code, 403)
+
+
+@override_settings(PRODUCT_CHANGES_SETTLE_SECONDS=0)
+class CatalogueSyncTests(APITestCase):
+    """Sync cursors expire by when the client last caught up, not by how old the products are"""
+
+    def setUp(self):
+        super().setUp()
+        self.shop = self.make_shop()
+        self.client = self.client_for(self.shop.test_customers[0])
+        self.url = f'/api/products/shops/{self.shop.pk}/products/changes/'
+        self.products = [self.make_product(self.shop, f'Product {index}') for index in range(3)]
+        Product.objects.update(updated_at=timezone.now() - timedelta(days=40))
+
+    def sync(self, cursor=None):
+        """Follow ``next`` to the end, returning the product ids seen and the cursor to store"""
+        seen, params = [], {'page_size': 2}
+        if cursor:
+            params['cursor'] = cursor
+        while True:
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 200, response.data)
+            seen += [row['id'] for row in response.data['results']]
+            if not response.data['next']:
+                return seen, response.data['cursor']
+            params['cursor'] = response.data['cursor']
+
+    def test_quiet_catalogue_syncs_from_scratch_and_resumes(self):
+        seen, cursor = self.sync()
+        self.assertEqual(seen, [product.pk for product in self.products])
+        self.assertEqual(self.sync(cursor)[0], [])
+
+        deleted = self.products[0].pk
+        self.products[0].delete()
+        seen, _ = self.sync(cursor)
+        self.assertEqual(seen, [deleted])
+
+    def test_queryset_deletes_leave_tombstones(self):
+        _, cursor = self.sync()
+        Product.objects.filter(pk__in=[product.pk for product in self.products[1:]]).delete()
+        self.assertEqual(self.sync(cursor)[0], [product.pk for product in self.products[1:]])
+
+        # Deleting the shop takes its products' tombstones with it
+        self.shop.delete()
+        self.assertFalse(ProductTombstone.objects.exists())
+
+    def test_cursor_not_followed_within_the_tombstone_ttl_expires(self):
+        _, cursor = self.sync()
+        with override_settings(PRODUCT_TOMBSTONE_TTL_DAYS=0):
+            response = self.client.get(self.url, {'cursor': cursor})
+        self.assertEqual(response.status_code, 410)
+
+
+def photo(name='photo.png', size=(1200, 600)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, 'red').save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+class ProductImageTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        self.shop = self.make_shop()
+        self.product = self.make_product(self.shop, 'Rice')
+        self.url = f'/api/products/shops/{self.shop.pk}/products/{self.product.pk}/image/'
+        self.keeper = self.client_for(self.shop.owner)
+
+    def test_upload_stores_the_original(self):
+        response = self.keeper.post(self.url, {'image': photo()})
+        self.assertEqual(response.status_code, 202)
+        self.product.refresh_from_db()
+        original = self.product.image_files['original']
+        self.assertTrue(original.startswith(f'products/{self.shop.pk}/') and original.endswith('.png'))
+        self.assertTrue(default_storage.exists(original))
+
+    def rendered(self, files):
+        """``{variant: {extension: (format, size)}}`` of the stored variants in an image files dict"""
+        rendered = {}
+        for variant, names in files.items():
+            if variant == 'original':
+                continue
+            rendered[variant] = {}
+            for extension, name in names.items():
+                with default_storage.open(name) as stored, Image.open(stored) as image:
+                    rendered[variant][extension] = (image.format, image.size)
+        return rendered
+
+    @override_settings(IMAGE_WORKERS=0)
+    def test_variants_are_rendered_and_served(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.keeper.post(self.url, {'image': photo()}).status_code, 202)
+        self.product.refresh_from_db()
+        self.assertEqual(self.rendered(self.product.image_files), {
+            'thumbnail': {'webp': ('WEBP', (200, 100)), 'jpeg': ('JPEG', (200, 100))},
+            'detail': {'webp': ('WEBP', (800, 400)), 'jpeg': ('JPEG', (800, 400))},
+        })
+
+        response = self.client_for(self.shop.test_customers[0]).get(
+            f'/api/products/shops/{self.shop.pk}/products/{self.product.pk}/'
+        )
+        images, files = response.json()['images'], self.product.image_files
+        self.assertEqual(images['original'], f"http://testserver{default_storage.url(files['original'])}")
+        thumbnail = files['thumbnail']['webp']
+        self.assertEqual(images['thumbnail']['webp'], f"http://testserver{default_storage.url(thumbnail)}")
+
+    @override_settings(IMAGE_WORKERS=0)
+    def test_shop_logo_variants_are_rendered_and_served(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.keeper.post('/api/shops/my-shop/logo/', {'logo': photo('logo.png', size=(300, 300))})
+        self.assertEqual(response.status_code, 202)
+        self.shop.refresh_from_db()
+        self.assertTrue(self.shop.logo_files['original'].endswith('.png'))
+        self.assertEqual(self.rendered(self.shop.logo_files), {
+            'thumbnail': {'webp': ('WEBP', (200, 200)), 'jpeg': ('JPEG', (200, 200))},
+            'detail': {'webp': ('WEBP', (300, 300)), 'jpeg': ('JPEG', (300, 300))},
+        })
+
+        logo, files = self.keeper.get('/api/shops/my-shop/').data['logo_images'], self.shop.logo_files
+        self.assertEqual(logo['detail']['jpeg'], f"http://testserver{default_storage.url(files['detail']['jpeg'])}")
+
+    def test_delete_removes_the_stored_files(self):
+        self.keeper.post(self.url, {'image': photo()})
+        self.product.refresh_from_db()
+        original = self.product.image_files['original']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.keeper.delete(self.url).status_code, 204)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.image_files, {})
+        self.assertFalse(default_storage.exists(original))
+
+    def test_queryset_and_cascading_deletes_remove_the_stored_files(self):
+        self.keeper.post(self.url, {'image': photo()})
+        self.keeper.post('/api/shops/my-shop/logo/', {'logo': photo('logo.png')})
+        self.product.refresh_from_db()
+        self.shop.refresh_from_db()
+        names = [self.product.image_files['original'], self.shop.logo_files['original']]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.shop.owner.delete()
+        self.assertFalse(any(default_storage.exists(name) for name in names))
+
+    def test_only_images_from_the_owner(self):
+        upload = SimpleUploadedFile('photo.png', b'not an image', content_type='image/png')
+        self.assertEqual(self.keeper.post(self.url, {'image': upload}).status_code, 400)
+        self.assertEqual(self.keeper.post(self.url, {}).status_code, 400)
+        customer = self.client_for(self.shop.test_customers[0])
+        self.assertEqual(customer.post(self.url, {'image': photo()}).status_code, 403)
+
+    def test_upload_keeps_stock_changed_while_storing_the_photo(self):
+        def store_original(upload, prefix):
+            # An order is accepted while the upload is being written
+            Product.objects.filter(pk=self.product.pk).update(stock=4)
+            return {'original': f'{prefix}/photo.jpg'}
+
+        with mock.patch('products.views.store_original', side_effect=store_original):
+            response = self.keeper.post(self.url, {'image': photo()})
+        self.assertEqual(response.status_code, 202)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock, self.product.image_files), (4, {'original': f'products/{self.shop.pk}/photo.jpg'}))
+
+
+class StockReservationTests(APITestCase):
+    """Product edits never write back ``reserved``, which checkouts change with F() updates"""
+
+    def setUp(self):
+        super().setUp()
+        self.shop = self.make_shop()
+        self.customer = self.shop.test_customers[0]
+        self.product = self.make_product(self.shop, 'Rice', stock=10)
+
+    def checkout(self, quantity):
+        response = self.place_order(self.customer, self.shop, {self.product: quantity})
+        self.assertEqual(response.status_code, 201)
+        return response.data['id']
+
+    def test_saving_a_copy_loaded_before_a_checkout_keeps_the_hold(self):
+        stale = Product.objects.get(pk=self.product.pk)
+        order_id = self.checkout(7)
+        stale.name = 'Basmati Rice'
+        stale.save()
+
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.name, self.product.reserved), ('Basmati Rice', 7))
+        self.assertEqual(self.set_status(order_id, self.shop, 'ACCEPTED').status_code, 200)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock, self.product.reserved), (3, 0))
+
+    def test_edit_after_a_checkout_keeps_the_hold(self):
+        order_id = self.checkout(7)
+        response = self.client_for(self.shop.owner).put(
+            f'/api/products/shops/{self.shop.pk}/products/{self.product.pk}/', {'price': '12.50'}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['available_stock'], 3)
+
+        self.assertEqual(self.set_status(order_id, self.shop, 'REJECTED').status_code, 200)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock, self.product.reserved, str(self.product.price)), (10, 0, '12.50'))
+        self.assertEqual(Order.objects.get(pk=order_id).status, 'REJECTED')
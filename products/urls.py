@@ -3,5 +3,9 @@ from . import views
 
 urlpatterns = [
     path('shops/<int:shop_id>/products/', views.product_list_create, name='product_list_create'),
+    path('shops/<int:shop_id>/products/changes/', views.product_changes, name='product_changes'),
+    path('shops/<int:shop_id>/products/import/', views.product_import, name='product_import'),
+    path('shops/<int:shop_id>/products/sync/', views.product_sync, name='product_sync'),
     path('shops/<int:shop_id>/products/<int:pk>/', views.product_detail, name='product_detail'),
+    path('shops/<int:shop_id>/products/<int:pk>/image/', views.product_image, name='product_image'),
 ]
\ No newline at end of file
@@ -1,33 +1,160 @@
-from rest_framework import status
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from rest_framework import serializers, status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
+from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
-from .models import Product
-from .serializers import ProductSerializer, ProductCreateSerializer
-from shops.models import Shop, ShopCustomer
+from nearbasket.conditional import make_etag, not_modified
+from nearbasket.images import InvalidImage, delete_images, generate_variants, store_original
+from nearbasket.pagination import KeysetPagination, SyncPagination
+from .cache import catalogue_cache_key, get_or_build
+from .imports import ImportFileError, csv_rows, import_products, json_rows
+from .models import CatalogueVersion, Product, ProductTombstone
+from .search import search_products
+from .serializers import (
+    ProductSerializer, ProductCreateSerializer, ProductSyncSerializer, ProductTombstoneSerializer
+)
+from .stock import adjust_products
+from shops.access import is_shop_customer, owns_shop
+from shops.models import Shop
+
+SORT_ORDERINGS = {
+    'newest': ('-created_at', '-id'),
+    'price': ('price', 'id'),
+    '-price': ('-price', '-id'),
+    'name': ('name', 'id'),
+    'relevance': ('-search_rank', 'id'),
+}
+
+def filter_products(products, request):
+    """
+    Apply the ``q``, ``min_price``, ``max_price``, ``in_stock`` and ``sort``
+    query parameters. Returns the queryset and its keyset ordering.
+    """
+    params = request.query_params
+    for param, lookup in [('min_price', 'price__gte'), ('max_price', 'price__lte')]:
+        value = params.get(param)
+        if not value:
+            continue
+        try:
+            price = Decimal(value)
+        except InvalidOperation:
+            price = None
+        if price is None or not price.is_finite():
+            raise serializers.ValidationError({param: 'Must be a number'})
+        products = products.filter(**{lookup: price})
+    
+    if params.get('in_stock', '').lower() in ('1', 'true', 'yes'):
+        # Stock held for pending orders is not for sale
+        products = products.filter(stock__gt=F('reserved'))
+    
+    query = params.get('q', '').strip()
+    if query:
+        products = search_products(products, query)
+    
+    sort = params.get('sort') or ('relevance' if query else 'newest')
+    if sort not in SORT_ORDERINGS or (sort == 'relevance' and not query):
+        raise serializers.ValidationError({
+            'sort': f"Sort must be one of {', '.join(SORT_ORDERINGS)} (relevance needs q)"
+        })
+    return products, SORT_ORDERINGS[sort]
+
+def catalogue_etag(request, shop):
+    """
+    ETag for a catalogue read: changes with the shop's catalogue version and
+    name (rendered as ``shop_name``), and differs per URL and media type.
+    """
+    return make_etag(
+        shop.pk, CatalogueVersion.for_shop(shop), shop.name,
+        request.build_absolute_uri(), request.accepted_media_type
+    )
+
+def catalogue_access_error(request, shop_id):
+    """
+    Return a 403 response if the user may not read this shop's catalogue,
+    else None. Answered from the shop access cache; only a refusal queries
+    the database, to report a missing shop as 404.
+    """
+    if request.user.role == 'SHOPKEEPER':
+        if owns_shop(request.user, shop_id):
+            return None
+        error = 'Access denied'
+    elif request.user.role == 'CUSTOMER':
+        if is_shop_customer(request.user, shop_id):
+            return None
+        error = 'You are not a customer of this shop'
+    else:
+        return None
+    
+    get_object_or_404(Shop.objects.only('id'), pk=shop_id)
+    return Response({
+        'error': error
+    }, status=status.HTTP_403_FORBIDDEN)
+
+def product_list_response(request, shop):
+    products, ordering = filter_products(Product.objects.filter(shop=shop), request)
+    products = ProductSerializer.setup_eager_loading(
+        products,
+        context={'request': request},
+        required=[name for name in KeysetPagination.ordering_fields(ordering) if name != 'search_rank']
+    )
+    paginator = KeysetPagination(ordering)
+    page = paginator.paginate_queryset(products, request)
+    serializer = ProductSerializer(page, many=True, context={'request': request})
+    return paginator.get_paginated_response(serializer.data)
+
+def cached_product_list(request, shop, etag):
+    """
+    Serve a rendered catalogue page from the catalogue cache, building it on
+    a miss. The entry is keyed by shop and URL and is only fresh for the
+    current ETag, so any catalogue change invalidates exactly that shop.
+    """
+    def build():
+        response = product_list_response(request, shop)
+        content = request.accepted_renderer.render(
+            response.data, request.accepted_media_type, {'request': request, 'response': response}
+        )
+        return {'etag': etag, 'content': content, 'content_type': request.accepted_media_type}
+    
+    entry = get_or_build(catalogue_cache_key(request, shop), etag, build)
+    # A stale entry served while another worker rebuilds keeps its own ETag
+    response = HttpResponse(entry['content'], content_type=entry['content_type'])
+    response['ETag'] = entry['etag']
+    response['Cache-Control'] = 'private, no-cache'
+    return response
 
 @api_view(['GET', 'POST'])
 @permission_classes([IsAuthenticated])
 def product_list_create(request, shop_id):
-    shop = get_object_or_404(Shop, pk=shop_id)
-    
     # Check access permissions
-    if request.user.role == 'SHOPKEEPER':
-        if shop.owner != request.user:
-            return Response({
-                'error': 'Access denied'
-            }, status=status.HTTP_403_FORBIDDEN)
-    elif request.user.role == 'CUSTOMER':
-        if not ShopCustomer.objects.filter(shop=shop, customer=request.user).exists():
-            return Response({
-                'error': 'You are not a customer of this shop'
-            }, status=status.HTTP_403_FORBIDDEN)
+    denied = catalogue_access_error(request, shop_id)
+    if denied:
+        return denied
+    
+    shop = get_object_or_404(Shop.objects.select_related('catalogue_version'), pk=shop_id)
     
     if request.method == 'GET':
-        products = Product.objects.filter(shop=shop)
-        serializer = ProductSerializer(products, many=True)
-        return Response(serializer.data)
+        # Unchanged catalogue: answer from the version alone, without touching products
+        etag = catalogue_etag(request, shop)
+        cached = not_modified(request, etag)
+        if cached:
+            return cached
+        
+        # Search results are too varied to be worth caching
+        if isinstance(request.accepted_renderer, JSONRenderer) and not request.query_params.get('q'):
+            return cached_product_list(request, shop, etag)
+        
+        response = product_list_response(request, shop)
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
     
     elif request.method == 'POST':
         if request.user.role != 'SHOPKEEPER':
@@ -44,31 +171,36 @@ def product_list_create(request, shop_id):
 @api_view(['GET', 'PUT', 'DELETE'])
 @permission_classes([IsAuthenticated])
 def product_detail(request, shop_id, pk):
-    shop = get_object_or_404(Shop, pk=shop_id)
-    product = get_object_or_404(Product, pk=pk, shop=shop)
-    
     if request.method == 'GET':
         # Check access permissions
-        if request.user.role == 'SHOPKEEPER':
-            if shop.owner != request.user:
-                return Response({
-                    'error': 'Access denied'
-                }, status=status.HTTP_403_FORBIDDEN)
-        elif request.user.role == 'CUSTOMER':
-            if not ShopCustomer.objects.filter(shop=shop, customer=request.user).exists():
-                return Response({
-                    'error': 'You are not a customer of this shop'
-                }, status=status.HTTP_403_FORBIDDEN)
+        denied = catalogue_access_error(request, shop_id)
+        if denied:
+            return denied
+        
+        shop = get_object_or_404(Shop.objects.select_related('catalogue_version'), pk=shop_id)
+        
+        etag = catalogue_etag(request, shop)
+        cached = not_modified(request, etag)
+        if cached:
+            return cached
         
-        serializer = ProductSerializer(product)
-        return Response(serializer.data)
+        products = ProductSerializer.setup_eager_loading(Product.objects.all(), context={'request': request})
+        product = get_object_or_404(products, pk=pk, shop=shop)
+        serializer = ProductSerializer(product, context={'request': request})
+        response = Response(serializer.data)
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
     
-    elif request.method in ['PUT', 'DELETE']:
-        if shop.owner != request.user:
+    if request.method in ['PUT', 'DELETE']:
+        if not owns_shop(request.user, shop_id):
+            get_object_or_404(Shop.objects.only('id'), pk=shop_id)
             return Response({
                 'error': 'Only shop owner can modify products'
             }, status=status.HTTP_403_FORBIDDEN)
         
+        product = get_object_or_404(Product, pk=pk, shop_id=shop_id)
+        
         if request.method == 'PUT':
             serializer = ProductSerializer(product, data=request.data, partial=True)
             if serializer.is_valid():
@@ -80,4 +212,141 @@ def product_detail(request, shop_id, pk):
             product.delete()
             return Response({
                 'message': 'Product deleted successfully'
-            }, status=status.HTTP_204_NO_CONTENT)
\ No newline at end of file
+            }, status=status.HTTP_204_NO_CONTENT)
+
+@api_view(['POST', 'DELETE'])
+@permission_classes([IsAuthenticated])
+def product_image(request, shop_id, pk):
+    """Upload or remove a product photo; its thumbnails are rendered in the background"""
+    shop = get_object_or_404(Shop.objects.only('id', 'owner_id'), pk=shop_id)
+    
+    if shop.owner_id != request.user.id:
+        return Response({
+            'error': 'Only shop owner can change product images'
+        }, status=status.HTTP_403_FORBIDDEN)
+    
+    product = get_object_or_404(Product, pk=pk, shop=shop)
+    previous = product.image_files
+    files = {}
+    
+    if request.method == 'POST':
+        upload = request.FILES.get('image')
+        if upload is None:
+            return Response({
+                'error': 'Send the photo as an "image" file upload'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            files = store_original(upload, f'products/{shop.id}')
+        except InvalidImage as exc:
+            return Response({
+                'error': str(exc)
+            }, status=status.HTTP_400_BAD_REQUEST)
+    
+    with transaction.atomic():
+        product.image_files = files
+        # Stock may have changed during the upload, so only the photo is written
+        product.save(update_fields=['image_files', 'updated_at'])
+        transaction.on_commit(lambda: delete_images(previous), robust=True)
+        if files:
+            transaction.on_commit(
+                lambda: generate_variants(files, lambda variants: Product.image_variants_ready(product.pk, variants)),
+                robust=True
+            )
+    
+    if request.method == 'DELETE':
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    return Response(
+        ProductSerializer(product, context={'request': request}).data, status=status.HTTP_202_ACCEPTED
+    )
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def product_changes(request, shop_id):
+    """Products created, changed or deleted since the client's last sync, oldest change first"""
+    # Check access permissions
+    denied = catalogue_access_error(request, shop_id)
+    if denied:
+        return denied
+    
+    now = timezone.now()
+    settled = now - timedelta(seconds=settings.PRODUCT_CHANGES_SETTLE_SECONDS)
+    context = {'request': request}
+    products = ProductSerializer.setup_eager_loading(
+        Product.objects.filter(shop_id=shop_id, updated_at__lte=settled),
+        context=context,
+        required=SyncPagination.ordering_fields()
+    )
+    # Deletes are read first, so a product deleted in between is reported deleted rather than missed
+    tombstones = ProductTombstone.objects.filter(shop_id=shop_id, updated_at__lte=settled)
+    
+    paginator = SyncPagination(horizon=now - timedelta(days=settings.PRODUCT_TOMBSTONE_TTL_DAYS), settled=settled)
+    page = paginator.paginate_querysets([tombstones, products], request)
+    
+    rendered = {}
+    for serializer_class, model, deleted in [
+        (ProductSerializer, Product, False), (ProductTombstoneSerializer, ProductTombstone, True)
+    ]:
+        rows = [row for row in page if isinstance(row, model)]
+        for row, data in zip(rows, serializer_class(rows, many=True, context=context).data):
+            rendered[row.pk] = {**data, 'deleted': deleted}
+    results = [rendered[row.pk] for row in page]
+    return paginator.get_paginated_response(results)
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def product_import(request, shop_id):
+    shop = get_object_or_404(Shop, pk=shop_id)
+    
+    if shop.owner_id != request.user.id:
+        return Response({
+            'error': 'Only shop owner can import products'
+        }, status=status.HTTP_403_FORBIDDEN)
+    
+    # Rows are parsed straight off the upload as they are imported, never loaded whole
+    content_type = request.content_type.split(';')[0].strip().lower()
+    if content_type == 'multipart/form-data':
+        stream = request.FILES.get('file')
+        is_csv = stream is not None and (
+            stream.name.lower().endswith('.csv') or stream.content_type == 'text/csv'
+        )
+    elif content_type in ('text/csv', 'application/json'):
+        stream = request.stream
+        is_csv = content_type == 'text/csv'
+    else:
+        return Response({
+            'error': 'Send products as text/csv, application/json or a multipart "file" upload'
+        }, status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+    
+    if stream is None:
+        return Response({
+            'error': 'No products uploaded'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        result = import_products(shop, csv_rows(stream) if is_csv else json_rows(stream))
+    except ImportFileError as exc:
+        return Response({
+            'error': str(exc)
+        }, status=status.HTTP_400_BAD_REQUEST)
+    return Response(result)
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def product_sync(request, shop_id):
+    """Push stock levels and prices from a billing/POS system"""
+    shop = get_object_or_404(Shop.objects.only('id', 'owner_id'), pk=shop_id)
+    
+    if shop.owner_id != request.user.id:
+        return Response({
+            'error': 'Only shop owner can sync products'
+        }, status=status.HTTP_403_FORBIDDEN)
+    
+    serializer = ProductSyncSerializer(data=request.data)
+    if serializer.is_valid():
+        changes = serializer.validated_data['products']
+        unmatched = adjust_products(shop.id, changes, key=serializer.validated_data['key'])
+        return Response({
+            'updated': len(changes) - len(unmatched),
+            'unmatched': unmatched
+        })
+    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,66 @@
+import uuid
+from django.core.cache import caches
+from django.db import transaction
+from .models import Shop, ShopCustomer
+
+
+def access_cache():
+    return caches['shop_access']
+
+
+def _keys(user_id):
+    return f"shop-access:{user_id}", f"shop-access:{user_id}:generation"
+
+
+def shop_access(user):
+    """
+    Return ``(owned_shop_id, joined_shop_ids)`` for ``user``, served from the
+    shop access cache after the first call.
+
+    Entries carry the user's generation token from before they were read,
+    and ``forget_shop_access`` replaces the token once a membership change
+    commits, so an entry filled by a read that raced the change is never
+    served.
+    """
+    cache = access_cache()
+    key, generation_key = _keys(user.pk)
+    cached = cache.get_many([key, generation_key])
+    generation = cached.get(generation_key)
+    entry = cached.get(key)
+    if entry is not None and entry[0] == generation:
+        return entry[1], entry[2]
+
+    # Only shopkeepers own shops and only customers join them, so one query fills the entry
+    owned, joined = None, frozenset()
+    if user.role == 'SHOPKEEPER':
+        owned = Shop.objects.filter(owner_id=user.pk).values_list('id', flat=True).first()
+    elif user.role == 'CUSTOMER':
+        joined = frozenset(ShopCustomer.objects.filter(customer_id=user.pk).values_list('shop_id', flat=True))
+    cache.set(key, (generation, owned, joined))
+    return owned, joined
+
+
+def owns_shop(user, shop_id):
+    return shop_access(user)[0] == shop_id
+
+
+def is_shop_customer(user, shop_id):
+    return shop_id in shop_access(user)[1]
+
+
+def forget_shop_access(*user_ids):
+    """Invalidate the cached access of ``user_ids`` once the current transaction commits"""
+    def forget():
+        keys = [_keys(user_id) for user_id in user_ids]
+        access_cache().set_many({generation_key: uuid.uuid4().hex for _, generation_key in keys})
+        access_cache().delete_many([key for key, _ in keys])
+
+    transaction.on_commit(forget)
+
+
+def shop_customer_changed(sender, instance, **kwargs):
+    forget_shop_access(instance.customer_id)
+
+
+def shop_changed(sender, instance, **kwargs):
+    forget_shop_access(instance.owner_id)
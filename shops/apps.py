@@ -1,6 +1,18 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save
 
 
 class ShopsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'shops'
+
+    def ready(self):
+        from .access import shop_changed, shop_customer_changed
+        from .models import Shop, ShopCustomer, shop_deleted
+
+        # Cached permission checks (see shops.access) follow every membership and ownership change,
+        # including queryset deletes and cascades from a deleted user or shop
+        for model, receiver in [(Shop, shop_changed), (ShopCustomer, shop_customer_changed)]:
+            post_save.connect(receiver, sender=model, dispatch_uid=f'{model.__name__}_access')
+            post_delete.connect(receiver, sender=model, dispatch_uid=f'{model.__name__}_access_delete')
+        post_delete.connect(shop_deleted, sender=Shop, dispatch_uid='Shop_deleted')
@@ -0,0 +1,123 @@
+import re
+from django.db import transaction
+from django.db.models import Q
+from users.models import User
+from .access import forget_shop_access
+from .models import ShopCustomer
+
+MOBILE_NUMBER = re.compile(r'^\d{10}$')
+
+# Links inserted per INSERT statement
+BULK_BATCH_SIZE = 500
+
+
+def _resolve(mobile_numbers, user_ids):
+    """
+    Find the users behind ``mobile_numbers`` and ``user_ids`` with one query.
+
+    Returns ``(entry, user)`` pairs in request order without repeats, where
+    ``entry`` echoes the request (``{'mobile_number': ...}`` or
+    ``{'user_id': ...}``) and ``user`` is a ``{id, role}`` dict, None for
+    no such user, ``'invalid'`` for a malformed mobile number, or
+    ``'duplicate'`` for a user an earlier entry already named (by number
+    and by id); the entry of a duplicate points at the earlier one in
+    ``duplicate_of``.
+    """
+    numbers = list(dict.fromkeys(number.strip() for number in mobile_numbers))
+    ids = list(dict.fromkeys(user_ids))
+    valid = [number for number in numbers if MOBILE_NUMBER.match(number)]
+
+    by_number, by_id = {}, {}
+    if valid or ids:
+        for user in User.objects.filter(Q(mobile_number__in=valid) | Q(pk__in=ids)).values('id', 'mobile_number', 'role'):
+            by_number[user['mobile_number']] = by_id[user['id']] = user
+
+    rows = [
+        ({'mobile_number': number}, by_number.get(number) if MOBILE_NUMBER.match(number) else 'invalid')
+        for number in numbers
+    ]
+    rows += [({'user_id': user_id}, by_id.get(user_id)) for user_id in ids]
+    
+    first = {}
+    for index, (entry, user) in enumerate(rows):
+        if isinstance(user, dict):
+            if user['id'] in first:
+                rows[index] = ({**entry, 'duplicate_of': first[user['id']]}, 'duplicate')
+            else:
+                first[user['id']] = entry
+    return rows
+
+
+def add_customers(shop, mobile_numbers=(), user_ids=()):
+    """
+    Link many customers to ``shop`` at once.
+
+    Users are resolved with one query and existing links with another, and
+    the new links go in with conflict-ignoring bulk INSERTs, so a link made
+    concurrently is skipped rather than failing the batch. Returns one
+    ``{mobile_number | user_id, outcome}`` per requested customer, with
+    outcome ``invalid``, ``unknown``, ``not_a_customer``, ``already_linked``,
+    ``added`` or ``duplicate``.
+    """
+    rows = _resolve(mobile_numbers, user_ids)
+    customer_ids = {user['id'] for _, user in rows if isinstance(user, dict) and user['role'] == 'CUSTOMER'}
+
+    with transaction.atomic():
+        linked = set(
+            ShopCustomer.objects.filter(shop=shop, customer_id__in=customer_ids).values_list('customer_id', flat=True)
+        )
+        new = sorted(customer_ids - linked)
+        ShopCustomer.objects.bulk_create(
+            [ShopCustomer(shop=shop, customer_id=customer_id) for customer_id in new],
+            batch_size=BULK_BATCH_SIZE, ignore_conflicts=True
+        )
+        # bulk_create() sends no post_save, which keeps the access cache in step
+        if new:
+            forget_shop_access(*new)
+
+    results = []
+    for entry, user in rows:
+        if user in ('invalid', 'duplicate'):
+            outcome = user
+        elif user is None:
+            outcome = 'unknown'
+        elif user['role'] != 'CUSTOMER':
+            outcome = 'not_a_customer'
+        elif user['id'] in linked:
+            outcome = 'already_linked'
+        else:
+            outcome = 'added'
+        results.append({**entry, 'outcome': outcome})
+    return results
+
+
+def remove_customers(shop, mobile_numbers=(), user_ids=()):
+    """
+    Unlink many customers from ``shop`` with one DELETE. Returns one
+    ``{mobile_number | user_id, outcome}`` per requested customer, with
+    outcome ``invalid``, ``unknown``, ``not_linked``, ``removed`` or
+    ``duplicate``.
+    """
+    rows = _resolve(mobile_numbers, user_ids)
+    user_ids = {user['id'] for _, user in rows if isinstance(user, dict)}
+
+    with transaction.atomic():
+        linked = set(
+            ShopCustomer.objects.filter(shop=shop, customer_id__in=user_ids).values_list('customer_id', flat=True)
+        )
+        if linked:
+            # Deleted links send post_delete, which forgets the customers' cached access
+            ShopCustomer.objects.filter(shop=shop, customer_id__in=linked).delete()
+
+    results = []
+    for entry, user in rows:
+        if user in ('invalid', 'duplicate'):
+            outcome = user
+        elif user is None:
+            outcome = 'unknown'
+        elif user['id'] in linked:
+            outcome = 'removed'
+        else:
+            outcome = 'not_linked'
+        results.append({**entry, 'outcome': outcome})
+    return results
@@ -0,0 +1,93 @@
+import math
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = EARTH_RADIUS_KM * math.pi / 180
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# Stored geohashes are about 5 m across, finer than any search needs
+GEOHASH_PRECISION = 9
+
+# Most geohash cells one search scans; fewer, larger cells are used for wider searches
+MAX_SEARCH_CELLS = 12
+
+
+def _cell_size(precision):
+    """Cells per axis as ``(latitude_cells, longitude_cells)``; longitude takes the odd bit"""
+    bits = 5 * precision
+    return 1 << (bits // 2), 1 << ((bits + 1) // 2)
+
+
+def _cell_index(value, low, high, cells):
+    return min(int((value - low) / (high - low) * cells), cells - 1)
+
+
+def _geohash(lat_index, lng_index, precision):
+    """Interleave cell indices into a geohash, longitude bit first"""
+    lat_bits, lng_bits = (5 * precision) // 2, (5 * precision + 1) // 2
+    code = 0
+    for bit in range(5 * precision):
+        code <<= 1
+        if bit % 2 == 0:
+            lng_bits -= 1
+            code |= (lng_index >> lng_bits) & 1
+        else:
+            lat_bits -= 1
+            code |= (lat_index >> lat_bits) & 1
+    return ''.join(BASE32[(code >> shift) & 31] for shift in range(5 * (precision - 1), -1, -5))
+
+
+def encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    lat_cells, lng_cells = _cell_size(precision)
+    return _geohash(
+        _cell_index(latitude, -90, 90, lat_cells),
+        _cell_index(longitude, -180, 180, lng_cells),
+        precision
+    )
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1, math.sqrt(a)))
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """
+    Return ``(south, north, west, east)`` degrees enclosing the circle around
+    a point. ``west`` is greater than ``east`` when the box crosses the
+    antimeridian, and the box spans every longitude when it reaches a pole.
+    """
+    delta = radius_km / KM_PER_DEGREE
+    south, north = max(latitude - delta, -90), min(latitude + delta, 90)
+    if south == -90 or north == 90:
+        return south, north, -180, 180
+    # Longitude degrees shrink towards the poles; the widest point of the circle sets the span
+    lng_delta = math.degrees(math.asin(min(1, math.sin(math.radians(delta)) / math.cos(math.radians(latitude)))))
+    if lng_delta >= 180:
+        return south, north, -180, 180
+    west, east = longitude - lng_delta, longitude + lng_delta
+    return south, north, (west + 540) % 360 - 180, (east + 540) % 360 - 180
+
+
+def covering_cells(box):
+    """
+    The geohash prefixes of the fewest, smallest cells covering ``box``:
+    the finest precision whose cover needs at most ``MAX_SEARCH_CELLS``.
+    """
+    south, north, west, east = box
+    cover = ['']
+    for precision in range(1, GEOHASH_PRECISION + 1):
+        lat_cells, lng_cells = _cell_size(precision)
+        rows = range(_cell_index(south, -90, 90, lat_cells), _cell_index(north, -90, 90, lat_cells) + 1)
+        first, last = _cell_index(west, -180, 180, lng_cells), _cell_index(east, -180, 180, lng_cells)
+        if (west, east) == (-180, 180):
+            columns = range(lng_cells)
+        elif west <= east:
+            columns = range(first, last + 1)
+        else:
+            columns = [*range(first, lng_cells), *range(last + 1)]
+        if len(rows) * len(columns) > MAX_SEARCH_CELLS:
+            break
+        cover = [_geohash(row, column, precision) for row in rows for column in columns]
+    return cover
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 21:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shops', '0003_alter_shop_unique_together_alter_shop_owner'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shop',
+            name='logo_files',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-17 21:33
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shops', '0004_shop_logo_files'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='shopcustomer',
+            index=models.Index(fields=['shop', 'joined_at', 'id'], name='shop_customer_joined_idx'),
+        ),
+    ]
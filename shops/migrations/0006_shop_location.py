@@ -0,0 +1,40 @@
+# Generated by Django 5.2.5 on 2026-10-17 21:41
+
+import django.core.validators
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shops', '0005_shopcustomer_joined_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shop',
+            name='delivery_radius_km',
+            field=models.FloatField(default=5, validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(100)]),
+        ),
+        migrations.AddField(
+            model_name='shop',
+            name='geohash',
+            field=models.CharField(blank=True, editable=False, max_length=9),
+        ),
+        migrations.AddField(
+            model_name='shop',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(-90), django.core.validators.MaxValueValidator(90)]),
+        ),
+        migrations.AddField(
+            model_name='shop',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(-180), django.core.validators.MaxValueValidator(180)]),
+        ),
+        migrations.AddIndex(
+            model_name='shop',
+            index=models.Index(fields=['geohash', 'latitude', 'longitude', 'delivery_radius_km'], name='shop_geohash_idx'),
+        ),
+    ]
@@ -1,6 +1,8 @@
 import uuid
-from django.db import models
+from django.db import models, transaction
 from django.core.exceptions import ValidationError
+from django.core.validators import MaxValueValidator, MinValueValidator
+from nearbasket.images import delete_images
 from users.models import User
 
 def generate_shop_id():
@@ -12,8 +14,21 @@ class Shop(models.Model):
     address = models.TextField()
     description = models.TextField(blank=True, null=True)
     shop_logo_url = models.URLField(blank=True, null=True)
+    # Uploaded logo and its generated variants, see nearbasket.images
+    logo_files = models.JSONField(default=dict, blank=True)
     shop_id = models.CharField(max_length=8, unique=True, default=generate_shop_id)
     created_at = models.DateTimeField(auto_now_add=True)
+    latitude = models.FloatField(blank=True, null=True, validators=[MinValueValidator(-90), MaxValueValidator(90)])
+    longitude = models.FloatField(blank=True, null=True, validators=[MinValueValidator(-180), MaxValueValidator(180)])
+    delivery_radius_km = models.FloatField(default=5, validators=[MinValueValidator(0), MaxValueValidator(100)])
+    # Derived from the coordinates on save, see shops.geo; empty for shops without a location
+    geohash = models.CharField(max_length=9, blank=True, editable=False)
+    
+    class Meta:
+        indexes = [
+            # Nearby searches scan geohash prefixes and filter on the columns that follow
+            models.Index(fields=['geohash', 'latitude', 'longitude', 'delivery_radius_km'], name='shop_geohash_idx'),
+        ]
     
     def clean(self):
         super().clean()
@@ -21,11 +36,23 @@ class Shop(models.Model):
             raise ValidationError('Only shopkeepers can own shops')
         if not self.name.strip():
             raise ValidationError('Shop name cannot be empty')
+        if (self.latitude is None) != (self.longitude is None):
+            raise ValidationError('Set both latitude and longitude, or neither')
     
     def save(self, *args, **kwargs):
+        from .geo import encode
+        
         self.full_clean()
+        self.geohash = encode(self.latitude, self.longitude) if self.latitude is not None else ''
+        if kwargs.get('update_fields') is not None and {'latitude', 'longitude'} & set(kwargs['update_fields']):
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'geohash'}
         super().save(*args, **kwargs)
     
+    @classmethod
+    def logo_variants_ready(cls, pk, files):
+        """Store generated logo variants unless the logo was replaced meanwhile"""
+        return bool(cls.objects.filter(pk=pk, logo_files__original=files['original']).update(logo_files=files))
+    
     def __str__(self):
         return f"{self.name} - {self.owner.name}"
 
@@ -36,6 +63,9 @@ class ShopCustomer(models.Model):
     
     class Meta:
         unique_together = ['shop', 'customer']
+        indexes = [
+            models.Index(fields=['shop', 'joined_at', 'id'], name='shop_customer_joined_idx'),
+        ]
     
     def clean(self):
         super().clean()
@@ -49,4 +79,10 @@ class ShopCustomer(models.Model):
         super().save(*args, **kwargs)
     
     def __str__(self):
-        return f"{self.customer.name} - {self.shop.name}"
\ No newline at end of file
+        return f"{self.customer.name} - {self.shop.name}"
+
+
+def shop_deleted(sender, instance, **kwargs):
+    """Remove a deleted shop's logo files once the delete commits"""
+    logo_files = instance.logo_files
+    transaction.on_commit(lambda: delete_images(logo_files), robust=True)
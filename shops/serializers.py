@@ -1,29 +1,72 @@
+from django.conf import settings
 from rest_framework import serializers
 from .models import Shop, ShopCustomer
 from users.models import User
 from users.serializers import UserProfileSerializer
+from nearbasket.serializers import DynamicFieldsMixin, EagerLoadingMixin, ImageFilesField
 
-class ShopSerializer(serializers.ModelSerializer):
+class ShopSerializer(DynamicFieldsMixin, EagerLoadingMixin, serializers.ModelSerializer):
     owner_name = serializers.CharField(source='owner.name', read_only=True)
+    logo_images = ImageFilesField(source='logo_files')
     
     class Meta:
         model = Shop
-        fields = ['id', 'name', 'address', 'description', 'shop_logo_url', 
-                 'shop_id', 'created_at', 'owner_name']
+        fields = ['id', 'name', 'address', 'description', 'shop_logo_url', 'logo_images',
+                 'shop_id', 'created_at', 'owner_name', 'latitude', 'longitude', 'delivery_radius_km']
         read_only_fields = ['id', 'shop_id', 'created_at', 'owner_name']
 
+class HomeFeedShopSerializer(ShopSerializer):
+    """A joined shop on the customer's home screen; the counts and latest order are query annotations"""
+    joined_at = serializers.DateTimeField(read_only=True)
+    product_count = serializers.IntegerField(read_only=True)
+    in_stock_count = serializers.IntegerField(read_only=True)
+    latest_order = serializers.SerializerMethodField()
+    
+    class Meta(ShopSerializer.Meta):
+        fields = ShopSerializer.Meta.fields + ['joined_at', 'product_count', 'in_stock_count', 'latest_order']
+    
+    def get_latest_order(self, shop):
+        if shop.latest_order_id is None:
+            return None
+        return {
+            'id': shop.latest_order_id,
+            'status': shop.latest_order_status,
+            'created_at': serializers.DateTimeField().to_representation(shop.latest_order_at),
+        }
+
+class NearbyShopSerializer(ShopSerializer):
+    """A shop found near the customer; ``distance_km`` is set by the search"""
+    distance_km = serializers.SerializerMethodField()
+    delivers = serializers.SerializerMethodField()
+    
+    class Meta(ShopSerializer.Meta):
+        fields = ShopSerializer.Meta.fields + ['distance_km', 'delivers']
+    
+    def get_distance_km(self, shop):
+        return round(shop.distance_km, 2)
+    
+    def get_delivers(self, shop):
+        return shop.distance_km <= shop.delivery_radius_km
+
 class ShopUpdateSerializer(serializers.ModelSerializer):
     """Serializer for updating shop information (shopkeeper only)"""
     class Meta:
         model = Shop
-        fields = ['name', 'address', 'description', 'shop_logo_url']
+        fields = ['name', 'address', 'description', 'shop_logo_url', 'latitude', 'longitude', 'delivery_radius_km']
     
     def validate_name(self, value):
         if not value.strip():
             raise serializers.ValidationError("Shop name cannot be empty")
         return value
+    
+    def validate(self, data):
+        latitude = data.get('latitude', getattr(self.instance, 'latitude', None))
+        longitude = data.get('longitude', getattr(self.instance, 'longitude', None))
+        if (latitude is None) != (longitude is None):
+            raise serializers.ValidationError("Set both latitude and longitude, or neither")
+        return data
 
-class ShopCustomerSerializer(serializers.ModelSerializer):
+class ShopCustomerSerializer(DynamicFieldsMixin, EagerLoadingMixin, serializers.ModelSerializer):
     customer = UserProfileSerializer(read_only=True)
     shop_name = serializers.CharField(source='shop.name', read_only=True)
     
@@ -46,4 +89,35 @@ class AddCustomerSerializer(serializers.Serializer):
         except User.DoesNotExist:
             raise serializers.ValidationError("Customer with this mobile number does not exist")
         
-        return value
\ No newline at end of file
+        return value
+
+class NearbyShopsQuerySerializer(serializers.Serializer):
+    """Query parameters of a nearby shops search"""
+    lat = serializers.FloatField(min_value=-90, max_value=90)
+    lng = serializers.FloatField(min_value=-180, max_value=180)
+    radius_km = serializers.FloatField(min_value=0.1, required=False)
+    limit = serializers.IntegerField(min_value=1, required=False)
+    delivers = serializers.BooleanField(required=False, default=False)
+    
+    def validate_radius_km(self, value):
+        if value > settings.NEARBY_SHOPS_MAX_RADIUS_KM:
+            raise serializers.ValidationError(f"Search at most {settings.NEARBY_SHOPS_MAX_RADIUS_KM:g} km away")
+        return value
+    
+    def validate_limit(self, value):
+        return min(value, settings.NEARBY_SHOPS_MAX_RESULTS)
+
+class BulkCustomersSerializer(serializers.Serializer):
+    """Customers to add to or remove from a shop, by mobile number and/or user id"""
+    mobile_numbers = serializers.ListField(child=serializers.CharField(max_length=20), required=False, default=list)
+    user_ids = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False, default=list)
+    
+    def validate(self, data):
+        total = len(data['mobile_numbers']) + len(data['user_ids'])
+        if not total:
+            raise serializers.ValidationError("List at least one mobile number or user id")
+        if total > settings.SHOP_CUSTOMER_BULK_MAX_ITEMS:
+            raise serializers.ValidationError(
+                f"At most {settings.SHOP_CUSTOMER_BULK_MAX_ITEMS} customers can be changed at once"
+            )
+        return data
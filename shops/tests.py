@@ -1,3 +1,228 @@
-from django.test import TestCase
+from unittest import mock
+from nearbasket.testing import APITestCase
+from . import geo
+from .access import is_shop_customer, owns_shop, shop_access
+from .models import ShopCustomer
 
-# Create your tests here.
+
+class ShopAccessCacheTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.shop = self.make_shop()
+        self.other = self.make_shop('9100000000', customers=0)
+        self.customer = self.shop.test_customers[0]
+
+    def test_cached_after_the_first_read(self):
+        self.assertEqual(shop_access(self.customer), (None, {self.shop.pk}))
+        self.assertEqual(shop_access(self.shop.owner), (self.shop.pk, set()))
+        with self.assertNumQueries(0):
+            self.assertTrue(is_shop_customer(self.customer, self.shop.pk))
+            self.assertTrue(owns_shop(self.shop.owner, self.shop.pk))
+
+    def test_joining_and_leaving_take_effect_on_commit(self):
+        self.assertFalse(is_shop_customer(self.customer, self.other.pk))
+        with self.captureOnCommitCallbacks(execute=True):
+            link = ShopCustomer.objects.create(shop=self.other, customer=self.customer)
+        self.assertTrue(is_shop_customer(self.customer, self.other.pk))
+        with self.captureOnCommitCallbacks(execute=True):
+            link.delete()
+        self.assertFalse(is_shop_customer(self.customer, self.other.pk))
+
+    def test_queryset_and_cascading_deletes_are_forgotten(self):
+        self.assertTrue(is_shop_customer(self.customer, self.shop.pk))
+        with self.captureOnCommitCallbacks(execute=True):
+            ShopCustomer.objects.filter(shop=self.shop).delete()
+        self.assertFalse(is_shop_customer(self.customer, self.shop.pk))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ShopCustomer.objects.create(shop=self.other, customer=self.customer)
+        self.assertTrue(is_shop_customer(self.customer, self.other.pk))
+        self.assertTrue(owns_shop(self.other.owner, self.other.pk))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other.owner.delete()
+        self.assertFalse(is_shop_customer(self.customer, self.other.pk))
+
+    def test_read_that_raced_a_join_is_not_served(self):
+        stale = [self.shop.pk]
+
+        def read_then_join(**lookup):
+            # The join commits after this read fetched its rows, but before it fills the cache
+            with self.captureOnCommitCallbacks(execute=True):
+                ShopCustomer.objects.create(shop=self.other, customer=self.customer)
+            return mock.Mock(values_list=mock.Mock(return_value=stale))
+
+        with mock.patch('shops.access.ShopCustomer') as model:
+            model.objects.filter.side_effect = read_then_join
+            self.assertEqual(shop_access(self.customer)[1], {self.shop.pk})
+        self.assertEqual(shop_access(self.customer)[1], {self.shop.pk, self.other.pk})
+
+
+class HomeFeedTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.customer = self.make_user('9200000000')
+        self.quiet, self.busy, self.unjoined = [
+            self.make_shop(f'90000000{index:02d}', customers=0, name=name)
+            for index, name in enumerate(['Quiet Store', 'Busy Store', 'Other Store'])
+        ]
+        for shop in (self.quiet, self.busy):
+            ShopCustomer.objects.create(shop=shop, customer=self.customer)
+        rice = self.make_product(self.busy, 'Rice', stock=2)
+        self.make_product(self.busy, 'Dal', stock=0)
+        self.make_product(self.quiet, 'Bread')
+        self.order_id = self.place_order(self.customer, self.busy, {rice: 2}).data['id']
+
+    def test_joined_shops_with_counts_and_latest_order(self):
+        response = self.client_for(self.customer).get('/api/shops/home/')
+        self.assertEqual(response.status_code, 200)
+        busy, quiet = response.data
+        self.assertEqual((busy['name'], busy['product_count'], busy['in_stock_count']), ('Busy Store', 2, 0))
+        self.assertEqual((busy['latest_order']['id'], busy['latest_order']['status']), (self.order_id, 'PENDING'))
+        self.assertEqual((quiet['name'], quiet['product_count'], quiet['in_stock_count']), ('Quiet Store', 1, 1))
+        self.assertIsNone(quiet['latest_order'])
+
+    def test_customers_only(self):
+        self.assertEqual(self.client_for(self.busy.owner).get('/api/shops/home/').status_code, 403)
+
+
+class QueryBudgetTests(APITestCase):
+    """The budgeted shop views stay within their budgets across several shops"""
+
+    def setUp(self):
+        super().setUp()
+        self.shops = [
+            self.make_shop(f'90000000{index:02d}', customers=0, name=f'Shop {index}',
+                           latitude=19.07 + index / 100, longitude=72.87)
+            for index in range(3)
+        ]
+        self.customer = self.make_user('9100000000')
+        for shop in self.shops:
+            ShopCustomer.objects.create(shop=shop, customer=self.customer)
+        for shop in self.shops:
+            product = self.make_product(shop, 'Rice')
+            self.assertEqual(self.place_order(self.customer, shop, {product: 1}).status_code, 201)
+
+    def test_home_feed(self):
+        response = self.client_for(self.customer).get('/api/shops/home/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 3)
+        self.assertTrue(all(shop['latest_order'] for shop in response.data))
+
+    def test_nearby_shops(self):
+        response = self.client_for(self.customer).get('/api/shops/nearby/?lat=19.07&lng=72.87&limit=3')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([shop['name'] for shop in response.data['results']], ['Shop 0', 'Shop 1', 'Shop 2'])
+
+
+class CustomerDirectoryTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.shop = self.make_shop(customers=0)
+        for mobile_number, name in [('9123400003', 'Anil Kumar'), ('9876500001', 'Priya Sharma'),
+                                    ('9876500002', 'pradeep Rao')]:
+            ShopCustomer.objects.create(shop=self.shop, customer=self.make_user(mobile_number, name=name))
+        self.keeper = self.client_for(self.shop.owner)
+
+    def names(self, **params):
+        names, params = [], {'page_size': 1, **params}
+        url = '/api/shops/customers/'
+        while url:
+            response = self.keeper.get(url, params)
+            self.assertEqual(response.status_code, 200, response.data)
+            names += [row['customer']['name'] for row in response.data['results']]
+            url, params = response.data['next'], None
+        return names
+
+    def test_pages_newest_first_or_by_name(self):
+        self.assertEqual(self.names(), ['pradeep Rao', 'Priya Sharma', 'Anil Kumar'])
+        self.assertEqual(self.names(sort='name'), ['Anil Kumar', 'pradeep Rao', 'Priya Sharma'])
+
+    def test_prefix_search_by_name_or_number(self):
+        self.assertEqual(self.names(q='PR'), ['pradeep Rao', 'Priya Sharma'])
+        self.assertEqual(self.names(q='98765', sort='name'), ['pradeep Rao', 'Priya Sharma'])
+        self.assertEqual(self.names(q='Sharma'), [])
+        self.assertEqual(self.keeper.get('/api/shops/customers/', {'sort': 'mobile'}).status_code, 400)
+
+
+class BulkCustomerTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.shop = self.make_shop(customers=2)
+        self.linked, self.other = self.shop.test_customers
+        self.new = self.make_user('9200000000')
+        self.keeper = self.client_for(self.shop.owner)
+
+    def test_add_reports_each_entry(self):
+        response = self.keeper.post('/api/shops/customers/bulk-add/', {
+            'mobile_numbers': [self.new.mobile_number, self.linked.mobile_number, '12345', '9300000000',
+                               self.shop.owner.mobile_number],
+            'user_ids': [self.new.pk],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['outcome'] for result in response.data['results']],
+                         ['added', 'already_linked', 'invalid', 'unknown', 'not_a_customer', 'duplicate'])
+        self.assertEqual(response.data['results'][-1]['duplicate_of'], {'mobile_number': self.new.mobile_number})
+        self.assertTrue(ShopCustomer.objects.filter(shop=self.shop, customer=self.new).exists())
+
+    def test_remove_reports_a_customer_listed_twice_once(self):
+        response = self.keeper.post('/api/shops/customers/bulk-remove/', {
+            'mobile_numbers': [self.linked.mobile_number, self.new.mobile_number],
+            'user_ids': [self.linked.pk],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], [
+            {'mobile_number': self.linked.mobile_number, 'outcome': 'removed'},
+            {'mobile_number': self.new.mobile_number, 'outcome': 'not_linked'},
+            {'user_id': self.linked.pk, 'outcome': 'duplicate', 'duplicate_of': {'mobile_number': self.linked.mobile_number}},
+        ])
+        self.assertEqual(response.data['summary'], {'removed': 1, 'not_linked': 1, 'duplicate': 1})
+        self.assertEqual(list(ShopCustomer.objects.filter(shop=self.shop).values_list('customer', flat=True)), [self.other.pk])
+
+    def test_removed_customer_loses_catalogue_access(self):
+        url = f'/api/products/shops/{self.shop.pk}/products/'
+        self.assertEqual(self.client_for(self.linked).get(url).status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.keeper.post('/api/shops/customers/bulk-remove/', {'user_ids': [self.linked.pk]}, format='json')
+        self.assertEqual(self.client_for(self.linked).get(url).status_code, 403)
+
+    def test_only_shopkeepers(self):
+        response = self.client_for(self.linked).post('/api/shops/customers/bulk-add/', {'user_ids': [1]}, format='json')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.keeper.post('/api/shops/customers/bulk-add/', {}, format='json').status_code, 400)
+
+
+class NearbyShopTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        # About 1.1, 3.3 and 22 km north of the customer
+        self.near, self.mid, self.far = [
+            self.make_shop(f'90000000{index:02d}', customers=0, name=name, latitude=19.07 + offset, longitude=72.87,
+                           delivery_radius_km=2)
+            for index, (name, offset) in enumerate([('Near', 0.01), ('Mid', 0.03), ('Far', 0.2)])
+        ]
+        self.make_shop('9000000099', customers=0, name='Unlocated')
+        self.client = self.client_for(self.make_user('9200000000'))
+
+    def nearby(self, **params):
+        response = self.client.get('/api/shops/nearby/', {'lat': 19.07, 'lng': 72.87, **params})
+        self.assertEqual(response.status_code, 200, response.data)
+        return [shop['name'] for shop in response.data['results']]
+
+    def test_geohash_and_distance(self):
+        self.assertEqual(geo.encode(57.64911, 10.40744), 'u4pruydqq')
+        self.assertAlmostEqual(geo.haversine_km(0, 0, 1, 0), 111.195, places=3)
+        self.near.refresh_from_db()
+        self.assertEqual(self.near.geohash, geo.encode(19.08, 72.87))
+
+    def test_within_a_radius_nearest_first(self):
+        self.assertEqual(self.nearby(radius_km=5), ['Near', 'Mid'])
+        self.assertEqual(self.nearby(radius_km=5, delivers='true'), ['Near'])
+        self.assertEqual(self.nearby(), ['Near', 'Mid', 'Far'])
+        self.assertEqual(self.nearby(limit=1), ['Near'])
+
+    def test_moved_shop_is_found_at_its_new_location(self):
+        self.far.latitude = 19.069
+        self.far.save(update_fields=['latitude'])
+        self.assertEqual(self.nearby(radius_km=1), ['Far'])
+        response = self.client.get('/api/shops/nearby/', {'lat': 19.07})
+        self.assertEqual(response.status_code, 400)
@@ -4,10 +4,15 @@ from . import views
 urlpatterns = [
     path('my-shop/', views.get_my_shop, name='get_my_shop'),
     path('my-shop/update/', views.update_my_shop, name='update_my_shop'),
+    path('my-shop/logo/', views.my_shop_logo, name='my_shop_logo'),
+    path('nearby/', views.nearby_shops, name='nearby_shops'),
     path('details/<str:shop_id>/', views.shop_detail, name='shop_detail'),
     path('join/<str:shop_id>/', views.join_shop, name='join_shop'),
     path('add-customer/', views.add_customer, name='add_customer'),
     path('customers/', views.shop_customers, name='shop_customers'),
+    path('customers/bulk-add/', views.bulk_add_customers, name='bulk_add_customers'),
+    path('customers/bulk-remove/', views.bulk_remove_customers, name='bulk_remove_customers'),
     path('customers/<int:user_id>/remove/', views.remove_customer, name='remove_customer'),
     path('my-joined-shops/', views.my_shops, name='my_shops'),
+    path('home/', views.home_feed, name='home_feed'),
 ]
\ No newline at end of file
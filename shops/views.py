@@ -2,9 +2,23 @@ from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, Lower
+from rest_framework import serializers
 from django.shortcuts import get_object_or_404
+from nearbasket.decorators import query_budget
+from nearbasket.images import InvalidImage, delete_images, generate_variants, store_original
+from nearbasket.pagination import KeysetPagination
 from .models import Shop, ShopCustomer
+from .customers import add_customers, remove_customers
+from .geo import bounding_box, covering_cells, haversine_km
 from .serializers import (
+    BulkCustomersSerializer,
+    HomeFeedShopSerializer,
+    NearbyShopSerializer,
+    NearbyShopsQuerySerializer,
     ShopSerializer, 
     ShopUpdateSerializer,
     ShopCustomerSerializer, 
@@ -12,6 +26,77 @@ from .serializers import (
     UserProfileSerializer
 )
 from users.models import User
+from products.models import Product
+from orders.models import Order
+
+CUSTOMER_SORT_ORDERINGS = {
+    'newest': ('-joined_at', '-id'),
+    'name': ('name_key', 'id'),
+}
+
+# Nearest-shop searches without a radius start this wide and double until enough shops are found
+NEARBY_START_RADIUS_KM = 1
+
+def prefix_filter(field, prefix):
+    """
+    Match ``field`` values starting with ``prefix`` as a range, which any
+    B-tree index on the field can answer on every backend (a LIKE prefix
+    needs special operator classes or collations to use one).
+    """
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return {f'{field}__gte': prefix, f'{field}__lt': upper}
+
+def filter_customers(shop_customers, request):
+    """
+    Apply the ``q`` and ``sort`` query parameters to a shop's customers.
+    ``q`` of digits matches the start of the mobile number, anything else
+    the start of the name, ignoring case. Returns the queryset and its
+    keyset ordering.
+    """
+    shop_customers = shop_customers.annotate(name_key=Lower('customer__name'))
+    
+    query = request.query_params.get('q', '').strip()
+    if query.isdigit():
+        shop_customers = shop_customers.filter(**prefix_filter('customer__mobile_number', query))
+    elif query:
+        query = query.lower()
+        # The range uses the lower(name) index; startswith keeps it exact under any collation
+        shop_customers = shop_customers.filter(**prefix_filter('name_key', query), name_key__startswith=query)
+    
+    sort = request.query_params.get('sort') or ('name' if query and not query.isdigit() else 'newest')
+    if sort not in CUSTOMER_SORT_ORDERINGS:
+        raise serializers.ValidationError({
+            'sort': f"Sort must be one of {', '.join(CUSTOMER_SORT_ORDERINGS)}"
+        })
+    return shop_customers, CUSTOMER_SORT_ORDERINGS[sort]
+
+def shops_within(latitude, longitude, radius_km, delivers=False):
+    """
+    Every located shop within ``radius_km`` of a point as ``[(distance_km, id)]``.
+
+    The database only reads the geohash cells covering the circle's bounding
+    box, through ``shop_geohash_idx``, and drops rows outside the box; exact
+    great-circle distances are then computed for what is left.
+    """
+    box = bounding_box(latitude, longitude, radius_km)
+    south, north, west, east = box
+    cells = Q()
+    for prefix in covering_cells(box):
+        cells |= Q(**prefix_filter('geohash', prefix)) if prefix else ~Q(geohash='')
+    shops = Shop.objects.filter(cells, latitude__range=(south, north))
+    if west <= east:
+        shops = shops.filter(longitude__range=(west, east))
+    else:
+        shops = shops.filter(Q(longitude__gte=west) | Q(longitude__lte=east))
+    
+    found = []
+    for pk, shop_latitude, shop_longitude, delivery_radius_km in shops.values_list(
+        'id', 'latitude', 'longitude', 'delivery_radius_km'
+    ):
+        distance = haversine_km(latitude, longitude, shop_latitude, shop_longitude)
+        if distance <= radius_km and (not delivers or distance <= delivery_radius_km):
+            found.append((distance, pk))
+    return found
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
@@ -20,7 +105,7 @@ def get_my_shop(request):
     if request.user.role == 'SHOPKEEPER':
         try:
             shop = request.user.shop
-            serializer = ShopSerializer(shop)
+            serializer = ShopSerializer(shop, context={'request': request})
             return Response(serializer.data)
         except Shop.DoesNotExist:
             return Response({
@@ -29,9 +114,10 @@ def get_my_shop(request):
     
     elif request.user.role == 'CUSTOMER':
         # Return shops the customer has joined
-        shop_customers = ShopCustomer.objects.filter(customer=request.user)
-        shops = [sc.shop for sc in shop_customers]
-        serializer = ShopSerializer(shops, many=True)
+        shops = ShopSerializer.setup_eager_loading(
+            Shop.objects.filter(shop_customers__customer=request.user), context={'request': request}
+        )
+        serializer = ShopSerializer(shops, many=True, context={'request': request})
         return Response(serializer.data)
     
     return Response({
@@ -60,14 +146,96 @@ def update_my_shop(request):
         return Response(ShopSerializer(shop).data)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+@api_view(['POST', 'DELETE'])
+@permission_classes([IsAuthenticated])
+def my_shop_logo(request):
+    """Upload or remove the shop logo; its thumbnails are rendered in the background"""
+    if request.user.role != 'SHOPKEEPER':
+        return Response({
+            'error': 'Only shopkeepers can change the shop logo'
+        }, status=status.HTTP_403_FORBIDDEN)
+    
+    try:
+        shop = request.user.shop
+    except Shop.DoesNotExist:
+        return Response({
+            'error': 'No shop found for this shopkeeper'
+        }, status=status.HTTP_404_NOT_FOUND)
+    
+    previous = shop.logo_files
+    files = {}
+    
+    if request.method == 'POST':
+        upload = request.FILES.get('logo')
+        if upload is None:
+            return Response({
+                'error': 'Send the logo as a "logo" file upload'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            files = store_original(upload, 'shops')
+        except InvalidImage as exc:
+            return Response({
+                'error': str(exc)
+            }, status=status.HTTP_400_BAD_REQUEST)
+    
+    with transaction.atomic():
+        shop.logo_files = files
+        shop.save(update_fields=['logo_files'])
+        transaction.on_commit(lambda: delete_images(previous), robust=True)
+        if files:
+            transaction.on_commit(
+                lambda: generate_variants(files, lambda variants: Shop.logo_variants_ready(shop.pk, variants)),
+                robust=True
+            )
+    
+    if request.method == 'DELETE':
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    return Response(ShopSerializer(shop, context={'request': request}).data, status=status.HTTP_202_ACCEPTED)
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def shop_detail(request, shop_id):
     """Get shop details by shop_id (for customers to view before joining)"""
-    shop = get_object_or_404(Shop, shop_id=shop_id)
-    serializer = ShopSerializer(shop)
+    shops = ShopSerializer.setup_eager_loading(Shop.objects, context={'request': request})
+    shop = get_object_or_404(shops, shop_id=shop_id)
+    serializer = ShopSerializer(shop, context={'request': request})
     return Response(serializer.data)
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@query_budget(8)
+def nearby_shops(request):
+    """Shops nearest a point, within ``radius_km`` or, without one, the nearest ``limit``"""
+    params = NearbyShopsQuerySerializer(data=request.query_params)
+    if not params.is_valid():
+        return Response(params.errors, status=status.HTTP_400_BAD_REQUEST)
+    latitude, longitude = params.validated_data['lat'], params.validated_data['lng']
+    limit = params.validated_data.get('limit', settings.NEARBY_SHOPS_MAX_RESULTS)
+    delivers = params.validated_data['delivers']
+    
+    radius_km = params.validated_data.get('radius_km')
+    if radius_km is not None:
+        found = shops_within(latitude, longitude, radius_km, delivers)
+    else:
+        # Every shop within a radius is found, so once there are enough the nearest are among them
+        radius_km = NEARBY_START_RADIUS_KM
+        while True:
+            found = shops_within(latitude, longitude, radius_km, delivers)
+            if len(found) >= limit or radius_km >= settings.NEARBY_SHOPS_MAX_RADIUS_KM:
+                break
+            radius_km = min(radius_km * 2, settings.NEARBY_SHOPS_MAX_RADIUS_KM)
+    
+    nearest = {pk: distance for distance, pk in sorted(found)[:limit]}
+    shops = NearbyShopSerializer.setup_eager_loading(
+        Shop.objects.filter(pk__in=nearest), context={'request': request}
+    )
+    shops = sorted(shops, key=lambda shop: (nearest[shop.pk], shop.pk))
+    for shop in shops:
+        shop.distance_km = nearest[shop.pk]
+    
+    serializer = NearbyShopSerializer(shops, many=True, context={'request': request})
+    return Response({'radius_km': radius_km, 'results': serializer.data})
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def join_shop(request, shop_id):
@@ -133,6 +301,40 @@ def add_customer(request):
     
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+def bulk_customer_change(request, change):
+    if request.user.role != 'SHOPKEEPER':
+        return Response({
+            'error': 'Only shopkeepers can manage shop customers'
+        }, status=status.HTTP_403_FORBIDDEN)
+    
+    try:
+        shop = request.user.shop
+    except Shop.DoesNotExist:
+        return Response({
+            'error': 'No shop found for this shopkeeper'
+        }, status=status.HTTP_404_NOT_FOUND)
+    
+    serializer = BulkCustomersSerializer(data=request.data)
+    if serializer.is_valid():
+        results = change(shop, **serializer.validated_data)
+        summary = {}
+        for result in results:
+            summary[result['outcome']] = summary.get(result['outcome'], 0) + 1
+        return Response({'summary': summary, 'results': results})
+    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def bulk_add_customers(request):
+    """Shopkeeper links many customers to their shop by mobile number or user id"""
+    return bulk_customer_change(request, add_customers)
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def bulk_remove_customers(request):
+    """Shopkeeper unlinks many customers from their shop by mobile number or user id"""
+    return bulk_customer_change(request, remove_customers)
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def shop_customers(request):
@@ -149,9 +351,12 @@ def shop_customers(request):
             'error': 'No shop found for this shopkeeper'
         }, status=status.HTTP_404_NOT_FOUND)
     
-    shop_customers = ShopCustomer.objects.filter(shop=shop)
-    serializer = ShopCustomerSerializer(shop_customers, many=True)
-    return Response(serializer.data)
+    shop_customers, ordering = filter_customers(ShopCustomer.objects.filter(shop=shop), request)
+    shop_customers = ShopCustomerSerializer.setup_eager_loading(shop_customers, context={'request': request})
+    paginator = KeysetPagination(ordering)
+    page = paginator.paginate_queryset(shop_customers, request)
+    serializer = ShopCustomerSerializer(page, many=True, context={'request': request})
+    return paginator.get_paginated_response(serializer.data)
 
 @api_view(['DELETE'])
 @permission_classes([IsAuthenticated])
@@ -189,7 +394,38 @@ def my_shops(request):
             'error': 'Only customers can view joined shops'
         }, status=status.HTTP_403_FORBIDDEN)
     
-    shop_customers = ShopCustomer.objects.filter(customer=request.user)
-    shops = [sc.shop for sc in shop_customers]
-    serializer = ShopSerializer(shops, many=True)
-    return Response(serializer.data)
\ No newline at end of file
+    shops = ShopSerializer.setup_eager_loading(
+        Shop.objects.filter(shop_customers__customer=request.user), context={'request': request}
+    )
+    serializer = ShopSerializer(shops, many=True, context={'request': request})
+    return Response(serializer.data)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@query_budget(1)
+def home_feed(request):
+    """Every joined shop with its product counts and the customer's latest order there, in one query"""
+    if request.user.role != 'CUSTOMER':
+        return Response({
+            'error': 'Only customers have a home feed'
+        }, status=status.HTTP_403_FORBIDDEN)
+    
+    def product_count(**filters):
+        products = Product.objects.filter(shop=OuterRef('pk'), **filters).order_by().values('shop')
+        return Coalesce(Subquery(products.annotate(count=Count('id')).values('count')), 0)
+    
+    latest_orders = Order.objects.filter(shop=OuterRef('pk'), customer=request.user).order_by('-created_at', '-id')
+    shops = HomeFeedShopSerializer.setup_eager_loading(
+        Shop.objects.filter(shop_customers__customer=request.user), context={'request': request}
+    ).annotate(
+        joined_at=F('shop_customers__joined_at'),
+        product_count=product_count(),
+        # Stock held for pending orders is not available to order
+        in_stock_count=product_count(stock__gt=F('reserved')),
+        latest_order_id=Subquery(latest_orders.values('id')[:1]),
+        latest_order_status=Subquery(latest_orders.values('status')[:1]),
+        latest_order_at=Subquery(latest_orders.values('created_at')[:1]),
+    ).order_by(F('latest_order_at').desc(nulls_last=True), '-joined_at')
+    
+    serializer = HomeFeedShopSerializer(shops, many=True, context={'request': request})
+    return Response(serializer.data)
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-17 21:33
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(django.db.models.functions.text.Lower('name'), name='user_name_lower_idx'),
+        ),
+    ]
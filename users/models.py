@@ -2,6 +2,7 @@ import re
 import uuid
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.db import models
+from django.db.models.functions import Lower
 from django.core.validators import RegexValidator
 from django.core.exceptions import ValidationError
 
@@ -56,6 +57,12 @@ class User(AbstractBaseUser, PermissionsMixin):
     USERNAME_FIELD = 'mobile_number'
     REQUIRED_FIELDS = ['name']
 
+    class Meta:
+        indexes = [
+            # Case-insensitive name prefix search in the shop customer directory
+            models.Index(Lower('name'), name='user_name_lower_idx'),
+        ]
+
     def clean(self):
         super().clean()
         if len(self.name) < 2:
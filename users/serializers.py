@@ -5,6 +5,7 @@ from django.contrib.auth import authenticate
 from django.core.exceptions import ValidationError
 from django.db import transaction
 from .models import User, OTP
+from nearbasket.serializers import DynamicFieldsMixin, EagerLoadingMixin
 
 class ShopInfoSerializer(serializers.Serializer):
     """Serializer for shop information during shopkeeper registration"""
@@ -73,8 +74,9 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
             
             return user
 
-class UserProfileSerializer(serializers.ModelSerializer):
+class UserProfileSerializer(DynamicFieldsMixin, EagerLoadingMixin, serializers.ModelSerializer):
     shop = serializers.SerializerMethodField()
+    related_fields = ['shop']
     
     class Meta:
         model = User